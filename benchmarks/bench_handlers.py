@@ -0,0 +1,338 @@
+# Offline throughput benchmark for the Firehose transform, the Kinesis
+# consumer and the brand report Lambda. Firehose- and Kinesis-shaped events
+# are built from the sample CSV (optionally scaled up with synthetic users)
+# and the handlers run against in-memory stand-ins for DynamoDB, SNS and S3
+# that count every API call. Reports records/sec, API calls per record and
+# peak traced memory, and with --output appends the run to a JSON results
+# file so changes can be compared. --latency-ms simulates the network round
+# trip, which is what the consumer's thread pool overlaps.
+#
+#   python benchmarks/bench_handlers.py [--scale N] [--batch-size N] [--format json|aggregated]
+#                                       [--output FILE]
+
+import argparse
+import base64
+import contextlib
+import csv
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import Decimal
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'layers', 'common', 'python'))
+
+# Configuration the handlers read at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update({
+    'TABLE_NAME': 'events',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:alerts',
+    'ALERT_TABLE_NAME': 'alert-cooldowns',
+    'ROLLUP_TABLE_NAME': 'brand-rollups',
+    'S3_BUCKET': 'data',
+    'LOG_SAMPLE_RATE': '0',
+})
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from record_format import aggregate  # noqa: E402
+
+BASE_TIME = datetime(2024, 4, 6, 20, 0, 0)
+
+
+class FakeTable:
+    def __init__(self, name, backend):
+        self.name = name
+        self.backend = backend
+
+    def query(self, **kwargs):
+        # Only the DDoS loader queries the events table; new users have no
+        # history in this benchmark
+        self.backend.call('dynamodb.Query')
+        return {'Items': []}
+
+    def put_item(self, **kwargs):
+        self.backend.call('dynamodb.PutItem')
+
+    def get_item(self, **kwargs):
+        # Sketches start empty in this benchmark
+        self.backend.call('dynamodb.GetItem')
+        return {}
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        self.backend.call('dynamodb.UpdateItem')
+        if ':count' not in ExpressionAttributeValues:
+            # Session funnel counters
+            return
+        counts = self.backend.rollups.setdefault((Key['brand'], Key['bucket']), [0, Decimal(0), 0])
+        counts[0] += ExpressionAttributeValues[':count']
+        counts[1] += ExpressionAttributeValues[':price']
+        counts[2] += ExpressionAttributeValues[':one']
+
+
+class FakeBackend:
+    # Stands in for the DynamoDB resource and the DynamoDB, SNS and S3 clients
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.items = {}
+        self.rollups = {}
+        self.objects = {}
+
+    def call(self, name):
+        # Calls may come from the processor's worker threads
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    # dynamodb resource
+    def Table(self, name):
+        return FakeTable(name, self)
+
+    def batch_write_item(self, RequestItems):
+        self.call('dynamodb.BatchWriteItem')
+        for requests in RequestItems.values():
+            for request in requests:
+                item = request['PutRequest']['Item']
+                self.items[(item['u'], item['t'])] = item
+        return {'UnprocessedItems': {}}
+
+    # dynamodb client, as used by the report over the rollup table
+    def query(self, ExpressionAttributeValues, **kwargs):
+        # The report's watermark and totals queries over the brand's
+        # all-time rollups
+        self.call('dynamodb.Query')
+        if ':prefix' in ExpressionAttributeValues:
+            # The report's sketch query; no sketches are stored here
+            return {'Items': []}
+        brand = ExpressionAttributeValues[':brand']['S']
+        return {'Items': [
+            {'brand': {'S': brand}, 'bucket': {'S': bucket}, 'event_count': {'N': str(count)},
+             'price_sum': {'N': str(price)}, 'rollup_version': {'N': str(version)}}
+            for (rollup_brand, bucket), (count, price, version) in self.rollups.items()
+            if rollup_brand == brand and bucket.startswith('all#')
+        ]}
+
+    # sns and s3 clients
+    def publish(self, **kwargs):
+        self.call('sns.Publish')
+
+    def put_object(self, Key, Body, **kwargs):
+        self.call('s3.PutObject')
+        self.objects[Key] = Body
+
+    def get_object(self, Key, **kwargs):
+        self.call('s3.GetObject')
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key].encode('utf-8'))}
+
+    def client(self, service_name, *args, **kwargs):
+        return self
+
+    def resource(self, service_name, *args, **kwargs):
+        return self
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_rows(scale, events_per_second):
+    with open(os.path.join(ROOT, 'term_assignment', '2019-Nov-sample.csv'), newline='') as f:
+        sample = list(csv.DictReader(f))
+    # Each copy of the sample gets its own users, so scaling adds users
+    # rather than bursts that would trip the DDoS detector
+    rows = []
+    for copy in range(scale):
+        for row in sample:
+            row = dict(row, user_id=f"{row['user_id']}{copy:03d}" if copy else row['user_id'])
+            row['txn_timestamp'] = (BASE_TIME + timedelta(seconds=len(rows) / events_per_second)).isoformat()
+            rows.append(row)
+    return rows
+
+
+def build_payloads(rows, record_format, events_per_record):
+    if record_format == 'aggregated':
+        documents = [json.dumps(row, separators=(',', ':')).encode('utf-8') for row in rows]
+        payloads = [aggregate(documents[i:i + events_per_record]) for i in range(0, len(documents), events_per_record)]
+    else:
+        payloads = [json.dumps(row, indent=4).encode('utf-8') for row in rows]
+    return [base64.b64encode(payload).decode('utf-8') for payload in payloads]
+
+
+def firehose_events(payloads, batch_size):
+    # Firehose transformation events of batch_size records each
+    records = [{'recordId': str(index), 'data': data} for index, data in enumerate(payloads)]
+    return [{'records': records[i:i + batch_size]} for i in range(0, len(records), batch_size)]
+
+
+def kinesis_events(payloads, batch_size):
+    # Event source mapping batches of batch_size records each
+    records = [{'kinesis': {'sequenceNumber': str(index), 'data': data}} for index, data in enumerate(payloads)]
+    return [{'Records': records[i:i + batch_size]} for i in range(0, len(records), batch_size)]
+
+
+def load_consumer(backend):
+    consumer = load_module('consumer', os.path.join(ROOT, 'term_assignment', 'lambda', 'consumer.py'))
+    consumer.dynamodb = backend
+    consumer.dynamodb_writer = backend
+    consumer.table = backend.Table(os.environ['TABLE_NAME'])
+    consumer.rollup_table = backend.Table(os.environ['ROLLUP_TABLE_NAME'])
+    consumer.sns = backend
+    consumer.alert_aggregator.store.table = backend.Table(os.environ['ALERT_TABLE_NAME'])
+    return consumer
+
+
+def load_report_handler(backend):
+    module = load_module('report_handler', os.path.join(ROOT, 'term_assignment', 'lambda_report', 'report_handler.py'))
+    module.dynamodb = backend
+    module.s3 = backend
+    module.sns = backend
+    return module
+
+
+def run(name, invoke, invocations, records, events, backend, traced):
+    backend.calls.clear()
+    if traced:
+        tracemalloc.start()
+    started = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(invocations):
+            invoke()
+    seconds = perf_counter() - started
+    peak = None
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'handler': name,
+        'invocations': invocations,
+        'records': records,
+        'events': events,
+        'seconds': round(seconds, 4),
+        'records_per_sec': round(records / seconds) if seconds else None,
+        'events_per_sec': round(events / seconds) if seconds else None,
+        'api_calls': dict(sorted(backend.calls.items())),
+        'api_calls_per_record': round(sum(backend.calls.values()) / records, 4),
+        'peak_memory_kb': round(peak / 1024) if peak is not None else None,
+    }
+
+
+def measure(name, make_invoke, invocations, records, events, backend):
+    # The timed pass runs untraced; a second pass measures peak memory
+    result = run(name, make_invoke(), invocations, records, events, backend, traced=False)
+    traced = run(name, make_invoke(), invocations, records, events, backend, traced=True)
+    result['peak_memory_kb'] = traced['peak_memory_kb']
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=1, help='copies of the sample CSV, each with its own users')
+    parser.add_argument('--batch-size', type=int, default=500, help='Firehose or Kinesis records per invocation')
+    parser.add_argument('--format', choices=('json', 'aggregated'), default='json')
+    parser.add_argument('--events-per-record', type=int, default=100, help='events per aggregated record')
+    parser.add_argument('--events-per-second', type=float, default=100.0, help='spacing of the txn_timestamps')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated round trip of every AWS call')
+    parser.add_argument('--brands', nargs='+', default=['apple', 'samsung'], help='brands of the report')
+    parser.add_argument('--output', help='JSON file the run is appended to, e.g. benchmarks/results/handlers.json')
+    args = parser.parse_args()
+
+    rows = load_rows(args.scale, args.events_per_second)
+    payloads = build_payloads(rows, args.format, args.events_per_record)
+    transform_batches = firehose_events(payloads, args.batch_size)
+    consumer_batches = kinesis_events(payloads, args.batch_size)
+
+    def processor_invoke():
+        processor = load_module('processor', os.path.join(ROOT, 'term_assignment', 'lambda', 'processor.py'))
+        batches = iter(transform_batches)
+        return lambda: processor.lambda_handler(next(batches), None)
+
+    def consumer_invoke():
+        # A fresh module per pass, so both passes start from a cold container
+        backend.items.clear()
+        backend.rollups = {}
+        consumer = load_consumer(backend)
+        batches = iter(consumer_batches)
+        return lambda: consumer.lambda_handler(next(batches), None)
+
+    backend = FakeBackend(args.latency_ms)
+    results = [
+        measure('processor', processor_invoke, len(transform_batches), len(payloads), len(rows), backend),
+        measure('consumer', consumer_invoke, len(consumer_batches), len(payloads), len(rows), backend),
+    ]
+    rollups = dict(backend.rollups)
+
+    # One multi-brand report run the way the state machine does: plan, one
+    # invocation per scan segment, merge; records and events count the
+    # report. The second run finds the first one's reports in the cache.
+    def report_invoke():
+        backend.rollups = dict(rollups)
+        backend.objects.clear()
+        handler = load_report_handler(backend).handler
+
+        def invoke():
+            plan = handler({'step': 'plan', 'request': {'brands': args.brands}}, None)
+            partials = [handler(segment, None) for segment in plan['segments']]
+            handler({'step': 'merge', 'plan': plan, 'partials': partials}, None)
+        return invoke
+
+    results.append(measure('report', report_invoke, 1, 1, 1, backend))
+
+    def cached_report_invoke():
+        invoke = report_invoke()
+        with contextlib.redirect_stdout(io.StringIO()):
+            invoke()
+        return invoke
+
+    results.append(measure('report_cached', cached_report_invoke, 1, 1, 1, backend))
+
+    run_summary = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'parameters': {'scale': args.scale, 'batch_size': args.batch_size, 'format': args.format,
+                       'events_per_record': args.events_per_record, 'events_per_second': args.events_per_second,
+                       'latency_ms': args.latency_ms, 'brands': args.brands,
+                       'events': len(rows)},
+        'results': results,
+    }
+    for result in results:
+        print(json.dumps(result))
+
+    # Runs accumulate so regressions show up between revisions
+    if args.output:
+        history = []
+        if os.path.exists(args.output):
+            with open(args.output) as f:
+                history = json.load(f)
+        history.append(run_summary)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(history, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Compares the size of the events table items before and after item_codec,
+# over the sample CSV. Sizes follow DynamoDB's item size rules (attribute
+# names count, strings are their UTF-8 length, binary its length, numbers
+# about one byte per two significant digits plus one) and are turned into
+# write units per item and table and brand-index storage, which add 100
+# bytes of overhead per item.
+#
+#   python benchmarks/bench_item_size.py [--scale N]
+
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'layers', 'common', 'python'))
+
+from boto3.dynamodb.types import Binary  # noqa: E402
+
+from item_codec import ATTRIBUTES, encode_item  # noqa: E402
+from record_format import build_item  # noqa: E402
+
+ITEM_OVERHEAD_BYTES = 100
+EXPIRES_AT = 1712500000
+
+
+def value_size(value):
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, (int, Decimal)):
+        digits = Decimal(value).normalize().as_tuple().digits
+        return math.ceil(len(digits) / 2) + 1
+    raise TypeError(f"Unsupported value {value!r}")
+
+
+def item_size(item):
+    return sum(len(name.encode('utf-8')) + value_size(value) for name, value in item.items())
+
+
+def load_items(scale):
+    with open(os.path.join(ROOT, 'term_assignment', '2019-Nov-sample.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+    items = []
+    for copy in range(scale):
+        for row in rows:
+            row = dict(row, txn_timestamp='2024-04-06T20:15:14.151884')
+            items.append(build_item(row))
+    return items
+
+
+def summarize(items, index_attributes):
+    sizes = [item_size(item) for item in items]
+    # Only items with a brand are in the brand index
+    index_sizes = [item_size({name: item[name] for name in index_attributes if name in item})
+                   for item in items if index_attributes[0] in item]
+    return {
+        'items': len(sizes),
+        'avg_item_bytes': round(sum(sizes) / len(sizes), 1),
+        'max_item_bytes': max(sizes),
+        'write_units_per_item': round(sum(math.ceil(size / 1024) for size in sizes) / len(sizes), 3),
+        'table_storage_bytes': sum(sizes) + ITEM_OVERHEAD_BYTES * len(sizes),
+        'index_storage_bytes': sum(index_sizes) + ITEM_OVERHEAD_BYTES * len(index_sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=1, help='copies of the sample CSV')
+    args = parser.parse_args()
+
+    items = load_items(args.scale)
+    # Brand index: its keys, the table keys and the projected attributes
+    before = summarize(items, ['brand', 'txn_timestamp', 'user_id', 'event_type', 'price'])
+    after = summarize(
+        [encode_item(item, EXPIRES_AT) for item in items],
+        [ATTRIBUTES[name] for name in ('brand', 'txn_timestamp', 'user_id', 'event_type', 'price')]
+    )
+    results = {
+        'before': before,
+        'after': after,
+        'item_bytes_saved_pct': round(100 * (1 - after['avg_item_bytes'] / before['avg_item_bytes']), 1),
+        'storage_saved_pct': round(100 * (1 - (after['table_storage_bytes'] + after['index_storage_bytes']) /
+                                          (before['table_storage_bytes'] + before['index_storage_bytes'])), 1),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Benchmarks the Parquet report engine against the DynamoDB scan path offline.
+# A local Parquet dataset shaped like the Firehose output is generated from
+# the sample CSV; the scan path is replayed from an in-memory fake client that
+# pages results the way DynamoDB does (1 MB pages of full items, stored in
+# the item_codec form the consumer writes).
+#
+#   python benchmarks/bench_parquet_report.py [--scale N] [--files N] [--brands apple samsung]
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'layers', 'common', 'python'))
+
+import pyarrow as pa  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+from boto3.dynamodb.types import TypeSerializer  # noqa: E402
+
+from brand_report import ATTRIBUTE_NAMES, scan_brand_totals  # noqa: E402
+from item_codec import ATTRIBUTES, encode_item  # noqa: E402
+from parquet_report import FooterCache, parquet_brand_totals  # noqa: E402
+from record_format import build_item  # noqa: E402
+
+SCAN_PAGE_BYTES = 1024 * 1024
+COLUMNS = ['event_time', 'event_type', 'product_id', 'category_id', 'category_code',
+           'brand', 'price', 'user_id', 'user_session', 'txn_timestamp']
+
+
+def load_rows(scale):
+    with open(os.path.join(ROOT, 'term_assignment', '2019-Nov-sample.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row['txn_timestamp'] = '2024-04-06T20:15:14.151884'
+    return rows * scale
+
+
+def write_dataset(rows, directory, files):
+    # Small row groups, like the many short Firehose buffers
+    per_file = -(-len(rows) // files)
+    for index in range(files):
+        chunk = rows[index * per_file:(index + 1) * per_file]
+        table = pa.table({name: [row[name] for row in chunk] for name in COLUMNS})
+        pq.write_table(table, os.path.join(directory, f'part-{index:05d}'), row_group_size=5000)
+
+
+class FakeDynamoDB:
+    # Serves a filtered scan segment in pages of about 1 MB of stored items
+    def __init__(self, rows):
+        serializer = TypeSerializer()
+        self.items = [
+            {name: serializer.serialize(value) for name, value in encode_item(build_item(row)).items()}
+            for row in rows
+        ]
+        self.item_bytes = len(json.dumps(self.items[0], default=bytes.hex))
+        self.brand = ATTRIBUTES['brand']
+        self.projected = list(ATTRIBUTE_NAMES.values())
+        self.pages = 0
+
+    def scan(self, Segment, TotalSegments, ExpressionAttributeValues, ExclusiveStartKey=None, **kwargs):
+        self.pages += 1
+        brand = ExpressionAttributeValues[':brand']['S']
+        segment = self.items[Segment::TotalSegments]
+        start = ExclusiveStartKey['offset'] if ExclusiveStartKey else 0
+        stop = start + SCAN_PAGE_BYTES // self.item_bytes
+        response = {'Items': [
+            {key: item[key] for key in self.projected if key in item}
+            for item in segment[start:stop] if item.get(self.brand, {}).get('S') == brand
+        ]}
+        if stop < len(segment):
+            response['LastEvaluatedKey'] = {'offset': stop}
+        return response
+
+
+def timed(function):
+    started = perf_counter()
+    result = function()
+    return result, perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=50)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--brands', nargs='+', default=['apple', 'samsung'])
+    args = parser.parse_args()
+
+    rows = load_rows(args.scale)
+    results = {'events': len(rows), 'brands': args.brands}
+
+    fake = FakeDynamoDB(rows)
+    scan_reports, seconds = timed(lambda: {brand: scan_brand_totals(fake, 'events', brand).report(brand)
+                                          for brand in args.brands})
+    results['dynamodb_scan'] = {'seconds': round(seconds, 3), 'scan_pages': fake.pages,
+                                'events_per_sec': round(len(rows) * len(args.brands) / seconds)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_dataset(rows, directory, args.files)
+        cache_path = os.path.join(directory, '.footer-cache')
+
+        for run in ('parquet_cold', 'parquet_warm'):
+            cache = FooterCache(cache_path)
+            totals, seconds = timed(lambda: parquet_brand_totals(directory, args.brands, cache=cache))
+            results[run] = {'seconds': round(seconds, 3), 'events_per_sec': round(len(rows) / seconds)}
+
+    parquet_reports = {brand: totals[brand].report(brand) for brand in args.brands}
+    for brand in args.brands:
+        assert parquet_reports[brand]['total_views'] == scan_reports[brand]['total_views']
+        assert parquet_reports[brand]['total_purchases'] == scan_reports[brand]['total_purchases']
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
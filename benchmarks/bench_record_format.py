@@ -0,0 +1,123 @@
+# Compares the one-event-per-record JSON wire format with aggregated records:
+# bytes per event, Kinesis records and PUT payload units on the producer side,
+# and de-aggregation/decoding throughput in the processor. Also reports the
+# bytes per event the processor hands back to Firehose before and after it
+# re-encodes events as minified, typed JSON lines.
+#
+#   python benchmarks/bench_record_format.py [csv_path]
+
+import base64
+import csv
+import importlib.util
+import json
+import math
+import os
+import sys
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'lambda'))
+
+from record_format import deaggregate, output_document  # noqa: E402
+
+# Kinesis bills PUTs in 25 KB payload units per record
+PUT_UNIT_BYTES = 25 * 1024
+
+
+def load_simulator():
+    spec = importlib.util.spec_from_file_location(
+        'stream_simulator', os.path.join(ROOT, 'term_assignment', 'stream-data-app-simulation.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_rows(path):
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row['txn_timestamp'] = '2024-04-06T20:15:14.151884'
+    return rows
+
+
+def encode_json(rows):
+    return [json.dumps(row, indent=4).encode('utf-8') for row in rows]
+
+
+def encode_aggregated(simulator, rows):
+    aggregator = simulator.RecordAggregator(simulator.aggregate_max_bytes, simulator.aggregate_max_events)
+    records = []
+    for row in rows:
+        record = aggregator.add(json.dumps(row, separators=(',', ':')).encode('utf-8'), row['category_id'])
+        if record is not None:
+            records.append(record[0])
+    record = aggregator.drain()
+    if record is not None:
+        records.append(record[0])
+    return records
+
+
+def decode(records):
+    # What the processor does for each Firehose record before touching AWS
+    events = 0
+    for record in records:
+        data = base64.b64decode(base64.b64encode(record))
+        for document in deaggregate(data):
+            json.loads(document)
+            events += 1
+    return events
+
+
+def measure(name, encode, rows, repeat=5):
+    started = perf_counter()
+    for _ in range(repeat):
+        records = encode(rows)
+    encode_seconds = (perf_counter() - started) / repeat
+
+    started = perf_counter()
+    for _ in range(repeat):
+        events = decode(records)
+    decode_seconds = (perf_counter() - started) / repeat
+
+    total_bytes = sum(len(record) for record in records)
+    put_units = sum(math.ceil(len(record) / PUT_UNIT_BYTES) for record in records)
+    return {
+        'format': name,
+        'events': events,
+        'kinesis_records': len(records),
+        'bytes_per_event': round(total_bytes / events, 1),
+        'put_units_per_1k_events': round(put_units * 1000 / events, 2),
+        'encode_events_per_sec': round(events / encode_seconds),
+        'decode_events_per_sec': round(events / decode_seconds),
+    }
+
+
+def measure_transform_output(rows):
+    # Before: the producer's pretty-printed record passed through unchanged
+    before = sum(len(json.dumps(row, indent=4).encode('utf-8')) for row in rows)
+    after = sum(len(output_document(row)) for row in rows)
+    return {
+        'transform_output': 'minified_typed',
+        'events': len(rows),
+        'bytes_per_event_before': round(before / len(rows), 1),
+        'bytes_per_event_after': round(after / len(rows), 1),
+        'bytes_saved_per_event': round((before - after) / len(rows), 1),
+    }
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, 'term_assignment', '2019-Nov-sample.csv')
+    simulator = load_simulator()
+    rows = load_rows(path)
+
+    results = [
+        measure('json', encode_json, rows),
+        measure('aggregated', lambda r: encode_aggregated(simulator, r), rows),
+    ]
+    results.append(measure_transform_output(rows))
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
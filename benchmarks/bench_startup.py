@@ -0,0 +1,177 @@
+# Cold start benchmark for the Lambda handlers. Every sample runs in a fresh
+# interpreter, like a new container, and measures the interpreter start, the
+# import of the handler module (the Lambda init phase) and the first and
+# second invocation. The processor is invoked on a Firehose event built from
+# the sample CSV; for the consumer and report handler the invocation part is
+# the creation of the boto3 clients they use (aws_clients), which is what the
+# first request pays before its first API call.
+#
+# Run it with the interpreter and on the architecture being considered (for
+# example inside the public Lambda base images, with --cpus set like the
+# memory size would) to choose the stack's lambda_runtime,
+# lambda_architecture and lambda_memory_size. With --output runs are
+# appended to a JSON results file together with the Python version and
+# machine.
+#
+#   python benchmarks/bench_startup.py [--samples N] [--handlers processor consumer report]
+#                                      [--output FILE]
+
+import argparse
+import base64
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HANDLERS = {
+    # name: (asset directory, module, services created on first use, as
+    # aws_clients function, service and optional retry settings name)
+    'processor': ('lambda', 'processor', []),
+    'consumer': ('lambda', 'consumer', [('resource', 'dynamodb'), ('resource', 'dynamodb', 'SINGLE_ATTEMPT'),
+                                        ('client', 'sns')]),
+    'report': ('lambda_report', 'report_handler', [('client', 'dynamodb'), ('client', 's3'), ('client', 'sns')]),
+}
+
+# Configuration the handlers read at import time; the credentials are never
+# used, nothing is sent to AWS
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'TABLE_NAME': 'events',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:alerts',
+    'ALERT_TABLE_NAME': 'alert-cooldowns',
+    'ROLLUP_TABLE_NAME': 'brand-rollups',
+    'S3_BUCKET': 'data',
+    'LOG_SAMPLE_RATE': '0',
+    'METRICS_NAMESPACE': 'Benchmark',
+}
+
+
+def firehose_event(records):
+    with open(os.path.join(ROOT, 'term_assignment', '2019-Nov-sample.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))[:records]
+    for row in rows:
+        row['txn_timestamp'] = '2024-04-06T20:15:14.151884'
+    return {'records': [
+        {'recordId': str(index), 'data': base64.b64encode(json.dumps(row).encode('utf-8')).decode('utf-8')}
+        for index, row in enumerate(rows)
+    ]}
+
+
+def child(name, records):
+    # One cold start, reported as a JSON line on stdout
+    import io
+    import contextlib
+    import resource
+
+    directory, module_name, services = HANDLERS[name]
+    sys.path.insert(0, os.path.join(ROOT, 'term_assignment', directory))
+    sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'layers', 'common', 'python'))
+
+    started = perf_counter()
+    module = __import__(module_name)
+    import_seconds = perf_counter() - started
+
+    import aws_clients
+
+    if name == 'processor':
+        event = firehose_event(records)
+
+        def invoke():
+            with contextlib.redirect_stdout(io.StringIO()):
+                module.lambda_handler(event, None)
+    else:
+        def invoke():
+            for kind, service, *retries in services:
+                getattr(aws_clients, kind)(service, *[getattr(aws_clients, name) for name in retries])
+
+    timings = []
+    for _ in range(2):
+        started = perf_counter()
+        invoke()
+        timings.append(perf_counter() - started)
+
+    print(json.dumps({
+        'import_ms': import_seconds * 1000,
+        'first_invocation_ms': timings[0] * 1000,
+        'second_invocation_ms': timings[1] * 1000,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+def sample(name, records):
+    started = perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name, '--records', str(records)],
+        env=dict(os.environ, **ENVIRONMENT), capture_output=True, text=True, check=True
+    ).stdout
+    wall_seconds = perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_ms'] = wall_seconds * 1000
+    return result
+
+
+def summarize(name, samples):
+    summary = {'handler': name, 'samples': len(samples)}
+    for field in ('process_ms', 'import_ms', 'first_invocation_ms', 'second_invocation_ms'):
+        values = [result[field] for result in samples]
+        summary[field] = {'median': round(statistics.median(values), 2), 'max': round(max(values), 2)}
+    summary['max_rss_kb'] = max(result['max_rss_kb'] for result in samples)
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=10, help='cold starts per handler')
+    parser.add_argument('--records', type=int, default=100, help='records of the processor invocation')
+    parser.add_argument('--handlers', nargs='+', choices=sorted(HANDLERS), default=sorted(HANDLERS))
+    parser.add_argument('--output', help='JSON file the run is appended to, e.g. benchmarks/results/startup.json')
+    parser.add_argument('--child', choices=sorted(HANDLERS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.records)
+        return
+
+    results = [summarize(name, [sample(name, args.records) for _ in range(args.samples)]) for name in args.handlers]
+    run_summary = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'parameters': {'samples': args.samples, 'records': args.records},
+        'results': results,
+    }
+    for result in results:
+        print(json.dumps(result))
+
+    # Runs accumulate so runtimes and architectures can be compared
+    if args.output:
+        history = []
+        if os.path.exists(args.output):
+            with open(args.output) as f:
+                history = json.load(f)
+        history.append(run_summary)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(history, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Predicts how the simulator's partition strategies spread a CSV over the
+# shards of a Kinesis stream, using the same MD5 hash key mapping as Kinesis
+# and shards that split the hash key space evenly. Load is the events per
+# shard; users is the distinct users per shard, which is what the user and
+# composite strategies spread, so heavy users still make the load uneven.
+#
+#   python benchmarks/shard_distribution.py [csv_path] [--shards N] [--speedup X]
+
+import argparse
+import csv
+import hashlib
+import importlib.util
+import os
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Per-shard write limit of a provisioned stream
+SHARD_RECORDS_PER_SEC = 1000
+
+
+def load_simulator():
+    spec = importlib.util.spec_from_file_location(
+        'stream_simulator', os.path.join(ROOT, 'term_assignment', 'stream-data-app-simulation.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def shard_for(partition_key, explicit_hash_key, shards, hash_key_space):
+    if explicit_hash_key is not None:
+        hash_key = int(explicit_hash_key)
+    else:
+        hash_key = int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+    return hash_key * shards // hash_key_space
+
+
+def distribution(simulator, rows, strategy, shards, speedup):
+    events = Counter()
+    users = {}
+    per_second = Counter()
+    for row in rows:
+        partition_key, explicit_hash_key = simulator.partition_route(row, strategy, shards)
+        shard = shard_for(partition_key, explicit_hash_key, shards, simulator.HASH_KEY_SPACE)
+        events[shard] += 1
+        users.setdefault(shard, set()).add(row['user_id'])
+        second = int(simulator.parse_event_time(row['event_time']) / speedup)
+        per_second[(shard, second)] += 1
+
+    peaks = Counter()
+    for (shard, _), count in per_second.items():
+        peaks[shard] = max(peaks[shard], count)
+    return [(shard, events[shard], len(users.get(shard, ())), peaks[shard]) for shard in range(shards)]
+
+
+def report(strategy, rows_by_shard, total):
+    counts = [count for _, count, _, _ in rows_by_shard]
+    users = [user_count for _, _, user_count, _ in rows_by_shard]
+    mean = total / len(counts)
+    print(f"{strategy}: max/mean load {max(counts) / mean:.2f}, "
+          f"max/mean users {max(users) / (sum(users) / len(users)):.2f}, idle shards {counts.count(0)}")
+    for shard, count, user_count, peak in rows_by_shard:
+        flag = '  THROTTLED' if peak > SHARD_RECORDS_PER_SEC else ''
+        print(f"  shard {shard:3d}: {count:8d} events ({count / total:6.1%}), {user_count:6d} users, "
+              f"peak {peak} records/sec{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csv_path', nargs='?', default=os.path.join(ROOT, 'term_assignment', '2019-Nov-sample.csv'))
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help='replay speed-up factor used for the peak records/sec estimate')
+    args = parser.parse_args()
+
+    simulator = load_simulator()
+    with open(args.csv_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    for strategy in simulator.PARTITION_STRATEGIES:
+        report(strategy, distribution(simulator, rows, strategy, args.shards, args.speedup), len(rows))
+
+
+if __name__ == '__main__':
+    main()
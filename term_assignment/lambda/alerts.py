@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+# Keep the SNS message well below the 256 KB publish limit
+MAX_USERS_IN_MESSAGE = 100
+
+
+class DynamoCooldownStore:
+    # Shares the alert cooldown between containers. Each claim is a
+    # conditional put, so only one container alerts for a user per cooldown,
+    # and the expires_at attribute lets DynamoDB TTL remove old entries.
+
+    def __init__(self, table):
+        self.table = table
+
+    def claim(self, user_id, now, until):
+        try:
+            self.table.put_item(
+                Item={'user_id': user_id, 'alerted_until': int(until), 'expires_at': int(until)},
+                ConditionExpression='attribute_not_exists(user_id) OR alerted_until <= :now',
+                ExpressionAttributeValues={':now': int(now)}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def release(self, user_id, until):
+        # Gives back a claim whose alert could not be sent; only removes it
+        # if no other container has claimed the user since
+        try:
+            self.table.delete_item(
+                Key={'user_id': user_id},
+                ConditionExpression='alerted_until = :until',
+                ExpressionAttributeValues={':until': int(until)}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+class AlertAggregator:
+    # Collects the users flagged while a batch is processed and sends a single
+    # summary per batch. A user who was alerted less than cooldown_seconds ago
+    # is left out. The cooldown is cached in the container (LRU, at most
+    # max_cached_users) and, when a store is given, shared through it. If a
+    # claim or the summary fails, the claims already made are released and
+    # every flagged user is kept for the next flush.
+
+    def __init__(self, cooldown_seconds=300, max_cached_users=50000, store=None, clock=time.time):
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cached_users = max_cached_users
+        self.store = store
+        self.clock = clock
+        self.cooldowns = OrderedDict()
+        self.pending = OrderedDict()
+
+    def flag(self, user_id):
+        self.pending[user_id] = self.pending.get(user_id, 0) + 1
+
+    def in_cooldown(self, user_id, now):
+        until = self.cooldowns.get(user_id)
+        if until is None:
+            return False
+        if until <= now:
+            del self.cooldowns[user_id]
+            return False
+        return True
+
+    def remember(self, user_id, until):
+        self.cooldowns[user_id] = until
+        self.cooldowns.move_to_end(user_id)
+        while len(self.cooldowns) > self.max_cached_users:
+            self.cooldowns.popitem(last=False)
+
+    def release(self, user_id, until):
+        if self.store is None:
+            return
+        try:
+            self.store.release(user_id, until)
+        except Exception as e:
+            # The claim then simply runs out with the cooldown
+            print(f"Failed to release alert claim for {user_id}: {e}")
+
+    def flush(self, publish):
+        # Returns {user_id: flagged event count} for the users alerted
+        pending, self.pending = self.pending, OrderedDict()
+        now = self.clock()
+        until = now + self.cooldown_seconds
+
+        alerted = OrderedDict()
+        try:
+            for user_id, count in pending.items():
+                if self.in_cooldown(user_id, now):
+                    continue
+                if self.store is not None and not self.store.claim(user_id, now, until):
+                    continue
+                alerted[user_id] = count
+            if alerted:
+                publish(summary_subject(alerted), summary_message(alerted))
+        except Exception:
+            # A claim or the publish failed: give back the claims made so far
+            # and keep every flagged user for the next flush
+            for user_id in alerted:
+                self.release(user_id, until)
+            for user_id, count in pending.items():
+                self.pending[user_id] = self.pending.get(user_id, 0) + count
+            raise
+        for user_id in alerted:
+            self.remember(user_id, until)
+        return alerted
+
+
+def summary_subject(alerted):
+    return f"DDoS Alert: {len(alerted)} user(s) flagged"
+
+
+def summary_message(alerted):
+    lines = [f"Potential DDoS detected for {len(alerted)} user(s):"]
+    for user_id, count in list(alerted.items())[:MAX_USERS_IN_MESSAGE]:
+        lines.append(f"  user {user_id}: {count} flagged event(s)")
+    if len(alerted) > MAX_USERS_IN_MESSAGE:
+        lines.append(f"  ... and {len(alerted) - MAX_USERS_IN_MESSAGE} more")
+    return '\n'.join(lines)
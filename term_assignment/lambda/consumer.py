@@ -0,0 +1,227 @@
+import json
+import base64
+from boto3.dynamodb.conditions import Key
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import InvalidOperation
+
+from dynamo_batch import batch_write_items
+from ddos_window import SlidingWindowDetector
+from alerts import AlertAggregator, DynamoCooldownStore
+from record_format import build_item, deaggregate
+from rollup import apply_rollups, merge_rollups
+from sessionizer import Sessionizer, apply_funnels, merge_funnels
+from sketches import build_sketches, store_sketches
+from metrics import Metrics, sample_log
+from time_budget import TimeBudget
+from aws_clients import SINGLE_ATTEMPT, client, lazy, resource
+from item_codec import ATTRIBUTES, KEY_NAMES, encode_item, encode_timestamp, encode_user_id, timestamp_seconds
+
+# Kinesis event-source consumer: stores the events in DynamoDB, maintains
+# the brand rollups and runs the DDoS check, independently of Firehose
+
+# DynamoDB and SNS clients, created on first use (see aws_clients)
+dynamodb = lazy(resource, 'dynamodb')
+sns = lazy(client, 'sns')
+# batch_write_items retries throttled and unprocessed items itself, so its
+# resource makes a single attempt per call
+dynamodb_writer = lazy(resource, 'dynamodb', SINGLE_ATTEMPT)
+
+# Use environment variables to configure the table name and SNS topic ARN
+table_name = os.environ['TABLE_NAME']
+sns_topic_arn = os.environ['SNS_TOPIC_ARN']
+
+table = lazy(lambda: dynamodb.Table(table_name))
+
+# Flag a user with more than DDOS_MAX_EVENTS events within DDOS_WINDOW_SECONDS.
+# The window is kept per container, so the stream must be partitioned by
+# user (see ddos_window and sessionizer)
+ddos_window_seconds = int(os.environ.get('DDOS_WINDOW_SECONDS', '20'))
+ddos_max_events = int(os.environ.get('DDOS_MAX_EVENTS', '4'))
+ddos_max_tracked_users = int(os.environ.get('DDOS_MAX_TRACKED_USERS', '50000'))
+
+# Alert a user at most once per ALERT_COOLDOWN_SECONDS, shared across
+# containers through ALERT_TABLE_NAME when it is configured
+alert_cooldown_seconds = int(os.environ.get('ALERT_COOLDOWN_SECONDS', '300'))
+alert_table_name = os.environ.get('ALERT_TABLE_NAME')
+
+# Per-brand, per-hour event counts and price sums read by the brand reports
+rollup_table_name = os.environ.get('ROLLUP_TABLE_NAME')
+rollup_table = lazy(lambda: dynamodb.Table(rollup_table_name)) if rollup_table_name else None
+
+# Sessions end after SESSION_TIMEOUT_SECONDS without events, and at most
+# SESSION_MAX_TRACKED are open at a time (see sessionizer)
+session_timeout_seconds = int(os.environ.get('SESSION_TIMEOUT_SECONDS', '1800'))
+session_max_tracked = int(os.environ.get('SESSION_MAX_TRACKED', '100000'))
+
+# Stored events expire EVENT_TTL_SECONDS after they arrive (item_codec)
+event_ttl_seconds = int(os.environ.get('EVENT_TTL_SECONDS', '604800'))
+
+# DynamoDB calls of a batch run on up to PROCESSOR_CONCURRENCY threads, and
+# no new work is started DEADLINE_MARGIN_MS before the Lambda timeout
+processor_concurrency = int(os.environ.get('PROCESSOR_CONCURRENCY', '8'))
+deadline_margin_ms = int(os.environ.get('DEADLINE_MARGIN_MS', '15000'))
+
+# Module level so the threads stay warm across invocations. The workers share
+# the boto3 resources above; their action calls keep no per-request state.
+executor = ThreadPoolExecutor(max_workers=processor_concurrency) if processor_concurrency > 1 else None
+
+def lambda_handler(event, context):
+    # Stage timings and counts go out as one EMF blob per invocation
+    metrics = Metrics()
+    try:
+        return consume_records(event, metrics, TimeBudget(context, deadline_margin_ms))
+    finally:
+        metrics.emit()
+
+def consume_records(event, metrics, budget):
+    # Returns the partial batch response of the event source mapping. Lambda
+    # checkpoints before the first reported sequence number and retries the
+    # batch from there, so only the records before the first failure are
+    # counted in the rollups and the DDoS window; the rest come back again.
+    sequence_numbers = []
+    items = []
+    stored = []
+    retry = set()
+    expires_at = int(time.time()) + event_ttl_seconds
+
+    metrics.count('Records', len(event['Records']))
+    with metrics.stage('Decode'):
+        for record in event['Records']:
+            sequence_number = record['kinesis']['sequenceNumber']
+            sequence_numbers.append(sequence_number)
+            if budget.expired():
+                # Out of time: hand the rest back instead of timing out
+                retry.add(sequence_number)
+                metrics.count('DeferredRecords')
+                continue
+            try:
+                # Decode from base64; an aggregated record carries many events
+                for document in deaggregate(base64.b64decode(record['kinesis']['data'])):
+                    payload = json.loads(document)
+                    sample_log(payload)
+                    item = build_item(payload)
+                    stored.append((sequence_number, encode_item(item, expires_at)))
+                    items.append((sequence_number, item))
+            except (ValueError, KeyError, InvalidOperation) as e:
+                # Retrying cannot fix a malformed record, so it is skipped
+                print(f"Skipping malformed record {sequence_number}: {e}")
+                metrics.count('MalformedRecords')
+    metrics.count('Events', len(items))
+
+    # Store the whole batch in DynamoDB with BatchWriteItem
+    with metrics.stage('DynamoWrite'):
+        retry.update(batch_write_items(
+            dynamodb_writer, table_name, stored,
+            key_names=KEY_NAMES,
+            on_retry=lambda count: metrics.count('DynamoWriteRetries', count),
+            executor=executor,
+            should_stop=budget.expired
+        ))
+
+    first_retry = next((index for index, number in enumerate(sequence_numbers) if number in retry), None)
+    done = set(sequence_numbers[:first_retry])
+    written = [item for sequence_number, item in items if sequence_number in done]
+
+    # Everything below runs after the events are stored. A failure there is
+    # counted and logged but does not fail the batch: the retry would apply
+    # the updates that did succeed a second time.
+
+    # Fold the stored events into the rollup table, once per key per batch
+    if rollup_table is not None:
+        with metrics.stage('Rollup'):
+            failed = side_update(metrics, 'rollups', lambda: apply_rollups(
+                rollup_table, merge_rollups(written), executor=executor))
+        metrics.count('RollupWriteFailures', len(failed or []))
+
+        # Funnel counters of the sessions that ended with this batch
+        with metrics.stage('Sessions'):
+            evicted = sessionizer.evicted
+            closed = side_update(metrics, 'sessionizer', lambda: sessionizer.observe_batch(written)) or []
+            failed = side_update(metrics, 'funnels', lambda: apply_funnels(
+                rollup_table, merge_funnels(closed), executor=executor))
+        metrics.count('FunnelWriteFailures', len(failed or []))
+        metrics.count('SessionsClosed', len(closed))
+        metrics.count('SessionsEvicted', sessionizer.evicted - evicted)
+
+        # Distinct users and sessions and top products per brand and day
+        with metrics.stage('Sketches'):
+            failed = side_update(metrics, 'sketches', lambda: store_sketches(
+                rollup_table, build_sketches(written), executor=executor, should_stop=budget.expired))
+        metrics.count('SketchWriteFailures', len(failed or []))
+
+    # Check for potential DDoS activity and send one summary for the batch
+    with metrics.stage('DdosCheck'):
+        side_update(metrics, 'DDoS check', lambda: check_for_ddos(written))
+    with metrics.stage('Sns'):
+        alerted = side_update(metrics, 'DDoS alert', lambda: alert_aggregator.flush(publish_alert))
+        metrics.count('UsersAlerted', len(alerted or {}))
+
+    if first_retry is None:
+        return {'batchItemFailures': []}
+    metrics.count('RetriedRecords', len(sequence_numbers) - first_retry)
+    return {'batchItemFailures': [{'itemIdentifier': sequence_numbers[first_retry]}]}
+
+def side_update(metrics, name, update):
+    # Returns the result of update(), or None when it raised
+    try:
+        return update()
+    except Exception as e:
+        print(f"Side update failed ({name}): {e}")
+        metrics.count('SideUpdateFailures')
+        return None
+
+def parse_timestamp(txn_timestamp):
+    # Epoch seconds through the stored form, so timestamps read back from
+    # the table compare equal to the ones of the batch
+    return timestamp_seconds(encode_timestamp(txn_timestamp))
+
+def load_recent_timestamps(user_id, before):
+    # Only called for users this container has not seen yet. The newest
+    # few events are enough, and the earliest event of the current batch
+    # (stored at `before`) is filtered out by the detector.
+    timestamp = ATTRIBUTES['txn_timestamp']
+    response = table.query(
+        KeyConditionExpression=Key(ATTRIBUTES['user_id']).eq(encode_user_id(user_id)) & Key(timestamp).between(
+            round((before - ddos_window_seconds) * 1000000), round(before * 1000000)
+        ),
+        ProjectionExpression=timestamp,
+        ScanIndexForward=False,
+        Limit=ddos_max_events + 2
+    )
+    return [timestamp_seconds(item[timestamp]) for item in response['Items']]
+
+# Module level so the window stays warm across invocations of this container
+ddos_detector = SlidingWindowDetector(
+    window_seconds=ddos_window_seconds,
+    max_events=ddos_max_events,
+    max_users=ddos_max_tracked_users,
+    loader=load_recent_timestamps
+)
+
+# Module level so open sessions carry over to the next batch
+sessionizer = Sessionizer(timeout_seconds=session_timeout_seconds, max_sessions=session_max_tracked)
+
+# Module level so cooldowns survive across invocations of this container
+alert_aggregator = AlertAggregator(
+    cooldown_seconds=alert_cooldown_seconds,
+    max_cached_users=ddos_max_tracked_users,
+    store=DynamoCooldownStore(lazy(lambda: dynamodb.Table(alert_table_name))) if alert_table_name else None
+)
+
+def check_for_ddos(items):
+    events = [(item['user_id'], parse_timestamp(item['txn_timestamp'])) for item in items]
+    flags = ddos_detector.observe_batch(events, executor=executor)
+
+    for (user_id, _), flagged in zip(events, flags):
+        if flagged:
+            alert_aggregator.flag(user_id)
+
+def publish_alert(subject, message):
+    print(message)
+    sns.publish(
+        TopicArn=sns_topic_arn,
+        Message=message,
+        Subject=subject
+    )
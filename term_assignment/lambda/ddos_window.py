@@ -0,0 +1,86 @@
+import bisect
+from collections import OrderedDict
+
+
+class SlidingWindowDetector:
+    # Keeps the most recent event timestamps (epoch seconds) of each user in
+    # memory. The state lives at module level in the handler, so it covers
+    # the whole batch and stays warm across invocations of the same container.
+    #
+    # A user is flagged when more than max_events events fall inside
+    # window_seconds. Only the newest max_events + 1 timestamps per user are
+    # ever needed for that, and at most max_users users are tracked, with the
+    # least recently seen user evicted first, which caps memory use.
+    #
+    # loader(user_id, before) is called once for a user the detector has not
+    # seen yet and should return that user's stored timestamps older than
+    # `before` and inside the window; without a loader unseen users start empty.
+    #
+    # The window is only complete when all of a user's events reach one
+    # container, i.e. when the stream is partitioned by user (the producer's
+    # 'user' or 'composite' strategy). Otherwise a warm container never sees
+    # the events other containers stored for a user it already tracks, and
+    # bursts spread over several shards go unnoticed.
+
+    def __init__(self, window_seconds=20, max_events=4, max_users=50000, loader=None):
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+        self.max_users = max_users
+        self.loader = loader
+        self.users = OrderedDict()
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def observe(self, user_id, timestamp):
+        # Record one event and return True if the user is over the threshold
+        if user_id not in self.users:
+            self.seed(user_id, timestamp)
+        timestamps = self.users[user_id]
+        self.users.move_to_end(user_id)
+
+        bisect.insort(timestamps, timestamp)
+        newest = timestamps[-1]
+        # Drop what can no longer be inside the window of a newer event
+        cutoff = bisect.bisect_left(timestamps, newest - self.window_seconds)
+        del timestamps[:max(cutoff, len(timestamps) - self.max_events - 1)]
+
+        in_window = len(timestamps) - bisect.bisect_left(timestamps, timestamp - self.window_seconds)
+        return in_window > self.max_events
+
+    def observe_batch(self, events, executor=None):
+        # events is a list of (user_id, timestamp); returns one flag per event.
+        # Unseen users are seeded from their earliest event in the batch so
+        # the loader never returns events that are part of this batch. With
+        # an executor the loader runs concurrently; the events themselves
+        # are always observed in order, so each user's order is kept.
+        earliest = {}
+        for user_id, timestamp in events:
+            if user_id not in self.users and timestamp < earliest.get(user_id, float('inf')):
+                earliest[user_id] = timestamp
+        users, befores = list(earliest), list(earliest.values())
+        histories = (executor.map if executor is not None else map)(self.load_history, users, befores)
+        for user_id, history in zip(users, histories):
+            self.track(user_id, history)
+
+        return [self.observe(user_id, timestamp) for user_id, timestamp in events]
+
+    def seed(self, user_id, before):
+        self.track(user_id, self.load_history(user_id, before))
+
+    def load_history(self, user_id, before):
+        if self.loader is None:
+            return []
+        return sorted(
+            ts for ts in self.loader(user_id, before)
+            if before - self.window_seconds <= ts < before
+        )[-(self.max_events + 1):]
+
+    def track(self, user_id, history):
+        self.users[user_id] = history
+        self.users.move_to_end(user_id)
+        while len(self.users) > self.max_users:
+            self.users.popitem(last=False)
@@ -0,0 +1,101 @@
+import random
+import time
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+# BatchWriteItem accepts at most 25 put requests per call
+BATCH_SIZE = 25
+# This is the only retry layer: the consumer passes a resource that makes one
+# attempt per call (aws_clients.SINGLE_ATTEMPT), so a chunk costs at most
+# MAX_ATTEMPTS requests
+MAX_ATTEMPTS = 6
+BASE_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 2.0
+
+# Errors worth retrying; anything else fails the chunk straight away
+RETRYABLE_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'InternalServerError',
+)
+
+
+def item_key(item, key_names):
+    return tuple(item[name] for name in key_names)
+
+
+def backoff_seconds(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt)))
+
+
+def batch_write_items(dynamodb, table_name, records, key_names=('user_id', 'txn_timestamp'), sleep=time.sleep,
+                      on_retry=None, executor=None, should_stop=None):
+    # records is a list of (record_id, item) pairs; returns the record ids
+    # whose item could not be written after all retries. on_retry, when
+    # given, is called with the number of items of every resent request.
+    # With an executor the chunks are written concurrently; once
+    # should_stop() returns True no new request is sent and the unwritten
+    # items are returned as failed.
+    pending = {}
+    owners = {}
+    for record_id, item in records:
+        # A single request may not contain the same key twice, so the last
+        # item for a key wins, exactly as consecutive put_item calls would
+        key = item_key(item, key_names)
+        pending[key] = item
+        owners.setdefault(key, []).append(record_id)
+
+    keys = list(pending)
+    chunks = [{key: pending[key] for key in keys[start:start + BATCH_SIZE]} for start in range(0, len(keys), BATCH_SIZE)]
+
+    def write(chunk):
+        return write_chunk(dynamodb, table_name, chunk, key_names, sleep, on_retry, should_stop)
+
+    failed_keys = set()
+    for failed in (executor.map(write, chunks) if executor is not None else map(write, chunks)):
+        failed_keys.update(failed)
+
+    return {record_id for key in failed_keys for record_id in owners[key]}
+
+
+def write_chunk(dynamodb, table_name, chunk, key_names, sleep=time.sleep, on_retry=None, should_stop=None):
+    attempt = 0
+    while chunk:
+        if should_stop is not None and should_stop():
+            print(f"Out of time, leaving {len(chunk)} items unwritten")
+            return set(chunk)
+        if attempt:
+            sleep(backoff_seconds(attempt))
+            if on_retry is not None:
+                on_retry(len(chunk))
+        attempt += 1
+
+        try:
+            response = dynamodb.batch_write_item(
+                RequestItems={table_name: [{'PutRequest': {'Item': item}} for item in chunk.values()]}
+            )
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code not in RETRYABLE_ERRORS or attempt >= MAX_ATTEMPTS:
+                print(f"BatchWriteItem failed for {len(chunk)} items: {code}")
+                return set(chunk)
+            continue
+        except (BotoConnectionError, HTTPClientError) as e:
+            # Timeouts and dropped connections; the puts are safe to resend
+            if attempt >= MAX_ATTEMPTS:
+                print(f"BatchWriteItem failed for {len(chunk)} items: {e}")
+                return set(chunk)
+            continue
+
+        # Only resend what DynamoDB reports as unprocessed
+        unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+        chunk = {
+            item_key(request['PutRequest']['Item'], key_names): request['PutRequest']['Item']
+            for request in unprocessed
+        }
+        if chunk and attempt >= MAX_ATTEMPTS:
+            print(f"Giving up on {len(chunk)} unprocessed items after {attempt} attempts")
+            return set(chunk)
+
+    return set()
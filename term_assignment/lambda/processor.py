@@ -1,78 +1,65 @@
 import json
 import base64
-import boto3
-from datetime import datetime, timedelta
-from boto3.dynamodb.conditions import Key
-import os
-from decimal import Decimal
+from decimal import InvalidOperation
 
-# Initialize DynamoDB and SNS clients
-dynamodb = boto3.resource('dynamodb')
-sns = boto3.client('sns')
+from record_format import build_item, deaggregate, hive_timestamp, output_document
+from metrics import Metrics, sample_log
 
-# Use environment variables to configure the table name and SNS topic ARN
-table_name = os.environ['TABLE_NAME']
-sns_topic_arn = os.environ['SNS_TOPIC_ARN']
-
-table = dynamodb.Table(table_name)
+# Firehose transformation only: every record is re-encoded for the Parquet
+# conversion and given its dynamic partitioning keys. DynamoDB ingestion and
+# DDoS detection run in the Kinesis consumer (consumer.py), so a slow table
+# never holds up delivery to S3.
 
 def lambda_handler(event, context):
-    output = []
+    # Stage timings and counts go out as one EMF blob per invocation
+    metrics = Metrics()
+    try:
+        return transform_records(event, metrics)
+    finally:
+        metrics.emit()
 
-    for record in event['records']:
-        # Decode from base64
-        decoded_data = base64.b64decode(record['data']).decode('utf-8')
-        payload = json.loads(decoded_data)
-        print(payload)
-
-        # Processing logic
-        process_record(payload)
+def transform_records(event, metrics):
+    output = []
+    events = 0
 
-        # Append the original record data to the output, unchanged
-        output_record = {
-            'recordId': record['recordId'],
-            'result': 'Ok',
-            'data': record['data']
-        }
-        output.append(output_record)
+    metrics.count('Records', len(event['records']))
+    with metrics.stage('Decode'):
+        for record in event['records']:
+            output_record = {'recordId': record['recordId'], 'result': 'Ok', 'data': record['data']}
+            try:
+                # Decode from base64; an aggregated record carries many events
+                items = []
+                for document in deaggregate(base64.b64decode(record['data'])):
+                    payload = json.loads(document)
+                    sample_log(payload)
+                    items.append(build_item(payload))
+                if items:
+                    # Firehose gets every event as a minified, typed JSON line
+                    output_data = b''.join(output_document(item) for item in items)
+                    output_record['data'] = base64.b64encode(output_data).decode('utf-8')
+                    output_record['metadata'] = {'partitionKeys': partition_keys(items)}
+                    events += len(items)
+                else:
+                    output_record['result'] = 'Dropped'
+            except (ValueError, KeyError, InvalidOperation) as e:
+                # A malformed record fails on its own instead of failing the
+                # batch, and keeps its original data for the error output
+                print(f"Failed to decode record {record['recordId']}: {e}")
+                output_record['result'] = 'ProcessingFailed'
+            if output_record['result'] != 'Ok':
+                metrics.count(f"{output_record['result']}Records")
+            output.append(output_record)
+    metrics.count('Events', events)
 
     return {'records': output}
 
-def process_record(payload):
-    # Store record in DynamoDB
-    item = {
-        'user_id': payload['user_id'],
-        'txn_timestamp': payload['txn_timestamp'],
-        'event_type': payload['event_type'],
-        'product_id': payload['product_id'],
-        'category_id': payload['category_id'],
-        'category_code': payload.get('category_code', ''),
-        'brand': payload.get('brand', ''),
-        'price': Decimal(str(payload.get('price', 0))),  
-        'user_session': payload['user_session'],
-        'event_time': payload['event_time']
+def partition_keys(items):
+    # dt/hour come from the ingestion time (UTC) of the record's first
+    # event; an aggregated record spanning several brands goes to brand=mixed
+    txn_timestamp = hive_timestamp(items[0]['txn_timestamp'])
+    brands = {item.get('brand') or 'unknown' for item in items}
+    return {
+        'dt': txn_timestamp[:10],
+        'hour': txn_timestamp[11:13],
+        'brand': brands.pop() if len(brands) == 1 else 'mixed'
     }
-    table.put_item(Item=item)
-
-    # Check for potential DDoS activity
-    check_for_ddos(payload['user_id'], payload['txn_timestamp'])
-
-def check_for_ddos(user_id, txn_timestamp):
-    # Convert the timestamp to a datetime object
-    txn_time = datetime.fromisoformat(txn_timestamp.rstrip('Z'))
-    time_threshold = txn_time - timedelta(seconds=20)
-
-    # Query DynamoDB for user actions within the last 20 seconds
-    response = table.query(
-        KeyConditionExpression=Key('user_id').eq(user_id) & Key('txn_timestamp').gte(time_threshold.isoformat())
-    )
-    print(response)
-
-    # Flag if more than 4 actions are detected
-    if response['Count'] > 4:
-        print(f"Potential DDoS detected for user {user_id}")
-        sns.publish(
-            TopicArn=sns_topic_arn,
-            Message=f"Potential DDoS detected for user {user_id}",
-            Subject="DDoS Alert"
-        )
@@ -0,0 +1,80 @@
+import gzip
+import json
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+
+# Aggregated records are gzip-compressed newline-delimited JSON, one compact
+# event per line, and are recognised by the gzip magic bytes. Anything else
+# is a single JSON event as sent by older producers.
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def is_aggregated(data):
+    return data[:2] == GZIP_MAGIC
+
+
+def deaggregate(data):
+    # Returns the JSON document of every event packed in a record; raises
+    # ValueError for a truncated or corrupt aggregated record
+    if is_aggregated(data):
+        try:
+            body = gzip.decompress(data)
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValueError(f"Corrupt aggregated record: {e}") from e
+        return [line for line in body.split(b'\n') if line.strip()]
+    return [data]
+
+
+def aggregate(documents, compresslevel=6):
+    return gzip.compress(b'\n'.join(documents), compresslevel=compresslevel)
+
+
+def build_item(payload):
+    # The DynamoDB item of one event; raises KeyError, ValueError or
+    # decimal.InvalidOperation for a malformed event
+    if not isinstance(payload, dict):
+        raise ValueError(f"Event is not a JSON object: {type(payload).__name__}")
+    item = {
+        'user_id': payload['user_id'],
+        'txn_timestamp': payload['txn_timestamp'],
+        'event_type': payload['event_type'],
+        'product_id': payload['product_id'],
+        'category_id': payload['category_id'],
+        'category_code': payload.get('category_code', ''),
+        'price': Decimal(str(payload.get('price', 0))),
+        'user_session': payload['user_session'],
+        'event_time': payload['event_time']
+    }
+    # brand is the brand-index key, which cannot be an empty string, so
+    # events without a brand are simply left out of the index
+    if payload.get('brand'):
+        item['brand'] = payload['brand']
+    return item
+
+
+# Firehose gets every event back as minified, newline-terminated JSON with
+# only the Glue schema columns, a numeric price and timestamps in the
+# 'yyyy-MM-dd HH:mm:ss[.f]' form the Hive JSON SerDe parses
+OUTPUT_FIELDS = (
+    'event_time', 'event_type', 'product_id', 'category_id', 'category_code',
+    'brand', 'price', 'user_id', 'user_session', 'txn_timestamp'
+)
+
+
+def hive_timestamp(value):
+    # '2019-11-01 00:00:00 UTC' and '2024-04-06T20:15:14.151884' are UTC;
+    # a timestamp with an offset is converted to UTC, as in item_codec
+    parsed = datetime.fromisoformat(value.replace(' UTC', '').rstrip('Z'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(sep=' ')
+
+
+def output_document(item):
+    # item is the DynamoDB item built from the event
+    document = {name: item.get(name, '') for name in OUTPUT_FIELDS}
+    document['price'] = float(item['price'])
+    document['event_time'] = hive_timestamp(item['event_time'])
+    document['txn_timestamp'] = hive_timestamp(item['txn_timestamp'])
+    return json.dumps(document, separators=(',', ':')).encode('utf-8') + b'\n'
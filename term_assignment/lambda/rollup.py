@@ -0,0 +1,51 @@
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+# Rollup items are keyed by brand and a bucket of '<hour>#<event_type>', e.g.
+# '2019-11-01T00#view', plus an all-time 'all#<event_type>' bucket per brand,
+# each holding an event_count and a price_sum. rollup_version counts the
+# updates of an item, so the sum over a brand's all-time items changes
+# whenever the brand gets new events and serves as its report watermark.
+ALL_TIME = 'all'
+
+
+def event_hour(event_time):
+    # '2019-11-01 00:12:44 UTC' -> '2019-11-01T00'
+    return event_time[:10] + 'T' + event_time[11:13]
+
+
+def merge_rollups(items):
+    # Merges a batch into {(brand, bucket): [event_count, price_sum]} so every
+    # key is updated once per batch however many events it covers
+    rollups = {}
+    for item in items:
+        brand = item.get('brand')
+        if not brand:
+            continue
+        price = item.get('price', Decimal(0))
+        for period in (event_hour(item['event_time']), ALL_TIME):
+            totals = rollups.setdefault((brand, f"{period}#{item['event_type']}"), [0, Decimal(0)])
+            totals[0] += 1
+            totals[1] += price
+    return rollups
+
+
+def apply_rollups(table, rollups, executor=None):
+    # One atomic ADD per key, issued concurrently when an executor is given;
+    # returns the keys that could not be updated
+    def update(entry):
+        (brand, bucket), (event_count, price_sum) = entry
+        try:
+            table.update_item(
+                Key={'brand': brand, 'bucket': bucket},
+                UpdateExpression='ADD event_count :count, price_sum :price, rollup_version :one',
+                ExpressionAttributeValues={':count': event_count, ':price': price_sum, ':one': 1}
+            )
+        except ClientError as e:
+            print(f"Failed to update rollup {brand}/{bucket}: {e}")
+            return (brand, bucket)
+        return None
+
+    entries = list(rollups.items())
+    results = executor.map(update, entries) if executor is not None else map(update, entries)
+    return [key for key in results if key is not None]
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from item_codec import encode_event_time
+from rollup import ALL_TIME, event_hour
+
+# Conversion funnel stages, reached in this order within a session
+FUNNEL = ('view', 'cart', 'purchase')
+
+# Funnel counters live in the rollup table next to the event counts, keyed by
+# brand and 'funnel#<hour>' (hour the session started) or 'funnel#all'
+FUNNEL_PREFIX = 'funnel'
+COUNTERS = ('sessions', 'viewed', 'carted', 'purchased', 'session_seconds', 'session_events')
+
+
+class Session:
+    __slots__ = ('brand', 'event_time', 'start', 'end', 'events', 'stage')
+
+    def __init__(self, brand, event_time, timestamp):
+        self.brand = brand
+        self.event_time = event_time
+        self.start = timestamp
+        self.end = timestamp
+        self.events = 0
+        self.stage = 0
+
+    def add(self, event_type, timestamp):
+        self.start = min(self.start, timestamp)
+        self.end = max(self.end, timestamp)
+        self.events += 1
+        if self.stage < len(FUNNEL) and event_type == FUNNEL[self.stage]:
+            self.stage += 1
+
+
+class Sessionizer:
+    # Groups events into sessions per (user_session, brand) and hands back
+    # every session once it is over: when no event arrived for
+    # timeout_seconds of event time, or when it has to make room. At most
+    # max_sessions sessions are open, each a fixed-size Session, with the
+    # least recently active one closed first, which caps memory use. The
+    # state lives at module level in the consumer, so a session spanning
+    # batches is followed across invocations of the same container.
+    #
+    # Sessions are only whole when all their events reach one container,
+    # i.e. when the stream is partitioned by user; otherwise each consumer
+    # counts its part as a session. Sessions still open when a container is
+    # recycled are lost.
+
+    def __init__(self, timeout_seconds=1800, max_sessions=100000):
+        self.timeout_seconds = timeout_seconds
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.watermark = None
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def observe(self, session_id, brand, event_type, event_time):
+        # Adds one event; returns the sessions this closed
+        timestamp = encode_event_time(event_time)
+        if not brand or isinstance(timestamp, str):
+            return []
+        closed = []
+        key = (session_id, brand)
+        session = self.sessions.get(key)
+        if session is not None and timestamp - session.end > self.timeout_seconds:
+            # Same session id after a long pause: a new session
+            closed.append(self.sessions.pop(key))
+            session = None
+        if session is None:
+            session = self.sessions[key] = Session(brand, event_time, timestamp)
+            while len(self.sessions) > self.max_sessions:
+                closed.append(self.sessions.popitem(last=False)[1])
+                self.evicted += 1
+        self.sessions.move_to_end(key)
+        session.add(event_type, timestamp)
+
+        if self.watermark is None or timestamp > self.watermark:
+            self.watermark = timestamp
+        return closed
+
+    def expire(self):
+        # Closes the sessions idle for timeout_seconds before the newest
+        # event seen; the least recently active come first
+        closed = []
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if self.watermark - session.end <= self.timeout_seconds:
+                break
+            closed.append(self.sessions.pop(key))
+        return closed
+
+    def observe_batch(self, items):
+        # items are event items (record_format.build_item)
+        closed = []
+        for item in items:
+            closed.extend(self.observe(item['user_session'], item.get('brand'), item['event_type'], item['event_time']))
+        closed.extend(self.expire())
+        return closed
+
+    def close_all(self):
+        closed = list(self.sessions.values())
+        self.sessions.clear()
+        return closed
+
+
+def merge_funnels(sessions):
+    # Merges closed sessions into {(brand, bucket): [sessions, viewed, carted,
+    # purchased, session_seconds, session_events]}
+    funnels = {}
+    for session in sessions:
+        counts = [1] + [int(session.stage > stage) for stage in range(len(FUNNEL))] + [
+            session.end - session.start, session.events
+        ]
+        for period in (event_hour(session.event_time), ALL_TIME):
+            totals = funnels.setdefault((session.brand, f'{FUNNEL_PREFIX}#{period}'), [0] * len(COUNTERS))
+            for index, count in enumerate(counts):
+                totals[index] += count
+    return funnels
+
+
+def apply_funnels(table, funnels, executor=None):
+    # One atomic ADD per key, like apply_rollups; returns the keys that
+    # could not be updated
+    def update(entry):
+        (brand, bucket), counts = entry
+        try:
+            table.update_item(
+                Key={'brand': brand, 'bucket': bucket},
+                UpdateExpression='ADD ' + ', '.join(f'{name} :{name}' for name in COUNTERS),
+                ExpressionAttributeValues={f':{name}': count for name, count in zip(COUNTERS, counts)}
+            )
+        except ClientError as e:
+            print(f"Failed to update funnel {brand}/{bucket}: {e}")
+            return (brand, bucket)
+        return None
+
+    entries = list(funnels.items())
+    results = executor.map(update, entries) if executor is not None else map(update, entries)
+    return [key for key in results if key is not None]
@@ -0,0 +1,16 @@
+import time
+
+
+class TimeBudget:
+    # Tracks how long an invocation may keep issuing work. The deadline is
+    # margin_ms before the Lambda timeout, leaving time to finish in-flight
+    # calls and return the results; without a context it never expires.
+
+    def __init__(self, context, margin_ms, clock=time.monotonic):
+        self.clock = clock
+        self.deadline = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            self.deadline = clock() + (context.get_remaining_time_in_millis() - margin_ms) / 1000
+
+    def expired(self):
+        return self.deadline is not None and self.clock() >= self.deadline
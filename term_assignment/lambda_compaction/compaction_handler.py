@@ -0,0 +1,10 @@
+import os
+
+from parquet_compaction import compact
+
+def handler(event, context):
+    # Merge the small Firehose files of every closed hour partition
+    summaries = compact(f"s3://{os.environ['S3_BUCKET']}/processed-data")
+    print({'compacted_directories': len(summaries), 'summaries': summaries})
+
+    return {'compacted': summaries}
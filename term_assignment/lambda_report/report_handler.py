@@ -0,0 +1,140 @@
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from aws_clients import client, lazy
+from brand_report import BrandTotals, brand_index_name, rollup_totals, scan_brands_segment, scan_segments
+from metrics import Metrics
+from report_cache import cache_key, index_watermark, load_report, rollup_watermark, store_report
+from sketches import load_brand_sketch
+
+# One report Lambda for any list of brands, run by the BrandStateMachine as
+# plan -> Map over segments -> merge. With the rollup table every segment is
+# one brand, read with a single Query of its all-time items; without it a
+# request for N brands costs a single parallel scan of the events, whose
+# time scales with the number of segments. Reports are cached per brand and
+# data watermark (see report_cache).
+
+# Clients are created on first use (see aws_clients)
+dynamodb = lazy(client, 'dynamodb')
+s3 = lazy(client, 's3')
+sns = lazy(client, 'sns')
+sns_topic_arn = os.environ['SNS_TOPIC_ARN']
+
+# With ROLLUP_TABLE_NAME set the brands' all-time rollup items are queried
+# instead of scanning the events
+rollup_table_name = os.environ.get('ROLLUP_TABLE_NAME')
+
+def handler(event, context):
+    step = event.get('step', 'plan')
+    metrics = Metrics(dimensions={'Step': step})
+    try:
+        with metrics.stage(step.capitalize()):
+            if step == 'plan':
+                return plan(event, metrics)
+            if step == 'segment':
+                return scan_segment(event, metrics)
+            if step == 'merge':
+                return merge(event, metrics)
+            raise ValueError(f"Unknown report step {step}")
+    finally:
+        metrics.emit()
+
+def watermark(brand):
+    # None when there is nothing cheap to tell whether the data moved: no
+    # rollups and no brand index, so reports are computed but not cached,
+    # like brand_report falls back to scanning
+    if rollup_table_name:
+        return rollup_watermark(dynamodb, rollup_table_name, brand)
+    if not brand_index_name:
+        return None
+    try:
+        return index_watermark(dynamodb, os.environ['TABLE_NAME'], brand_index_name, brand)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationException':
+            raise
+        print(f"Brand index {brand_index_name} unavailable, not caching reports: {e}")
+        return None
+
+def plan(event, metrics):
+    # The API request is {"brands": [...]} or the older {"brand": "apple"}
+    request = event.get('request', event)
+    brands = request.get('brands') or [request['brand']]
+    brands = list(dict.fromkeys(brand.lower() for brand in brands))
+    total_segments = int(request.get('segments', scan_segments))
+
+    # Brands whose data has not moved since their cached report are served
+    # from S3; only the others are scanned
+    cached, misses = {}, {}
+    for brand in brands:
+        brand_watermark = watermark(brand)
+        key = cache_key(brand, brand_watermark) if brand_watermark is not None else None
+        report = load_report(s3, os.environ['S3_BUCKET'], key) if key is not None else None
+        if report is None:
+            misses[brand] = key
+        else:
+            cached[brand] = report
+    metrics.count('CacheHits', len(cached))
+    metrics.count('CacheMisses', len(misses))
+
+    if rollup_table_name:
+        segments = [{'step': 'segment', 'brands': [brand]} for brand in misses]
+    else:
+        segments = [
+            {'step': 'segment', 'brands': list(misses), 'segment': segment, 'total_segments': total_segments}
+            for segment in range(total_segments)
+        ] if misses else []
+    return {'brands': brands, 'cached': cached, 'misses': misses, 'segments': segments}
+
+def scan_segment(event, metrics):
+    if rollup_table_name:
+        # Hourly, funnel and sketch items are never read
+        totals = {brand: rollup_totals(dynamodb, rollup_table_name, brand) for brand in event['brands']}
+    else:
+        totals = scan_brands_segment(
+            dynamodb,
+            os.environ['TABLE_NAME'],
+            event['brands'],
+            event['segment'],
+            event['total_segments']
+        )
+    metrics.count('Brands', len(totals))
+    return [brand_totals.report(brand) for brand, brand_totals in totals.items()]
+
+def merge(event, metrics):
+    # event['partials'] holds one list of partial reports per segment
+    plan = event['plan']
+    totals = {brand: BrandTotals() for brand in plan['misses']}
+    for partials in event['partials']:
+        for partial in partials:
+            totals[partial['brand']].merge(BrandTotals.from_report(partial))
+
+    fresh = {brand: brand_totals.report(brand) for brand, brand_totals in totals.items()}
+
+    # Distinct users and sessions and top products come from the sketches
+    # the consumer keeps next to the rollups
+    if rollup_table_name:
+        with metrics.stage('Sketches'):
+            for brand, report in fresh.items():
+                report.update(load_brand_sketch(dynamodb, rollup_table_name, brand).summary())
+
+    # Store the new reports under their watermark for the next request
+    with metrics.stage('S3Put'):
+        for brand, report in fresh.items():
+            if plan['misses'][brand] is not None:
+                store_report(s3, os.environ['S3_BUCKET'], plan['misses'][brand], report)
+
+    reports = [plan['cached'][brand] if brand in plan['cached'] else fresh[brand] for brand in plan['brands']]
+    print(reports)
+
+    # Synchronous API requests get the reports in the response instead
+    if event.get('notify', True):
+        with metrics.stage('Sns'):
+            sns.publish(
+                TopicArn=sns_topic_arn,
+                Message='\n'.join(f"Brand report for {report['brand']}-\n {json.dumps(report)}" for report in reports),
+                Subject=f"Clickstream Analysis for {', '.join(plan['brands'])}"[:100]
+            )
+
+    return {'reports': reports, 'cached': list(plan['cached'])}
@@ -0,0 +1,92 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# boto3 clients and resources shared by every handler of a container. They
+# are built on first use, so importing a handler resolves no credentials or
+# endpoints and a cold start only pays for the services it actually calls;
+# afterwards the warm container reuses them and their pooled connections.
+#
+#   sns = lazy(client, 'sns')
+#   table = lazy(lambda: resource('dynamodb').Table(table_name))
+#   writer = lazy(resource, 'dynamodb', SINGLE_ATTEMPT)
+
+# Keep-alive connections, a pool big enough for the handlers' thread pools,
+# and adaptive retries, which back off client-side once DynamoDB throttles
+config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32')),
+    connect_timeout=int(os.environ.get('AWS_CONNECT_TIMEOUT', '2')),
+    read_timeout=int(os.environ.get('AWS_READ_TIMEOUT', '10')),
+    retries={'mode': 'adaptive', 'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))}
+)
+
+# For callers that retry themselves (dynamo_batch): one attempt per call, so
+# the two retry loops do not multiply
+SINGLE_ATTEMPT = {'mode': 'standard', 'total_max_attempts': 1}
+
+_session = None
+_clients = {}
+_resources = {}
+# Sessions are not thread-safe, and the handlers' worker threads may ask for
+# a client at the same time
+_lock = threading.Lock()
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def _config(retries):
+    return config if retries is None else config.merge(Config(retries=retries))
+
+
+def client(service_name, retries=None):
+    # retries replaces the shared retry settings for this client
+    key = (service_name, None if retries is None else tuple(sorted(retries.items())))
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _get_session().client(service_name, config=_config(retries))
+        return _clients[key]
+
+
+def resource(service_name, retries=None):
+    key = (service_name, None if retries is None else tuple(sorted(retries.items())))
+    with _lock:
+        if key not in _resources:
+            _resources[key] = _get_session().resource(service_name, config=_config(retries))
+        return _resources[key]
+
+
+def reset():
+    # Drops every cached client, for tests and the startup benchmark
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources.clear()
+
+
+class lazy:
+    # Module-level stand-in for a client, resource or table: the object is
+    # built by factory(*args) on first attribute access and then reused
+    def __init__(self, factory, *args):
+        self._factory = factory
+        self._args = args
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory(*self._args)
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
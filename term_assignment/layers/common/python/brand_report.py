@@ -0,0 +1,190 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+from item_codec import ATTRIBUTES, decode_attributes
+
+# Parallel scan segments, and an optional GSI keyed on brand to query instead
+scan_segments = int(os.environ.get('REPORT_SCAN_SEGMENTS', '4'))
+brand_index_name = os.environ.get('BRAND_INDEX_NAME')
+
+# When set, reports read the processor's precomputed rollups instead
+rollup_table_name = os.environ.get('ROLLUP_TABLE_NAME')
+
+# Only the attributes a report needs are read
+PROJECTION = '#brand, #event_type, #price'
+ATTRIBUTE_NAMES = {'#brand': ATTRIBUTES['brand'], '#event_type': ATTRIBUTES['event_type'], '#price': ATTRIBUTES['price']}
+
+
+class BrandTotals:
+    # Running totals for one brand, updated page by page as items arrive
+    def __init__(self):
+        self.total_views = 0
+        self.total_purchases = 0
+        self.total_price = 0.0
+
+    def add_items(self, items):
+        # items are stored events in the low-level client format (item_codec)
+        for item in map(decode_attributes, items):
+            event_type = item.get('event_type')
+            if event_type == 'view':
+                self.total_views += 1
+            elif event_type == 'purchase':
+                self.total_purchases += 1
+                self.total_price += float(item.get('price', 0))
+
+    def add_rollup(self, event_type, event_count, price_sum):
+        if event_type == 'view':
+            self.total_views += event_count
+        elif event_type == 'purchase':
+            self.total_purchases += event_count
+            self.total_price += price_sum
+
+    def merge(self, other):
+        self.total_views += other.total_views
+        self.total_purchases += other.total_purchases
+        self.total_price += other.total_price
+        return self
+
+    def report(self, brand):
+        return {
+            'brand': brand,
+            'total_views': self.total_views,
+            'total_purchases': self.total_purchases,
+            'total_price': self.total_price
+        }
+
+    @classmethod
+    def from_report(cls, report):
+        # Partial totals travel between Step Functions states as reports
+        totals = cls()
+        totals.total_views = report['total_views']
+        totals.total_purchases = report['total_purchases']
+        totals.total_price = report['total_price']
+        return totals
+
+
+def paginate(call, **kwargs):
+    # Follows LastEvaluatedKey so results are not cut off at 1 MB
+    while True:
+        response = call(**kwargs)
+        yield response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def scan_segment(client, table_name, brand, segment, total_segments):
+    totals = BrandTotals()
+    for items in paginate(
+        client.scan,
+        TableName=table_name,
+        Segment=segment,
+        TotalSegments=total_segments,
+        FilterExpression='#brand = :brand',
+        ProjectionExpression=PROJECTION,
+        ExpressionAttributeNames=ATTRIBUTE_NAMES,
+        ExpressionAttributeValues={':brand': {'S': brand}}
+    ):
+        totals.add_items(items)
+    return totals
+
+
+def scan_brand_totals(client, table_name, brand, total_segments=None):
+    total_segments = total_segments or scan_segments
+    # boto3 clients are thread-safe, so the segments share one client
+    with ThreadPoolExecutor(max_workers=total_segments) as pool:
+        segments = pool.map(
+            lambda segment: scan_segment(client, table_name, brand, segment, total_segments),
+            range(total_segments)
+        )
+        totals = BrandTotals()
+        for segment_totals in segments:
+            totals.merge(segment_totals)
+    return totals
+
+
+def query_brand_totals(client, table_name, brand, index_name):
+    totals = BrandTotals()
+    for items in paginate(
+        client.query,
+        TableName=table_name,
+        IndexName=index_name,
+        KeyConditionExpression='#brand = :brand',
+        ProjectionExpression=PROJECTION,
+        ExpressionAttributeNames=ATTRIBUTE_NAMES,
+        ExpressionAttributeValues={':brand': {'S': brand}}
+    ):
+        totals.add_items(items)
+    return totals
+
+
+def rollup_totals(client, table_name, brand):
+    # Reads the brand's all-time rollup items, one per event type
+    totals = BrandTotals()
+    for items in paginate(
+        client.query,
+        TableName=table_name,
+        KeyConditionExpression='#brand = :brand AND begins_with(#bucket, :all_time)',
+        ExpressionAttributeNames={'#brand': 'brand', '#bucket': 'bucket'},
+        ExpressionAttributeValues={':brand': {'S': brand}, ':all_time': {'S': 'all#'}}
+    ):
+        for item in items:
+            totals.add_rollup(
+                item['bucket']['S'].split('#', 1)[1],
+                int(item['event_count']['N']),
+                float(item['price_sum']['N'])
+            )
+    return totals
+
+
+def brands_filter(brands):
+    # DynamoDB allows up to 100 operands in an IN condition
+    values = {f':brand{index}': {'S': brand} for index, brand in enumerate(brands)}
+    return f"#brand IN ({', '.join(values)})", values
+
+
+def scan_brands_segment(client, table_name, brands, segment, total_segments):
+    # One segment of a single scan of the events table that serves every
+    # requested brand; returns {brand: BrandTotals}. With a rollup table the
+    # reports query rollup_totals instead, which never reads more than the
+    # brand's all-time items.
+    expression, values = brands_filter(brands)
+    totals = {brand: BrandTotals() for brand in brands}
+    for items in paginate(
+        client.scan,
+        TableName=table_name,
+        Segment=segment,
+        TotalSegments=total_segments,
+        FilterExpression=expression,
+        ProjectionExpression=PROJECTION,
+        ExpressionAttributeNames=ATTRIBUTE_NAMES,
+        ExpressionAttributeValues=values
+    ):
+        for item in items:
+            totals[item[ATTRIBUTE_NAMES['#brand']]['S']].add_items([item])
+    return totals
+
+
+def brand_totals(table_name, brand, client=None, index_name=None, total_segments=None, rollup_table=None):
+    client = client or aws_clients.client('dynamodb')
+    rollup_table = rollup_table if rollup_table is not None else rollup_table_name
+    if rollup_table:
+        return rollup_totals(client, rollup_table, brand)
+
+    index_name = index_name if index_name is not None else brand_index_name
+    if index_name:
+        try:
+            return query_brand_totals(client, table_name, brand, index_name)
+        except ClientError as e:
+            # Fall back to scanning when the index does not exist (yet)
+            if e.response['Error']['Code'] != 'ValidationException':
+                raise
+            print(f"Brand index {index_name} unavailable, scanning instead: {e}")
+    return scan_brand_totals(client, table_name, brand, total_segments)
+
+
+def build_report(table_name, brand, client=None):
+    return brand_totals(table_name, brand, client=client).report(brand)
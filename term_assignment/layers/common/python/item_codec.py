@@ -0,0 +1,165 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary, TypeDeserializer
+
+# Stored form of the events table items. Attribute names are one or two
+# letters, the IDs, event type and timestamps are numbers, the session UUID
+# is 16 raw bytes and every item carries a TTL. Values that do not fit the
+# compact form (a non-numeric product ID, an unknown event type, ...) are
+# kept as strings, and decode_item accepts both. Only the key attributes
+# must be numeric, so an event whose user_id is not an integer is rejected.
+#
+#   user_id       u   N  partition key
+#   txn_timestamp t   N  sort key, microseconds since the epoch (UTC)
+#   event_type    e   N  index into EVENT_TYPES
+#   product_id    pi  N
+#   category_id   ci  N
+#   category_code cc  S  left out when empty
+#   brand         b   S  brand-index key, left out when empty
+#   price         p   N
+#   user_session  s   B  UUID bytes
+#   event_time    et  N  seconds since the epoch (UTC)
+#   expires_at    x   N  TTL, seconds since the epoch
+ATTRIBUTES = {
+    'user_id': 'u',
+    'txn_timestamp': 't',
+    'event_type': 'e',
+    'product_id': 'pi',
+    'category_id': 'ci',
+    'category_code': 'cc',
+    'brand': 'b',
+    'price': 'p',
+    'user_session': 's',
+    'event_time': 'et',
+}
+FIELDS = {name: field for field, name in ATTRIBUTES.items()}
+KEY_NAMES = (ATTRIBUTES['user_id'], ATTRIBUTES['txn_timestamp'])
+TTL_ATTRIBUTE = 'x'
+
+# Codes are stored, so new types are only ever appended
+EVENT_TYPES = ('view', 'cart', 'remove_from_cart', 'purchase')
+EVENT_TYPE_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+
+EPOCH = datetime(1970, 1, 1)
+EVENT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+
+_deserializer = TypeDeserializer()
+
+
+def encode_integer(value):
+    # '123' -> 123; anything that would not read back the same stays a string
+    value = str(value)
+    if value.isascii() and value.isdigit() and str(int(value)) == value:
+        return int(value)
+    return value
+
+
+def decode_integer(value):
+    return value if isinstance(value, str) else str(int(value))
+
+
+def encode_user_id(user_id):
+    user_id = encode_integer(user_id)
+    if isinstance(user_id, str):
+        raise ValueError(f"user_id {user_id!r} is not an integer")
+    return user_id
+
+
+def encode_timestamp(txn_timestamp):
+    # Naive ISO timestamps are UTC, as written by the producer
+    parsed = datetime.fromisoformat(txn_timestamp.rstrip('Z'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = parsed - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def decode_timestamp(value):
+    return (EPOCH + timedelta(microseconds=int(value))).isoformat()
+
+
+def timestamp_seconds(value):
+    # Stored txn timestamp -> epoch seconds, as used by the DDoS window
+    return int(value) / 1000000
+
+
+def encode_event_time(event_time):
+    # '2019-11-01 00:00:00 UTC'; fromisoformat is much faster than strptime
+    if len(event_time) != 23 or not event_time.endswith(' UTC'):
+        return event_time
+    try:
+        return int((datetime.fromisoformat(event_time[:19]) - EPOCH).total_seconds())
+    except ValueError:
+        return event_time
+
+
+def decode_event_time(value):
+    if isinstance(value, str):
+        return value
+    return (EPOCH + timedelta(seconds=int(value))).strftime(EVENT_TIME_FORMAT)
+
+
+def encode_session(user_session):
+    try:
+        parsed = uuid.UUID(user_session)
+    except (ValueError, AttributeError, TypeError):
+        return user_session
+    return Binary(parsed.bytes) if str(parsed) == user_session else user_session
+
+
+def decode_session(value):
+    if isinstance(value, str):
+        return value
+    return str(uuid.UUID(bytes=bytes(value.value if isinstance(value, Binary) else value)))
+
+
+def encode_item(item, expires_at=None):
+    # item is the event item built by record_format.build_item
+    stored = {
+        'u': encode_user_id(item['user_id']),
+        't': encode_timestamp(item['txn_timestamp']),
+        'e': EVENT_TYPE_CODES.get(item['event_type'], item['event_type']),
+        'pi': encode_integer(item['product_id']),
+        'ci': encode_integer(item['category_id']),
+        'p': Decimal(item['price']),
+        's': encode_session(item['user_session']),
+        'et': encode_event_time(item['event_time']),
+    }
+    if item.get('category_code'):
+        stored['cc'] = item['category_code']
+    if item.get('brand'):
+        stored['b'] = item['brand']
+    if expires_at is not None:
+        stored[TTL_ATTRIBUTE] = int(expires_at)
+    return stored
+
+
+def decode_event_type(value):
+    return value if isinstance(value, str) else EVENT_TYPES[int(value)]
+
+
+DECODERS = {
+    'u': decode_integer,
+    't': decode_timestamp,
+    'e': decode_event_type,
+    'pi': decode_integer,
+    'ci': decode_integer,
+    'cc': str,
+    'b': str,
+    'p': Decimal,
+    's': decode_session,
+    'et': decode_event_time,
+}
+
+
+def decode_item(stored):
+    # Stored item (as returned by a boto3 resource) -> event item; only the
+    # attributes present are decoded, so projected reads work too
+    return {FIELDS[name]: DECODERS[name](value) for name, value in stored.items() if name in DECODERS}
+
+
+def decode_attributes(attributes):
+    # Same for an item in the low-level client format, e.g. {'p': {'N': '1.5'}}
+    return decode_item({name: _deserializer.deserialize(value) for name, value in attributes.items()})
@@ -0,0 +1,66 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Metrics are written to the log as CloudWatch Embedded Metric Format, one
+# blob per invocation, so they cost no API calls and no per-record log lines
+namespace = os.environ.get('METRICS_NAMESPACE', 'TermAssignment')
+function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+# Fraction of per-record payloads that are still logged, e.g. 0.01
+log_sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+
+
+class Metrics:
+    # Stage timings and counters for one invocation
+    def __init__(self, dimensions=None, clock=time.perf_counter):
+        self.dimensions = dict({'FunctionName': function_name}, **(dimensions or {}))
+        self.clock = clock
+        self.timings = {}
+        self.counts = {}
+        # Counters may be bumped from worker threads
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        # Time spent in a stage accumulates if it runs more than once
+        started = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = (self.clock() - started) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def document(self, timestamp=None):
+        definitions = [{'Name': f'{name}Time', 'Unit': 'Milliseconds'} for name in self.timings]
+        definitions += [{'Name': name, 'Unit': 'Count'} for name in self.counts]
+        document = {
+            '_aws': {
+                'Timestamp': int((timestamp or time.time()) * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [sorted(self.dimensions)],
+                    'Metrics': definitions
+                }]
+            }
+        }
+        document.update(self.dimensions)
+        document.update({f'{name}Time': round(value, 3) for name, value in self.timings.items()})
+        document.update(self.counts)
+        return document
+
+    def emit(self, log=print):
+        log(json.dumps(self.document()))
+
+
+def sample_log(message, rate=None):
+    rate = log_sample_rate if rate is None else rate
+    if rate > 0 and random.random() < rate:
+        print(message)
@@ -0,0 +1,255 @@
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# pyarrow is only needed by the Parquet jobs, so a missing install is
+# reported when one runs rather than at import time
+try:
+    import pyarrow as pa
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Each compacted directory keeps a manifest listing the finished compaction
+# generations and the small files they replaced. Compacted files are named
+# compacted-<generation>-<n>.parquet and only count once their generation is
+# in the manifest, and replaced files stop counting as soon as the manifest
+# lists them, so a reader that applies the manifest never sees a row twice
+# while originals are being deleted or after a job dies half way.
+#
+# Readers that ignore the manifest, such as the Glue table Athena queries,
+# skip names starting with '_' or '.', so the swap never shows them both the
+# small files and the merged ones either: merged files are written under a
+# hidden staging name, the manifest lists their generation, the small files
+# are renamed to a hidden _replaced- name, and only then are the merged files
+# moved into place and the hidden small files deleted. In between such
+# readers can briefly miss the rows being swapped, never count them twice,
+# and a failed delete only leaves a hidden file behind. Every run finishes
+# the swaps the manifest lists and deletes staged and compacted files of
+# generations it does not list.
+MANIFEST_NAME = '_manifest.json'
+COMPACTED_PREFIX = 'compacted-'
+STAGING_PREFIX = '_' + COMPACTED_PREFIX
+REPLACED_PREFIX = '_replaced-'
+
+target_file_bytes = int(os.environ.get('COMPACTION_TARGET_BYTES', str(128 * 1024 * 1024)))
+row_group_rows = int(os.environ.get('COMPACTION_ROW_GROUP_ROWS', '131072'))
+# Hours are closed once Firehose can no longer deliver into them: buffering
+# interval plus the dynamic partitioning retry window, with some slack
+lookback_hours = int(os.environ.get('COMPACTION_LOOKBACK_HOURS', '48'))
+grace_minutes = int(os.environ.get('COMPACTION_GRACE_MINUTES', '15'))
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError('Parquet compaction needs pyarrow, e.g. pip install -r requirements-dev.txt')
+
+
+def resolve(source):
+    # source is a local directory or an s3://bucket/prefix URI
+    if '://' in source:
+        return pafs.FileSystem.from_uri(source)
+    return pafs.LocalFileSystem(), os.path.abspath(source)
+
+
+def read_manifest(fs, directory):
+    path = f'{directory}/{MANIFEST_NAME}'
+    if fs.get_file_info(path).type == pafs.FileType.NotFound:
+        return {'generations': [], 'replaced': []}
+    with fs.open_input_stream(path) as f:
+        return json.loads(f.read())
+
+
+def write_manifest(fs, directory, manifest):
+    # Written aside and moved into place so it switches over in one step
+    temporary = f'{directory}/.{MANIFEST_NAME}.{uuid.uuid4().hex}'
+    with fs.open_output_stream(temporary) as f:
+        f.write(json.dumps(manifest).encode('utf-8'))
+    fs.move(temporary, f'{directory}/{MANIFEST_NAME}')
+
+
+def generation_of(name):
+    # 'compacted-<generation>-<n>.parquet' -> generation, staged or not
+    return name.lstrip('_')[len(COMPACTED_PREFIX):].split('-')[0]
+
+
+def visible_files(infos, manifest):
+    # The data files of one directory that readers should read
+    generations = set(manifest['generations'])
+    replaced = set(manifest['replaced'])
+    files = []
+    for info in infos:
+        name = os.path.basename(info.path)
+        if name in replaced:
+            continue
+        if name.startswith(COMPACTED_PREFIX) and generation_of(name) not in generations:
+            continue
+        files.append(info)
+    return files
+
+
+def is_data_file(info):
+    # Firehose objects have no extension; skip hidden and marker files
+    return info.type == pafs.FileType.File and not os.path.basename(info.path).startswith(('_', '.'))
+
+
+def group_by_size(infos, target_bytes):
+    # Greedily packs files into groups of at most target_bytes
+    groups, group, size = [], [], 0
+    for info in sorted(infos, key=lambda i: i.path):
+        if group and size + info.size > target_bytes:
+            groups.append(group)
+            group, size = [], 0
+        group.append(info)
+        size += info.size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def merge_files(fs, paths, destination):
+    # Streams row groups from the inputs into one file, re-batched into row
+    # groups of about row_group_rows so memory stays bounded
+    writer, stream, pending, pending_rows = None, None, [], 0
+    try:
+        for path in paths:
+            with fs.open_input_file(path) as f:
+                parquet_file = pq.ParquetFile(f)
+                for index in range(parquet_file.num_row_groups):
+                    table = parquet_file.read_row_group(index)
+                    if writer is None:
+                        stream = fs.open_output_stream(destination)
+                        writer = pq.ParquetWriter(stream, table.schema)
+                    elif table.schema != writer.schema:
+                        table = table.cast(writer.schema)
+                    pending.append(table)
+                    pending_rows += table.num_rows
+                    if pending_rows >= row_group_rows:
+                        writer.write_table(pa.concat_tables(pending), row_group_size=row_group_rows)
+                        pending, pending_rows = [], 0
+        if pending:
+            writer.write_table(pa.concat_tables(pending), row_group_size=row_group_rows)
+    finally:
+        if writer is not None:
+            writer.close()
+        if stream is not None:
+            stream.close()
+
+
+def swap(fs, directory, replaced, outputs):
+    # Hides the replaced small files, then exposes the merged ones
+    for name in replaced:
+        fs.move(f'{directory}/{name}', f'{directory}/{REPLACED_PREFIX}{name}')
+    for name in outputs:
+        fs.move(f'{directory}/_{name}', f'{directory}/{name}')
+    delete_files(fs, directory, [f'{REPLACED_PREFIX}{name}' for name in replaced])
+
+
+def recover(fs, directory, names, manifest):
+    # Finishes or rolls back what earlier runs left behind; returns the
+    # names that no longer exist under that name
+    generations = set(manifest['generations'])
+    replaced = set(manifest['replaced'])
+    unhidden = sorted(name for name in names if name in replaced)
+    staged = sorted(name[1:] for name in names
+                    if name.startswith(STAGING_PREFIX) and generation_of(name) in generations)
+    hidden = sorted(name[len(REPLACED_PREFIX):] for name in names if name.startswith(REPLACED_PREFIX))
+    orphans = sorted(
+        name for name in names
+        if name.lstrip('_').startswith(COMPACTED_PREFIX) and generation_of(name) not in generations
+    )
+    if unhidden or staged or hidden:
+        # Died during a swap, or a delete failed
+        swap(fs, directory, unhidden, staged)
+        delete_files(fs, directory, [f'{REPLACED_PREFIX}{name}' for name in hidden])
+    if orphans:
+        print(f"Deleting {len(orphans)} uncommitted compacted files in {directory}")
+        delete_files(fs, directory, orphans)
+    return set(unhidden) | set(orphans)
+
+
+def compact_directory(fs, directory, infos, target_bytes=None):
+    # Merges the small data files of one partition directory; infos are the
+    # files of the directory. Returns a summary, or None when there is
+    # nothing worth merging
+    target_bytes = target_bytes or target_file_bytes
+    manifest = read_manifest(fs, directory)
+    gone = recover(fs, directory, [os.path.basename(info.path) for info in infos], manifest)
+    infos = [info for info in infos if is_data_file(info) and os.path.basename(info.path) not in gone]
+
+    small = [info for info in visible_files(infos, manifest) if info.size < target_bytes // 2]
+    groups = [group for group in group_by_size(small, target_bytes) if len(group) > 1]
+    if not groups:
+        return None
+
+    generation = uuid.uuid4().hex[:12]
+    outputs, replaced = [], []
+    for number, group in enumerate(groups):
+        name = f'{COMPACTED_PREFIX}{generation}-{number:05d}.parquet'
+        merge_files(fs, [info.path for info in group], f'{directory}/_{name}')
+        outputs.append(name)
+        replaced.extend(os.path.basename(info.path) for info in group)
+
+    # The commit: from here on manifest readers use the merged files only
+    manifest['generations'].append(generation)
+    manifest['replaced'].extend(replaced)
+    write_manifest(fs, directory, manifest)
+
+    swap(fs, directory, replaced, outputs)
+
+    return {
+        'directory': directory,
+        'input_files': len(replaced),
+        'output_files': len(outputs),
+        'input_bytes': sum(info.size for group in groups for info in group)
+    }
+
+
+def delete_files(fs, directory, names):
+    for name in names:
+        try:
+            fs.delete_file(f'{directory}/{name}')
+        except OSError as e:
+            # Hidden from every reader; the next run tries again
+            print(f"Failed to delete {directory}/{name}: {e}")
+
+
+def closed_hours(now, hours=None, grace=None):
+    hours = hours or lookback_hours
+    grace = grace if grace is not None else grace_minutes
+    # Every hour that ended at least `grace` minutes ago, newest first
+    latest_open = (now - timedelta(minutes=grace)).replace(minute=0, second=0, microsecond=0)
+    return [latest_open - timedelta(hours=offset) for offset in range(1, hours + 1)]
+
+
+def compact(source, now=None, hours=None, grace=None, target_bytes=None):
+    # Compacts every leaf directory of the closed dt=/hour= partitions
+    require_pyarrow()
+    fs, root = resolve(source)
+    root = root.rstrip('/')
+    now = now or datetime.now(timezone.utc)
+
+    summaries = []
+    for hour in closed_hours(now, hours, grace):
+        prefix = f'{root}/dt={hour:%Y-%m-%d}/hour={hour:%H}'
+        selector = pafs.FileSelector(prefix, recursive=True, allow_not_found=True)
+        directories = {}
+        for info in fs.get_file_info(selector):
+            # Hidden swap files too, so a directory left with only those recovers
+            if is_data_file(info) or (info.type == pafs.FileType.File and
+                                      os.path.basename(info.path).startswith((STAGING_PREFIX, REPLACED_PREFIX))):
+                directories.setdefault(os.path.dirname(info.path), []).append(info)
+        for directory, infos in sorted(directories.items()):
+            summary = compact_directory(fs, directory, infos, target_bytes)
+            if summary is not None:
+                summaries.append(summary)
+    return summaries
+
+
+if __name__ == '__main__':
+    # python parquet_compaction.py <dir or s3://bucket/processed-data>
+    for summary in compact(sys.argv[1]):
+        print(summary)
@@ -0,0 +1,189 @@
+import os
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from brand_report import BrandTotals
+from parquet_compaction import MANIFEST_NAME, is_data_file, read_manifest, resolve, visible_files
+
+# pyarrow is only needed by this engine, so a missing install is reported
+# when a report is requested rather than at import time
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Only these columns are read from the Parquet files Firehose writes
+COLUMNS = ['brand', 'event_type', 'price']
+REPORTED_EVENT_TYPES = ('view', 'purchase')
+
+# Aggregated records spanning several brands land in this brand partition
+MIXED_BRAND = 'mixed'
+
+read_parallelism = int(os.environ.get('PARQUET_READ_PARALLELISM', '8'))
+
+
+class FooterCache:
+    # Parsed Parquet footers keyed by file path and validated by size and
+    # modification time. Kept in memory across warm invocations and, when a
+    # path is given, pickled to disk between runs.
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.entries = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                print(f"Ignoring unreadable footer cache {path}: {e}")
+
+    def metadata(self, fs, info):
+        version = (info.size, info.mtime_ns)
+        entry = self.entries.get(info.path)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        with fs.open_input_file(info.path) as f:
+            metadata = pq.ParquetFile(f).metadata
+        self.entries[info.path] = (version, metadata)
+        self.dirty = True
+        return metadata
+
+    def save(self):
+        if self.path and self.dirty:
+            with open(self.path, 'wb') as f:
+                pickle.dump(self.entries, f)
+            self.dirty = False
+
+
+footer_cache = FooterCache(os.environ.get('PARQUET_FOOTER_CACHE'))
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError('The Parquet report engine needs pyarrow, e.g. pip install -r requirements-dev.txt')
+
+
+def partition_values(path):
+    # 'processed-data/dt=2024-04-06/hour=20/part' -> {'dt': '2024-04-06', 'hour': '20'}
+    return dict(part.split('=', 1) for part in path.split('/') if '=' in part)
+
+
+def date_range(start_date, end_date):
+    day, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    while day <= end:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def list_data_files(fs, root, brands=None, start_date=None, end_date=None):
+    # With a date range only the dt= partitions inside it are listed, and
+    # brand= partitions of other brands are skipped
+    if start_date and end_date:
+        roots = [f'{root}/dt={day}' for day in date_range(start_date, end_date)]
+    else:
+        roots = [root]
+
+    directories = {}
+    manifests = set()
+    for base in roots:
+        selector = pafs.FileSelector(base, recursive=True, allow_not_found=True)
+        for info in fs.get_file_info(selector):
+            directory = os.path.dirname(info.path)
+            if os.path.basename(info.path) == MANIFEST_NAME:
+                manifests.add(directory)
+            if not is_data_file(info):
+                continue
+            brand = partition_values(info.path).get('brand')
+            if brands is not None and brand is not None and brand not in brands and brand != MIXED_BRAND:
+                continue
+            directories.setdefault(directory, []).append(info)
+
+    # Compacted directories are read through their manifest; without one,
+    # compacted files of an unfinished generation are still hidden
+    files = []
+    for directory, infos in directories.items():
+        manifest = read_manifest(fs, directory) if directory in manifests else {'generations': [], 'replaced': []}
+        files.extend(visible_files(infos, manifest))
+    return files
+
+
+def row_group_may_match(metadata, index, columns, wanted):
+    # Row-group pruning on min/max statistics; without statistics the row
+    # group has to be read
+    row_group = metadata.row_group(index)
+    for name, values in wanted.items():
+        column = columns.get(name)
+        if column is None:
+            continue
+        statistics = row_group.column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        if not any(statistics.min <= value <= statistics.max for value in values):
+            return False
+    return True
+
+
+def aggregate_table(table, brands):
+    # Vectorized filter and group-by over the projected columns
+    mask = pc.and_(
+        pc.is_in(table['brand'], value_set=pa.array(brands)),
+        pc.is_in(table['event_type'], value_set=pa.array(REPORTED_EVENT_TYPES))
+    )
+    table = table.filter(mask)
+    price = table['price']
+    if pa.types.is_string(price.type) or pa.types.is_large_string(price.type):
+        # The Glue schema may still declare price as a string
+        price = pc.if_else(pc.equal(price, ''), pa.scalar(None, price.type), price)
+    table = pa.table({
+        'brand': table['brand'],
+        'event_type': table['event_type'],
+        'price': pc.cast(price, pa.float64())
+    })
+    return table.group_by(['brand', 'event_type']).aggregate([('price', 'sum'), ('event_type', 'count')]).to_pylist()
+
+
+def file_totals(fs, info, brands, cache):
+    metadata = cache.metadata(fs, info)
+    columns = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+    wanted = {'brand': brands, 'event_type': REPORTED_EVENT_TYPES}
+    row_groups = [i for i in range(metadata.num_row_groups) if row_group_may_match(metadata, i, columns, wanted)]
+
+    totals = {}
+    if not row_groups:
+        return totals
+    with fs.open_input_file(info.path) as f:
+        table = pq.ParquetFile(f, metadata=metadata).read_row_groups(row_groups, columns=COLUMNS)
+    for row in aggregate_table(table, brands):
+        totals.setdefault(row['brand'], BrandTotals()).add_rollup(
+            row['event_type'], row['event_type_count'], row['price_sum'] or 0.0
+        )
+    return totals
+
+
+def parquet_brand_totals(source, brands, cache=None, start_date=None, end_date=None):
+    # Returns {brand: BrandTotals} for every requested brand in one pass,
+    # optionally limited to the dt= partitions from start_date to end_date
+    require_pyarrow()
+    cache = cache or footer_cache
+    brands = list(brands)
+    fs, root = resolve(source)
+    files = list_data_files(fs, root.rstrip('/'), brands, start_date, end_date)
+
+    results = {brand: BrandTotals() for brand in brands}
+    with ThreadPoolExecutor(max_workers=read_parallelism) as pool:
+        for totals in pool.map(lambda info: file_totals(fs, info, brands, cache), files):
+            for brand, brand_totals in totals.items():
+                results[brand].merge(brand_totals)
+    cache.save()
+    return results
+
+
+if __name__ == '__main__':
+    # python parquet_report.py <dir or s3://bucket/prefix> <brand> [<brand> ...]
+    for brand, totals in parquet_brand_totals(sys.argv[1], sys.argv[2:]).items():
+        print(totals.report(brand))
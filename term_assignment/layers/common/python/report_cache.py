@@ -0,0 +1,66 @@
+import json
+
+from botocore.exceptions import ClientError
+
+from brand_report import paginate
+from item_codec import ATTRIBUTES
+
+# Brand reports are cached in S3 under the brand and a watermark of the data
+# they cover, reports/<brand>/<watermark>.json. While no new events arrive the
+# watermark stays the same and the stored report is served as is; old objects
+# are removed by the bucket's lifecycle rule on the prefix.
+REPORT_PREFIX = 'reports'
+EMPTY_WATERMARK = 'empty'
+
+
+def rollup_watermark(client, table_name, brand):
+    # Sum of the rollup_version counters of the brand's all-time items; it
+    # grows with every batch that adds events for the brand
+    version = 0
+    for items in paginate(
+        client.query,
+        TableName=table_name,
+        KeyConditionExpression='#brand = :brand AND begins_with(#bucket, :all_time)',
+        ProjectionExpression='rollup_version',
+        ExpressionAttributeNames={'#brand': 'brand', '#bucket': 'bucket'},
+        ExpressionAttributeValues={':brand': {'S': brand}, ':all_time': {'S': 'all#'}}
+    ):
+        version += sum(int(item.get('rollup_version', {}).get('N', 0)) for item in items)
+    return f'v{version}' if version else EMPTY_WATERMARK
+
+
+def index_watermark(client, table_name, index_name, brand):
+    # The latest ingested txn_timestamp of the brand (microseconds, see
+    # item_codec), from the brand index
+    response = client.query(
+        TableName=table_name,
+        IndexName=index_name,
+        KeyConditionExpression='#brand = :brand',
+        ProjectionExpression='#timestamp',
+        ExpressionAttributeNames={'#brand': ATTRIBUTES['brand'], '#timestamp': ATTRIBUTES['txn_timestamp']},
+        ExpressionAttributeValues={':brand': {'S': brand}},
+        ScanIndexForward=False,
+        Limit=1
+    )
+    if not response['Items']:
+        return EMPTY_WATERMARK
+    return 't' + response['Items'][0][ATTRIBUTES['txn_timestamp']]['N']
+
+
+def cache_key(brand, watermark):
+    return f'{REPORT_PREFIX}/{brand}/{watermark}.json'
+
+
+def load_report(s3, bucket, key):
+    # Returns the cached report, or None on a miss
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def store_report(s3, bucket, key, report):
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(report), ContentType='application/json')
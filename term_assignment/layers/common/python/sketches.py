@@ -0,0 +1,237 @@
+import hashlib
+import heapq
+import math
+import operator
+import random
+import struct
+import time
+import zlib
+from array import array
+
+from botocore.exceptions import ClientError
+
+from brand_report import paginate
+
+# Mergeable per-brand sketches: distinct users and sessions (HyperLogLog) and
+# the most viewed products (Count-Min sketch plus a small candidate list).
+# The consumer folds every batch into one sketch item per brand and event
+# day in the rollup table, keyed 'sketch#<yyyy-mm-dd>'; a report merges the
+# brand's days. Memory and item size are fixed whatever the traffic.
+#
+# Error bounds with the default sizes:
+#   HyperLogLog, 2^11 registers: standard error 1.04 / sqrt(2048) ~ 2.3% of
+#     the distinct count (small counts use linear counting and are near exact).
+#   Count-Min, width 512 x depth 4: an estimate never undercounts and is at
+#     most e / 512 ~ 0.53% of the brand's views too high, with probability
+#     1 - e^-4 ~ 98%. Top products are the TOP_K best estimates among the
+#     CANDIDATES products kept per sketch, so a product whose count is
+#     within that error of the K-th one may be swapped with it.
+SKETCH_PREFIX = 'sketch'
+HLL_PRECISION = 11
+CMS_WIDTH = 512
+CMS_DEPTH = 4
+TOP_K = 10
+CANDIDATES = 2 * TOP_K
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BBHBH')
+# Backoff between conflicting sketch writes
+BASE_BACKOFF_SECONDS = 0.02
+MAX_BACKOFF_SECONDS = 1.0
+
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        hashed = hash64(value)
+        index = hashed >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rank = rest_bits - (hashed & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return m * math.log(m / zeros)
+        return estimate
+
+
+class CountMinSketch:
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array('I', [0]) * (width * depth)
+
+    def cells(self, value):
+        # Row i uses h1 + i * h2 (Kirsch-Mitzenmacher double hashing)
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, value, count=1):
+        for cell in self.cells(value):
+            self.counts[cell] += count
+
+    def estimate(self, value):
+        return min(self.counts[cell] for cell in self.cells(value))
+
+    def merge(self, other):
+        self.counts = array('I', map(operator.add, self.counts, other.counts))
+        return self
+
+
+class BrandSketch:
+    def __init__(self, users=None, sessions=None, products=None, candidates=()):
+        self.users = users or HyperLogLog()
+        self.sessions = sessions or HyperLogLog()
+        self.products = products or CountMinSketch()
+        self.candidates = set(candidates)
+
+    def add(self, item):
+        # item is an event item (record_format.build_item)
+        self.users.add(item['user_id'])
+        self.sessions.add(item['user_session'])
+        if item['event_type'] == 'view':
+            self.products.add(item['product_id'])
+            self.candidates.add(item['product_id'])
+            if len(self.candidates) > 2 * CANDIDATES:
+                self.prune()
+
+    def prune(self):
+        # Keep the CANDIDATES products with the highest estimates (a heap
+        # selection, so pruning stays linear in the candidates)
+        self.candidates = set(heapq.nlargest(CANDIDATES, self.candidates, key=self.products.estimate))
+
+    def merge(self, other):
+        self.users.merge(other.users)
+        self.sessions.merge(other.sessions)
+        self.products.merge(other.products)
+        self.candidates |= other.candidates
+        self.prune()
+        return self
+
+    def top_products(self, k=TOP_K):
+        return [
+            {'product_id': product_id, 'views': self.products.estimate(product_id)}
+            for product_id in heapq.nlargest(k, sorted(self.candidates), key=self.products.estimate)
+        ]
+
+    def summary(self):
+        return {
+            'distinct_users': round(self.users.count()),
+            'distinct_sessions': round(self.sessions.count()),
+            'top_products': self.top_products()
+        }
+
+    def to_bytes(self):
+        self.prune()
+        body = b''.join([
+            HEADER.pack(FORMAT_VERSION, self.users.precision, self.products.width, self.products.depth,
+                        len(self.candidates)),
+            bytes(self.users.registers),
+            bytes(self.sessions.registers),
+            self.products.counts.tobytes(),
+            '\n'.join(sorted(self.candidates)).encode('utf-8'),
+        ])
+        # Registers and counters of a brand with little traffic are mostly
+        # zeros, so small brands take little space
+        return zlib.compress(body)
+
+    @classmethod
+    def from_bytes(cls, data):
+        body = zlib.decompress(data)
+        version, precision, width, depth, candidate_count = HEADER.unpack_from(body)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format {version}")
+        offset = HEADER.size
+        registers = 1 << precision
+        users = HyperLogLog(precision, body[offset:offset + registers])
+        sessions = HyperLogLog(precision, body[offset + registers:offset + 2 * registers])
+        offset += 2 * registers
+        counts = array('I')
+        counts.frombytes(body[offset:offset + 4 * width * depth])
+        candidates = body[offset + 4 * width * depth:].decode('utf-8').split('\n') if candidate_count else []
+        return cls(users, sessions, CountMinSketch(width, depth, counts), candidates)
+
+
+def build_sketches(items):
+    # One sketch per (brand, event day) of a batch; events without a brand
+    # are left out, like in the rollups
+    sketches = {}
+    for item in items:
+        if item.get('brand'):
+            sketches.setdefault((item['brand'], item['event_time'][:10]), BrandSketch()).add(item)
+    return sketches
+
+
+def store_sketch(table, brand, day, sketch, should_stop=None, sleep=time.sleep):
+    # Merges the batch's sketch into the stored one. Merging is a
+    # read-modify-write, so the put is conditional on the version read and
+    # retried when another consumer got there first. Every conflict means
+    # another write went through, so retries only stop once should_stop()
+    # returns True (the consumer's time budget). Returns False if it could
+    # not be stored.
+    key = {'brand': brand, 'bucket': f'{SKETCH_PREFIX}#{day}'}
+    attempt = 0
+    while True:
+        try:
+            stored = table.get_item(Key=key, ConsistentRead=True).get('Item')
+            version = int(stored['sketch_version']) if stored else 0
+            merged = BrandSketch.from_bytes(bytes(stored['sketch'].value)).merge(sketch) if stored else sketch
+            table.put_item(
+                Item=dict(key, sketch=merged.to_bytes(), sketch_version=version + 1),
+                ConditionExpression='attribute_not_exists(sketch_version) OR sketch_version = :version',
+                ExpressionAttributeValues={':version': version}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                print(f"Failed to store sketch {brand}/{day}: {e}")
+                return False
+        attempt += 1
+        if should_stop is not None and should_stop():
+            print(f"Out of time storing sketch {brand}/{day} after {attempt} conflicting writes")
+            return False
+        # Full jitter so competing consumers do not collide again
+        sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)))
+
+
+def store_sketches(table, sketches, executor=None, should_stop=None):
+    # Returns the (brand, day) keys that could not be stored
+    def store(entry):
+        (brand, day), sketch = entry
+        return None if store_sketch(table, brand, day, sketch, should_stop) else (brand, day)
+
+    entries = list(sketches.items())
+    results = executor.map(store, entries) if executor is not None else map(store, entries)
+    return [key for key in results if key is not None]
+
+
+def load_brand_sketch(client, table_name, brand):
+    # Merges every stored day of the brand; client is a low-level client
+    sketch = BrandSketch()
+    for items in paginate(
+        client.query,
+        TableName=table_name,
+        KeyConditionExpression='#brand = :brand AND begins_with(#bucket, :prefix)',
+        ProjectionExpression='sketch',
+        ExpressionAttributeNames={'#brand': 'brand', '#bucket': 'bucket'},
+        ExpressionAttributeValues={':brand': {'S': brand}, ':prefix': {'S': f'{SKETCH_PREFIX}#'}}
+    ):
+        for item in items:
+            sketch.merge(BrandSketch.from_bytes(item['sketch']['B']))
+    return sketch
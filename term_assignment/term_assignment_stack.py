@@ -15,21 +15,42 @@ from aws_cdk import (
     aws_kinesisfirehose as firehose,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
-    aws_apigateway as apigateway
+    aws_apigateway as apigateway,
+    aws_events as events,
+    aws_events_targets as targets,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_sqs as sqs,
+    aws_cloudwatch as cloudwatch
     
 )
 
 from constructs import Construct
 
+# AWS SDK for pandas publishes pyarrow as a public layer in every region
+AWS_SDK_PANDAS_LAYER_ARN = "arn:aws:lambda:{region}:336392948345:layer:AWSSDKPandas-Python38:13"
+
 class TermAssignmentStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, partition_by_brand: bool = False,
+                 report_retention_days: int = 30, sync_report_p99_ms: int = 3000,
+                 lambda_runtime: lambda_.Runtime = lambda_.Runtime.PYTHON_3_8,
+                 lambda_architecture: lambda_.Architecture = lambda_.Architecture.X86_64,
+                 lambda_memory_size: int = 256, event_retention_days: int = 7, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Create an S3 bucket
         self.data_bucket = s3.Bucket(
             self, "DataBucket-ecommerce-stream",
             removal_policy=RemovalPolicy.DESTROY,  # Automatically delete bucket on stack destruction (for testing purposes)
+            lifecycle_rules=[
+                # Cached brand reports are keyed by data watermark, so old
+                # ones are never read again
+                s3.LifecycleRule(
+                    id="ExpireBrandReports",
+                    prefix="reports/",
+                    expiration=Duration.days(report_retention_days)
+                )
+            ]
         )
 
         # Output the bucket name
@@ -109,26 +130,50 @@ chmod +x /home/ec2-user/stream-data-app-simulation.py
 export S3_BUCKET="{self.data_bucket.bucket_name}"
 export S3_KEY="2019-Nov-sample.csv"
 export KINESIS_STREAM_NAME="{self.kinesis_stream.stream_name}"
+export PRODUCER_MODE="single"
+export TARGET_RATE="1"
+# The consumer's DDoS window and sessions need each user on one shard
+export PARTITION_STRATEGY="user"
 
 echo "Running the Python script..."
 python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log 2>&1
 """
         instance.add_user_data(user_data_script)
 
+        # Events are stored in the compact form of item_codec: numeric user
+        # id and microsecond timestamp keys, short attribute names, and a TTL
+        # so they expire after event_retention_days (the DDoS check only
+        # looks back seconds; reports read the rollup table)
         self.user_activity_table = dynamodb.Table(
             self,
             "UserActivityTable",
             partition_key=dynamodb.Attribute(
-                name="user_id",
-                type=dynamodb.AttributeType.STRING
+                name="u",
+                type=dynamodb.AttributeType.NUMBER
             ),
             sort_key=dynamodb.Attribute(
-                name="txn_timestamp",
-                type=dynamodb.AttributeType.STRING
+                name="t",
+                type=dynamodb.AttributeType.NUMBER
             ),
+            time_to_live_attribute="x",
             removal_policy=RemovalPolicy.DESTROY  # Automatically delete the table when the stack is destroyed (use wisely)
         )
 
+        # Brand reports query this index instead of scanning the table
+        self.user_activity_table.add_global_secondary_index(
+            index_name="brand-index",
+            partition_key=dynamodb.Attribute(
+                name="b",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="t",
+                type=dynamodb.AttributeType.NUMBER
+            ),
+            projection_type=dynamodb.ProjectionType.INCLUDE,
+            non_key_attributes=["e", "p"]
+        )
+
         # Output the DynamoDB table name
         CfnOutput(
             self,
@@ -137,6 +182,35 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
             description="The name of the DynamoDB table for storing user activities."
         )
 
+        # Brand / event type counters kept up to date by the processor
+        self.brand_rollup_table = dynamodb.Table(
+            self,
+            "BrandRollupTable",
+            partition_key=dynamodb.Attribute(
+                name="brand",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="bucket",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
+        # Per-user DDoS alert cooldowns, shared between processor containers
+        self.alert_cooldown_table = dynamodb.Table(
+            self,
+            "AlertCooldownTable",
+            partition_key=dynamodb.Attribute(
+                name="user_id",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY
+        )
+
         # Create SNS topic for DDoS alerts
         self.alert_topic = sns.Topic(
             self,
@@ -157,23 +231,92 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
             description="The ARN of the SNS topic for DDoS alerts."
         )
 
+        # Runtime, architecture and memory of the stream and report Lambdas;
+        # benchmarks/bench_startup.py measures what they cost on a cold start.
+        # Compaction stays on x86 Python 3.8 for the pyarrow layer.
+        compatible_runtimes = [lambda_.Runtime.PYTHON_3_8]
+        if not lambda_runtime.runtime_equals(lambda_.Runtime.PYTHON_3_8):
+            compatible_runtimes.append(lambda_runtime)
+
+        # Modules shared by the processor, report and compaction Lambdas,
+        # including the lazily created, tuned boto3 clients (aws_clients)
+        common_layer = lambda_.LayerVersion(
+            self, 'CommonLayer',
+            code=lambda_.Code.from_asset('term_assignment/layers/common'),
+            compatible_runtimes=compatible_runtimes,
+            compatible_architectures=[lambda_.Architecture.X86_64, lambda_.Architecture.ARM_64]
+        )
+
+        # Firehose transformation: format and partition keys only, so it
+        # never waits on DynamoDB
         lambda_function = lambda_.Function(
             self,
             "DataStreamProcessor",
-            runtime=lambda_.Runtime.PYTHON_3_8,
+            runtime=lambda_runtime,
+            architecture=lambda_architecture,
             handler="processor.lambda_handler",
             code=lambda_.Code.from_asset("term_assignment/lambda"),
+            layers=[common_layer],
+            environment={
+                'LOG_SAMPLE_RATE': '0.01'
+            },
+            timeout=Duration.seconds(60), 
+            memory_size=lambda_memory_size  
+        )
+
+        # Kinesis consumer storing the events in DynamoDB and running the
+        # rollups and the DDoS check
+        stream_consumer = lambda_.Function(
+            self,
+            "StreamConsumer",
+            runtime=lambda_runtime,
+            architecture=lambda_architecture,
+            handler="consumer.lambda_handler",
+            code=lambda_.Code.from_asset("term_assignment/lambda"),
+            layers=[common_layer],
             environment={
                 'TABLE_NAME': self.user_activity_table.table_name,
-                'SNS_TOPIC_ARN': self.alert_topic.topic_arn
+                'SNS_TOPIC_ARN': self.alert_topic.topic_arn,
+                'DDOS_WINDOW_SECONDS': '20',
+                'DDOS_MAX_EVENTS': '4',
+                'ALERT_TABLE_NAME': self.alert_cooldown_table.table_name,
+                'ALERT_COOLDOWN_SECONDS': '300',
+                'ROLLUP_TABLE_NAME': self.brand_rollup_table.table_name,
+                'LOG_SAMPLE_RATE': '0.01',
+                'PROCESSOR_CONCURRENCY': '8',
+                'DEADLINE_MARGIN_MS': '15000',
+                'EVENT_TTL_SECONDS': str(event_retention_days * 86400),
+                'SESSION_TIMEOUT_SECONDS': '1800',
+                'SESSION_MAX_TRACKED': '100000'
             },
             timeout=Duration.seconds(300), 
-            memory_size=256  
+            memory_size=lambda_memory_size  
         )
 
-        # Grant permissions to Lambda function to access DynamoDB and SNS
-        self.user_activity_table.grant_read_write_data(lambda_function)
-        self.alert_topic.grant_publish(lambda_function)
+        # Grant permissions to the consumer to access DynamoDB and SNS
+        self.user_activity_table.grant_read_write_data(stream_consumer)
+        self.alert_cooldown_table.grant_read_write_data(stream_consumer)
+        self.brand_rollup_table.grant_read_write_data(stream_consumer)
+        self.alert_topic.grant_publish(stream_consumer)
+
+        # Batches that still fail after bisecting and retrying are recorded
+        # here (shard, sequence range) instead of blocking the shard
+        stream_consumer_failures = sqs.Queue(
+            self, "StreamConsumerFailures",
+            retention_period=Duration.days(14)
+        )
+        stream_consumer.add_event_source(lambda_event_sources.KinesisEventSource(
+            self.kinesis_stream,
+            starting_position=lambda_.StartingPosition.LATEST,
+            batch_size=500,
+            max_batching_window=Duration.seconds(5),
+            parallelization_factor=4,
+            bisect_batch_on_error=True,
+            retry_attempts=5,
+            max_record_age=Duration.hours(6),
+            report_batch_item_failures=True,
+            on_failure=lambda_event_sources.SqsDlq(stream_consumer_failures)
+        ))
 
      
         glue_database = glue.CfnDatabase(
@@ -185,6 +328,32 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
         )
     )
 
+        # Processed data is laid out as processed-data/dt=/hour=/[brand=/], with
+        # the keys emitted by the processor Lambda for Firehose dynamic
+        # partitioning and resolved by Glue partition projection, so readers
+        # only list and read the partitions they need. Glue does not allow a
+        # partition column named like a data column, so the brand= path
+        # segment is exposed as the brand_key column.
+        partition_paths = [("dt", "dt"), ("hour", "hour")] + ([("brand", "brand_key")] if partition_by_brand else [])
+        partition_names = [column for _, column in partition_paths]
+        partition_template = "".join(f"{key}=${{{column}}}/" for key, column in partition_paths)
+        partition_prefix = "".join(f"{key}=!{{partitionKeyFromLambda:{key}}}/" for key, _ in partition_paths)
+        projection_parameters = {
+            "projection.enabled": "true",
+            "projection.dt.type": "date",
+            "projection.dt.format": "yyyy-MM-dd",
+            "projection.dt.range": "2019-01-01,NOW",
+            "projection.dt.interval": "1",
+            "projection.dt.interval.unit": "DAYS",
+            "projection.hour.type": "integer",
+            "projection.hour.range": "0,23",
+            "projection.hour.digits": "2",
+            "storage.location.template": f"s3://{self.data_bucket.bucket_name}/processed-data/{partition_template}"
+        }
+        if partition_by_brand:
+            # Brands are open-ended, so queries have to name the brand
+            projection_parameters["projection.brand_key.type"] = "injected"
+
         # Define the Glue table using CfnTable
         glue_table = glue.CfnTable(
             self,
@@ -195,16 +364,16 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
                 name="my_glue_table",
                 storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
                     columns=[
-                        glue.CfnTable.ColumnProperty(name="event_time", type="string"),
+                        glue.CfnTable.ColumnProperty(name="event_time", type="timestamp"),
                         glue.CfnTable.ColumnProperty(name="event_type", type="string"),
                         glue.CfnTable.ColumnProperty(name="product_id", type="string"),
                         glue.CfnTable.ColumnProperty(name="category_id", type="string"),
                         glue.CfnTable.ColumnProperty(name="category_code", type="string"),
                         glue.CfnTable.ColumnProperty(name="brand", type="string"),
-                        glue.CfnTable.ColumnProperty(name="price", type="string"),  # Assuming as string; change if needed
+                        glue.CfnTable.ColumnProperty(name="price", type="double"),
                         glue.CfnTable.ColumnProperty(name="user_id", type="string"),
                         glue.CfnTable.ColumnProperty(name="user_session", type="string"),
-                        glue.CfnTable.ColumnProperty(name="txn_timestamp", type="string")
+                        glue.CfnTable.ColumnProperty(name="txn_timestamp", type="timestamp")
                     ],
                     location=f"s3://{self.data_bucket.bucket_name}/processed-data/",  # Specify the S3 location if needed
                     input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
@@ -213,6 +382,10 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
                         serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
                     )
                 ),
+                partition_keys=[
+                    glue.CfnTable.ColumnProperty(name=name, type="string") for name in partition_names
+                ],
+                parameters=projection_parameters,
                 table_type="EXTERNAL_TABLE"  # Specify based on your setup
             )
         )
@@ -250,8 +423,12 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
                     size_in_m_bs=64  # Buffer size, smaller due to Lambda payload limit and potential expansion
                 ),
                 compression_format="UNCOMPRESSED",
-                prefix='processed-data/',  # Data will be stored in the 'processed-data/' folder in the bucket
-                error_output_prefix='error-data/',
+                prefix=f'processed-data/{partition_prefix}',  # Data will be stored in partitions of the 'processed-data/' folder in the bucket
+                error_output_prefix='error-data/!{firehose:error-output-type}/',
+                dynamic_partitioning_configuration=firehose.CfnDeliveryStream.DynamicPartitioningConfigurationProperty(
+                    enabled=True,
+                    retry_options=firehose.CfnDeliveryStream.RetryOptionsProperty(duration_in_seconds=300)
+                ),
                 data_format_conversion_configuration=firehose.CfnDeliveryStream.DataFormatConversionConfigurationProperty(
                     schema_configuration=firehose.CfnDeliveryStream.SchemaConfigurationProperty(
                         role_arn=firehose_role.role_arn,
@@ -294,100 +471,90 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
         source_arn=firehose_stream.attr_arn
     )
         
-        lambda_apple = lambda_.Function(
-        self, 'LambdaApple',
-        runtime=lambda_.Runtime.PYTHON_3_8,
-        handler='lambda_apple.handler',
-        code=lambda_.Code.from_asset('term_assignment/lambda_apple'),  
-        environment={
-            'TABLE_NAME': self.user_activity_table.table_name,
-            'S3_BUCKET': self.data_bucket.bucket_name,
-            'SNS_TOPIC_ARN': self.alert_topic.topic_arn
-        },
-        timeout=Duration.seconds(300), 
-        memory_size=256
-    )
-        apple_policy = iam.PolicyStatement(
-        actions=[
-            "dynamodb:Scan",
-            "dynamodb:GetItem",
-            "dynamodb:Query",
-            "s3:PutObject",
-            "s3:GetObject",
-            "s3:ListBucket"
-        ],
-        resources=[
-            self.user_activity_table.table_arn,
-            self.data_bucket.bucket_arn,
-            f"{self.data_bucket.bucket_arn}/*"
-        ]
-    )
-
-        lambda_apple.add_to_role_policy(apple_policy)
-        self.alert_topic.grant_publish(lambda_apple)
+        pyarrow_layer = lambda_.LayerVersion.from_layer_version_arn(
+            self, 'AwsSdkPandasLayer',
+            AWS_SDK_PANDAS_LAYER_ARN.format(region=self.region)
+        )
 
-        lambda_samsung = lambda_.Function(
-            self, 'LambdaSamsung',
+        # Hourly job merging the small Firehose files of closed partitions
+        compaction_function = lambda_.Function(
+            self, 'ParquetCompaction',
             runtime=lambda_.Runtime.PYTHON_3_8,
-            handler='lambda_samsung.handler',
-            code=lambda_.Code.from_asset('term_assignment/lambda_samsung'),  
+            handler='compaction_handler.handler',
+            code=lambda_.Code.from_asset('term_assignment/lambda_compaction'),
+            layers=[common_layer, pyarrow_layer],
             environment={
-                'TABLE_NAME': self.user_activity_table.table_name,
                 'S3_BUCKET': self.data_bucket.bucket_name,
-                'SNS_TOPIC_ARN': self.alert_topic.topic_arn
+                'COMPACTION_TARGET_BYTES': str(128 * 1024 * 1024),
+                'COMPACTION_LOOKBACK_HOURS': '48',
+                'COMPACTION_GRACE_MINUTES': '15'
             },
-            timeout=Duration.seconds(300), 
-            memory_size=256 
-        )
-
-        samsung_policy = iam.PolicyStatement(
-        actions=[
-            "dynamodb:Scan",
-            "dynamodb:GetItem",
-            "dynamodb:Query",
-            "s3:PutObject",
-            "s3:GetObject",
-            "s3:ListBucket"
-        ],
-        resources=[
-            self.user_activity_table.table_arn,
-            self.data_bucket.bucket_arn,
-            f"{self.data_bucket.bucket_arn}/*"
-        ]
-    )
-
-        lambda_samsung.add_to_role_policy(samsung_policy)
-        self.alert_topic.grant_publish(lambda_samsung)
-
-        choice_state = sfn.Choice(self, "BrandChoice")
-
-        # Define the tasks for each brand processing
-        apple_task = tasks.LambdaInvoke(
-            self,
-            "AppleTask",
-            lambda_function=lambda_apple,
-            result_path="$.result"
+            timeout=Duration.minutes(15),
+            memory_size=2048
         )
+        self.data_bucket.grant_read_write(compaction_function, 'processed-data/*')
+        self.data_bucket.grant_delete(compaction_function, 'processed-data/*')
 
-        samsung_task = tasks.LambdaInvoke(
-            self,
-            "SamsungTask",
-            lambda_function=lambda_samsung,
-            result_path="$.result"
+        events.Rule(
+            self, 'ParquetCompactionSchedule',
+            schedule=events.Schedule.rate(Duration.hours(1)),
+            targets=[targets.LambdaFunction(compaction_function)]
         )
 
-        # Configure the routing based on the brand
-        choice_state.when(sfn.Condition.string_equals("$.brand", "apple"), apple_task)
-        choice_state.when(sfn.Condition.string_equals("$.brand", "samsung"), samsung_task)
+        # One report Lambda for any list of brands; the state machine runs
+        # it as plan -> parallel segments -> merge
+        report_function = lambda_.Function(
+            self, 'BrandReport',
+            runtime=lambda_runtime,
+            architecture=lambda_architecture,
+            handler='report_handler.handler',
+            code=lambda_.Code.from_asset('term_assignment/lambda_report'),
+            layers=[common_layer],
+            environment={
+                'TABLE_NAME': self.user_activity_table.table_name,
+                'S3_BUCKET': self.data_bucket.bucket_name,
+                'SNS_TOPIC_ARN': self.alert_topic.topic_arn,
+                'ROLLUP_TABLE_NAME': self.brand_rollup_table.table_name,
+                'BRAND_INDEX_NAME': 'brand-index',
+                'REPORT_SCAN_SEGMENTS': '16'
+            },
+            timeout=Duration.seconds(300),
+            memory_size=lambda_memory_size
+        )
+        self.user_activity_table.grant(report_function, "dynamodb:Scan", "dynamodb:Query")
+        self.brand_rollup_table.grant(report_function, "dynamodb:Query")
+        self.data_bucket.grant_read_write(report_function, 'reports/*')
+        self.alert_topic.grant_publish(report_function)
 
-        # Define the state machine
+        # Standard workflow started by POST /trigger for heavy reports; the
+        # report is saved to S3 and sent by email
         state_machine = sfn.StateMachine(
             self,
             "BrandStateMachine",
-            definition=choice_state.afterwards(),
+            definition=self._report_workflow("", report_function, sync=False),
             timeout=Duration.minutes(5)
         )
 
+        # Express workflow run by POST /report with StartSyncExecution, which
+        # returns the reports in the HTTP response. API Gateway gives up
+        # after 29 s, so the workflow stops before that.
+        sync_state_machine = sfn.StateMachine(
+            self,
+            "SyncBrandStateMachine",
+            state_machine_type=sfn.StateMachineType.EXPRESS,
+            definition=self._report_workflow("Sync", report_function, sync=True),
+            timeout=Duration.seconds(25)
+        )
+        cloudwatch.Alarm(
+            self,
+            "SyncReportLatencyAlarm",
+            metric=sync_state_machine.metric_time(statistic="p99", period=Duration.minutes(5)),
+            threshold=sync_report_p99_ms,
+            evaluation_periods=3,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+            alarm_description=f"p99 of synchronous brand reports above {sync_report_p99_ms} ms"
+        )
+
         # Create an IAM role for API Gateway
         api_gateway_role = iam.Role(
             self,
@@ -402,6 +569,12 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
                 resources=[state_machine.state_machine_arn]
             )
         )
+        api_gateway_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["states:StartSyncExecution"],
+                resources=[sync_state_machine.state_machine_arn]
+            )
+        )
 
         # Create an API Gateway REST API
         rest_api = apigateway.RestApi(
@@ -444,6 +617,45 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
             }]
         )
 
+        # POST /report answers with the report JSON itself
+        report_resource = rest_api.root.add_resource("report")
+        report_resource.add_method(
+            "POST",
+            integration=apigateway.AwsIntegration(
+                service="states",
+                action="StartSyncExecution",
+                integration_http_method="POST",
+                options=apigateway.IntegrationOptions(
+                    credentials_role=api_gateway_role,
+                    integration_responses=[{
+                        "statusCode": "200",
+                        "responseTemplates": {
+                            "application/json": """
+                            #if($input.path('$.status') == "SUCCEEDED")
+                            $input.path('$.output')
+                            #else
+                            #set($context.responseOverride.status = 500)
+                            {"error": "$util.escapeJavaScript($input.path('$.error'))", "cause": "$util.escapeJavaScript($input.path('$.cause'))"}
+                            #end
+                            """
+                        }
+                    }],
+                    request_templates={
+                        "application/json": f"""
+                        {{
+                            "input": "$util.escapeJavaScript($input.json('$'))",
+                            "stateMachineArn": "{sync_state_machine.state_machine_arn}"
+                        }}
+                        """
+                    }
+                )
+            ),
+            method_responses=[
+                {"statusCode": "200", "responseModels": {"application/json": apigateway.Model.EMPTY_MODEL}},
+                {"statusCode": "500", "responseModels": {"application/json": apigateway.Model.ERROR_MODEL}}
+            ]
+        )
+
         # Deploy the API
         deployment = apigateway.Deployment(
             self,
@@ -463,6 +675,49 @@ python3 /home/ec2-user/stream-data-app-simulation.py > /home/ec2-user/script.log
 
         # Output the URL of the API
         CfnOutput(self, "APIEndpoint", value=f"{rest_api.url_for_path(trigger_resource.path)}")
+        CfnOutput(self, "SyncReportEndpoint", value=f"{rest_api.url_for_path(report_resource.path)}")
+
+    def _report_workflow(self, prefix, report_function, sync):
+        # plan -> Map over the scan segments -> merge. The sync variant skips
+        # the email and ends with the reports as the workflow output.
+        plan_task = tasks.LambdaInvoke(
+            self,
+            f"{prefix}PlanReport",
+            lambda_function=report_function,
+            payload=sfn.TaskInput.from_object({"step": "plan", "request.$": "$"}),
+            payload_response_only=True,
+            result_path="$.plan"
+        )
 
+        # Every segment queries one brand's all-time rollups, or scans its
+        # share of the events table once for all brands
+        segment_task = tasks.LambdaInvoke(
+            self,
+            f"{prefix}ScanSegment",
+            lambda_function=report_function,
+            payload_response_only=True
+        )
+        segments_map = sfn.Map(
+            self,
+            f"{prefix}ScanSegments",
+            items_path="$.plan.segments",
+            max_concurrency=16,
+            result_path="$.partials"
+        )
+        segments_map.item_processor(segment_task)
 
+        merge_task = tasks.LambdaInvoke(
+            self,
+            f"{prefix}MergeReport",
+            lambda_function=report_function,
+            payload=sfn.TaskInput.from_object({
+                "step": "merge",
+                "plan.$": "$.plan",
+                "partials.$": "$.partials",
+                "notify": not sync
+            }),
+            payload_response_only=True,
+            result_path="$" if sync else "$.result"
+        )
+        return plan_task.next(segments_map).next(merge_task)
 
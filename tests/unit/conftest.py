@@ -0,0 +1,15 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Lambda handlers are deployed from their own asset directories and import
+# their modules as top-level names; shared modules come from the common
+# layer's python/ directory. Put those directories on the path.
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'lambda_report'))
+sys.path.insert(0, os.path.join(ROOT, 'term_assignment', 'layers', 'common', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('TABLE_NAME', 'test-table')
+os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:test-topic')
@@ -0,0 +1,126 @@
+import pytest
+
+from alerts import AlertAggregator, MAX_USERS_IN_MESSAGE, summary_message
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Publisher:
+    def __init__(self):
+        self.messages = []
+
+    def __call__(self, subject, message):
+        self.messages.append((subject, message))
+
+
+class FakeStore:
+    def __init__(self, taken=(), failing=()):
+        self.taken = set(taken)
+        self.failing = set(failing)
+        self.claims = []
+
+    def claim(self, user_id, now, until):
+        self.claims.append(user_id)
+        if user_id in self.failing:
+            raise RuntimeError('ProvisionedThroughputExceededException')
+        if user_id in self.taken:
+            return False
+        self.taken.add(user_id)
+        return True
+
+    def release(self, user_id, until):
+        self.taken.discard(user_id)
+
+
+def test_one_summary_per_batch():
+    aggregator = AlertAggregator(clock=Clock())
+    publish = Publisher()
+
+    for user_id in ['a', 'a', 'b', 'a']:
+        aggregator.flag(user_id)
+    alerted = aggregator.flush(publish)
+
+    assert alerted == {'a': 3, 'b': 1}
+    assert len(publish.messages) == 1
+
+
+def test_cooldown_suppresses_repeat_alerts_until_it_expires():
+    clock = Clock()
+    aggregator = AlertAggregator(cooldown_seconds=60, clock=clock)
+    publish = Publisher()
+
+    aggregator.flag('a')
+    aggregator.flush(publish)
+    aggregator.flag('a')
+    assert aggregator.flush(publish) == {}
+
+    clock.now += 61
+    aggregator.flag('a')
+    assert aggregator.flush(publish) == {'a': 1}
+    assert len(publish.messages) == 2
+
+
+def test_nothing_published_without_flags():
+    publish = Publisher()
+
+    assert AlertAggregator(clock=Clock()).flush(publish) == {}
+    assert publish.messages == []
+
+
+def test_store_claims_are_respected():
+    store = FakeStore(taken={'b'})
+    aggregator = AlertAggregator(store=store, clock=Clock())
+
+    aggregator.flag('a')
+    aggregator.flag('b')
+
+    assert aggregator.flush(Publisher()) == {'a': 1}
+    assert store.claims == ['a', 'b']
+
+
+def test_failed_publish_releases_claims_and_alerts_on_next_flush():
+    store = FakeStore()
+    aggregator = AlertAggregator(store=store, clock=Clock())
+
+    def failing_publish(subject, message):
+        raise RuntimeError('SNS unavailable')
+
+    aggregator.flag('a')
+    with pytest.raises(RuntimeError):
+        aggregator.flush(failing_publish)
+
+    publish = Publisher()
+    assert aggregator.flush(publish) == {'a': 1}
+    assert len(publish.messages) == 1
+    assert store.claims == ['a', 'a']
+
+
+def test_failed_claim_releases_earlier_claims_and_keeps_every_user():
+    store = FakeStore(failing={'b'})
+    aggregator = AlertAggregator(store=store, clock=Clock())
+    publish = Publisher()
+
+    for user_id in ['a', 'b', 'c']:
+        aggregator.flag(user_id)
+    with pytest.raises(RuntimeError):
+        aggregator.flush(publish)
+
+    assert publish.messages == []
+    assert store.taken == set()
+    assert list(aggregator.pending) == ['a', 'b', 'c']
+
+    store.failing.clear()
+    assert aggregator.flush(publish) == {'a': 1, 'b': 1, 'c': 1}
+    assert len(publish.messages) == 1
+
+
+def test_summary_is_truncated():
+    alerted = {str(i): 1 for i in range(MAX_USERS_IN_MESSAGE + 5)}
+
+    assert summary_message(alerted).endswith('... and 5 more')
@@ -0,0 +1,41 @@
+import aws_clients
+
+
+def test_lazy_builds_on_first_use_only():
+    built = []
+
+    def factory(name):
+        built.append(name)
+        return {'name': name}
+
+    table = aws_clients.lazy(factory, 'events')
+    assert built == []
+    assert table.get('name') == 'events'
+    assert table.get('brand') is None
+    assert built == ['events']
+
+
+def test_clients_are_shared_and_tuned():
+    aws_clients.reset()
+    try:
+        sns = aws_clients.client('sns')
+        assert aws_clients.client('sns') is sns
+        assert sns.meta.config.retries['mode'] == 'adaptive'
+        assert sns.meta.config.tcp_keepalive is True
+        assert sns.meta.config.max_pool_connections == 32
+    finally:
+        aws_clients.reset()
+
+
+def test_single_attempt_resource_is_separate():
+    aws_clients.reset()
+    try:
+        shared = aws_clients.resource('dynamodb')
+        writer = aws_clients.resource('dynamodb', aws_clients.SINGLE_ATTEMPT)
+        assert writer is not shared
+        assert aws_clients.resource('dynamodb', aws_clients.SINGLE_ATTEMPT) is writer
+        assert writer.meta.client.meta.config.retries['total_max_attempts'] == 1
+        assert shared.meta.client.meta.config.retries['mode'] == 'adaptive'
+        assert writer.meta.client.meta.config.max_pool_connections == 32
+    finally:
+        aws_clients.reset()
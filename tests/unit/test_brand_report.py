@@ -0,0 +1,88 @@
+import threading
+
+from botocore.exceptions import ClientError
+
+from brand_report import BrandTotals, brand_totals, scan_brand_totals
+from item_codec import EVENT_TYPE_CODES
+
+
+def raw_item(brand, event_type, price):
+    # The projected attributes of a stored event (item_codec)
+    return {'b': {'S': brand}, 'e': {'N': str(EVENT_TYPE_CODES[event_type])}, 'p': {'N': price}}
+
+
+class FakeClient:
+    # Serves each scan segment as pages of two items and records every call
+    def __init__(self, items, has_index=True):
+        self.items = items
+        self.has_index = has_index
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def page(self, items, kwargs):
+        start = kwargs.get('ExclusiveStartKey', {}).get('offset', 0)
+        response = {'Items': items[start:start + 2]}
+        if start + 2 < len(items):
+            response['LastEvaluatedKey'] = {'offset': start + 2}
+        return response
+
+    def matching(self, brand):
+        return [item for item in self.items if item['b']['S'] == brand]
+
+    def scan(self, **kwargs):
+        with self.lock:
+            self.calls.append(('scan', kwargs))
+        segment, total = kwargs['Segment'], kwargs['TotalSegments']
+        items = [item for i, item in enumerate(self.matching(kwargs['ExpressionAttributeValues'][':brand']['S']))
+                 if i % total == segment]
+        return self.page(items, kwargs)
+
+    def query(self, **kwargs):
+        self.calls.append(('query', kwargs))
+        if not self.has_index:
+            raise ClientError({'Error': {'Code': 'ValidationException'}}, 'Query')
+        return self.page(self.matching(kwargs['ExpressionAttributeValues'][':brand']['S']), kwargs)
+
+
+ITEMS = (
+    [raw_item('apple', 'view', '1.0') for _ in range(7)] +
+    [raw_item('apple', 'purchase', '10.5') for _ in range(3)] +
+    [raw_item('apple', 'cart', '10.5')] +
+    [raw_item('samsung', 'purchase', '99.0') for _ in range(4)]
+)
+
+
+def test_parallel_scan_reads_every_page_of_every_segment():
+    client = FakeClient(ITEMS)
+
+    totals = scan_brand_totals(client, 'events', 'apple', total_segments=3)
+
+    assert totals.report('apple') == {'brand': 'apple', 'total_views': 7, 'total_purchases': 3, 'total_price': 31.5}
+    assert {kwargs['Segment'] for _, kwargs in client.calls} == {0, 1, 2}
+    assert all(kwargs['ProjectionExpression'] == '#brand, #event_type, #price' for _, kwargs in client.calls)
+
+
+def test_index_is_queried_when_configured():
+    client = FakeClient(ITEMS)
+
+    totals = brand_totals('events', 'samsung', client=client, index_name='brand-index')
+
+    assert (totals.total_purchases, totals.total_price) == (4, 396.0)
+    assert {name for name, _ in client.calls} == {'query'}
+
+
+def test_missing_index_falls_back_to_scan():
+    client = FakeClient(ITEMS, has_index=False)
+
+    totals = brand_totals('events', 'apple', client=client, index_name='brand-index', total_segments=2)
+
+    assert totals.total_views == 7
+    assert [name for name, _ in client.calls][0] == 'query'
+
+
+def test_totals_merge():
+    left, right = BrandTotals(), BrandTotals()
+    left.add_items([raw_item('a', 'view', '1')])
+    right.add_items([raw_item('a', 'purchase', '2.5')])
+
+    assert left.merge(right).report('a') == {'brand': 'a', 'total_views': 1, 'total_purchases': 1, 'total_price': 2.5}
@@ -0,0 +1,119 @@
+import base64
+import json
+
+from botocore.exceptions import ClientError
+
+import consumer
+
+
+PAYLOAD = {
+    'user_id': '1', 'txn_timestamp': '2024-01-01T00:00:00', 'event_type': 'view',
+    'product_id': '10', 'category_id': '20', 'price': '1.5',
+    'user_session': 's', 'event_time': '2019-11-01 00:00:00 UTC'
+}
+
+
+def kinesis_record(sequence_number, data):
+    return {'kinesis': {'sequenceNumber': sequence_number, 'data': base64.b64encode(data.encode('utf-8')).decode('utf-8')}}
+
+
+def test_consumer_retries_from_the_first_failed_record(monkeypatch):
+    checked = []
+    monkeypatch.setattr(consumer, 'check_for_ddos', checked.extend)
+    monkeypatch.setattr(consumer, 'batch_write_items', lambda dynamodb, table_name, items, **kwargs: {'2'})
+
+    event = {'Records': [
+        kinesis_record('1', json.dumps(PAYLOAD)),
+        kinesis_record('2', json.dumps(dict(PAYLOAD, txn_timestamp='2024-01-01T00:00:01'))),
+        kinesis_record('3', 'not json'),
+        kinesis_record('4', json.dumps(dict(PAYLOAD, txn_timestamp='2024-01-01T00:00:02'))),
+    ]}
+
+    response = consumer.lambda_handler(event, None)
+
+    # Record 3 is malformed and skipped; 4 is written but comes back with 2
+    assert response == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+    assert [item['txn_timestamp'] for item in checked] == ['2024-01-01T00:00:00']
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_consumer_defers_records_past_the_time_budget(monkeypatch):
+    monkeypatch.setattr(consumer, 'check_for_ddos', lambda items: None)
+    monkeypatch.setattr(consumer, 'batch_write_items', lambda dynamodb, table_name, items, **kwargs: set())
+    event = {'Records': [kinesis_record('1', json.dumps(PAYLOAD))]}
+
+    assert consumer.lambda_handler(event, FakeContext(60000)) == {'batchItemFailures': []}
+    deferred = consumer.lambda_handler(event, FakeContext(consumer.deadline_margin_ms - 1))
+    assert deferred == {'batchItemFailures': [{'itemIdentifier': '1'}]}
+
+
+class BrokenTable:
+    def __getattr__(self, name):
+        def fail(**kwargs):
+            raise RuntimeError('connection reset')
+        return fail
+
+
+def test_consumer_side_update_failures_do_not_fail_the_batch(monkeypatch):
+    # A retry would apply the updates that succeeded a second time
+    monkeypatch.setattr(consumer, 'rollup_table', BrokenTable())
+    monkeypatch.setattr(consumer, 'check_for_ddos', lambda items: None)
+    monkeypatch.setattr(consumer, 'batch_write_items', lambda dynamodb, table_name, items, **kwargs: set())
+    event = {'Records': [kinesis_record('1', json.dumps(dict(PAYLOAD, brand='apple')))]}
+
+    metrics = consumer.Metrics()
+    response = consumer.consume_records(event, metrics, consumer.TimeBudget(None, 0))
+
+    assert response == {'batchItemFailures': []}
+    assert metrics.counts['SideUpdateFailures'] == 2
+
+
+class RejectingTable:
+    def update_item(self, **kwargs):
+        raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'UpdateItem')
+
+    def get_item(self, **kwargs):
+        raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'GetItem')
+
+
+def test_consumer_counts_rejected_rollup_writes(monkeypatch):
+    monkeypatch.setattr(consumer, 'rollup_table', RejectingTable())
+    monkeypatch.setattr(consumer, 'check_for_ddos', lambda items: None)
+    monkeypatch.setattr(consumer, 'batch_write_items', lambda dynamodb, table_name, items, **kwargs: set())
+    event = {'Records': [kinesis_record('1', json.dumps(dict(PAYLOAD, brand='apple')))]}
+
+    metrics = consumer.Metrics()
+    assert consumer.consume_records(event, metrics, consumer.TimeBudget(None, 0)) == {'batchItemFailures': []}
+
+    # The hour and all-time rollups of the brand, and its day's sketch
+    assert metrics.counts['RollupWriteFailures'] == 2
+    assert metrics.counts['SketchWriteFailures'] == 1
+    assert 'SideUpdateFailures' not in metrics.counts
+
+
+def test_handler_emits_stage_timings_and_retries(monkeypatch, capsys):
+    monkeypatch.setattr(consumer, 'check_for_ddos', lambda items: None)
+    monkeypatch.setattr(consumer, 'sample_log', lambda message: None)
+
+    def batch_write_items(dynamodb, table_name, items, on_retry=None, **kwargs):
+        on_retry(len(items))
+        return set()
+
+    monkeypatch.setattr(consumer, 'batch_write_items', batch_write_items)
+    event = {'Records': [kinesis_record('1', json.dumps(PAYLOAD)), kinesis_record('2', 'not json')]}
+
+    consumer.lambda_handler(event, None)
+
+    document = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert document['Records'] == 2
+    assert document['Events'] == 1
+    assert document['DynamoWriteRetries'] == 1
+    assert document['MalformedRecords'] == 1
+    assert {'DecodeTime', 'DynamoWriteTime', 'DdosCheckTime', 'SnsTime'} <= set(document)
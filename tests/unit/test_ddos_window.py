@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from ddos_window import SlidingWindowDetector
+
+
+def test_flags_more_than_max_events_within_window():
+    detector = SlidingWindowDetector(window_seconds=20, max_events=4)
+
+    flags = [detector.observe('u', float(t)) for t in range(0, 10, 2)]
+
+    assert flags == [False, False, False, False, True]
+
+
+def test_events_outside_window_are_not_counted():
+    detector = SlidingWindowDetector(window_seconds=20, max_events=4)
+
+    flags = [detector.observe('u', float(t)) for t in range(0, 150, 30)]
+
+    assert not any(flags)
+
+
+def test_users_are_tracked_independently():
+    detector = SlidingWindowDetector(window_seconds=20, max_events=1)
+
+    assert detector.observe_batch([('a', 0.0), ('b', 1.0), ('a', 2.0), ('b', 30.0)]) == [False, False, True, False]
+
+
+def test_per_user_history_is_bounded():
+    detector = SlidingWindowDetector(window_seconds=1000, max_events=4)
+
+    for t in range(100):
+        detector.observe('u', float(t))
+
+    assert len(detector.users['u']) == 5
+
+
+def test_least_recently_seen_user_is_evicted():
+    detector = SlidingWindowDetector(max_users=2)
+
+    detector.observe('a', 0.0)
+    detector.observe('b', 0.0)
+    detector.observe('a', 1.0)
+    detector.observe('c', 0.0)
+
+    assert 'a' in detector and 'c' in detector and 'b' not in detector
+
+
+def test_loader_only_called_once_per_unseen_user():
+    calls = []
+
+    def loader(user_id, before):
+        calls.append((user_id, before))
+        return [before - 5, before - 3, before - 1, before]
+
+    detector = SlidingWindowDetector(window_seconds=20, max_events=4, loader=loader)
+
+    # The stored event at `before` is the batch's own event and is ignored
+    flags = detector.observe_batch([('u', 100.0), ('u', 101.0), ('v', 50.0)])
+    detector.observe('u', 102.0)
+
+    assert calls == [('u', 100.0), ('v', 50.0)]
+    assert flags == [False, True, False]
+
+
+def test_concurrent_loading_keeps_per_user_order():
+    def loader(user_id, before):
+        return [before - 3, before - 2, before - 1]
+
+    events = [('u', 100.0), ('v', 10.0), ('u', 101.0), ('v', 40.0), ('u', 130.0)]
+    sequential = SlidingWindowDetector(window_seconds=20, max_events=4, loader=loader)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        concurrent = SlidingWindowDetector(window_seconds=20, max_events=4, loader=loader)
+        flags = concurrent.observe_batch(events, executor=executor)
+
+    assert flags == sequential.observe_batch(events) == [False, False, True, False, False]
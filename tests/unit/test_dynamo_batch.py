@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+import dynamo_batch
+
+
+class FakeDynamoDB:
+    # Records every BatchWriteItem call and replays a scripted list of responses
+    def __init__(self, responses=None):
+        self.calls = []
+        self.responses = list(responses or [])
+
+    def batch_write_item(self, RequestItems):
+        self.calls.append(RequestItems)
+        if self.responses:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return {'UnprocessedItems': {}}
+
+
+def make_item(user_id, timestamp):
+    return {'user_id': user_id, 'txn_timestamp': timestamp}
+
+
+def throttled():
+    return ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'BatchWriteItem')
+
+
+def test_writes_in_chunks_of_25():
+    fake = FakeDynamoDB()
+    records = [(str(i), make_item('u', f'2024-01-01T00:00:{i:02d}')) for i in range(60)]
+
+    failed = dynamo_batch.batch_write_items(fake, 'events', records, sleep=lambda s: None)
+
+    assert failed == set()
+    assert [len(call['events']) for call in fake.calls] == [25, 25, 10]
+
+
+def test_duplicate_keys_are_collapsed_last_write_wins():
+    fake = FakeDynamoDB()
+    first = dict(make_item('u', 't'), price=1)
+    second = dict(make_item('u', 't'), price=2)
+
+    dynamo_batch.batch_write_items(fake, 'events', [('a', first), ('b', second)], sleep=lambda s: None)
+
+    assert fake.calls[0]['events'] == [{'PutRequest': {'Item': second}}]
+
+
+def test_retries_only_unprocessed_items():
+    items = [make_item('u', str(i)) for i in range(3)]
+    fake = FakeDynamoDB([
+        {'UnprocessedItems': {'events': [{'PutRequest': {'Item': items[1]}}]}},
+        {'UnprocessedItems': {}},
+    ])
+
+    failed = dynamo_batch.batch_write_items(fake, 'events', list(zip('abc', items)), sleep=lambda s: None)
+
+    assert failed == set()
+    assert fake.calls[1]['events'] == [{'PutRequest': {'Item': items[1]}}]
+
+
+def test_gives_up_after_max_attempts():
+    item = make_item('u', 't')
+    unprocessed = {'UnprocessedItems': {'events': [{'PutRequest': {'Item': item}}]}}
+    fake = FakeDynamoDB([unprocessed] * dynamo_batch.MAX_ATTEMPTS)
+
+    failed = dynamo_batch.batch_write_items(fake, 'events', [('a', item), ('b', item)], sleep=lambda s: None)
+
+    assert failed == {'a', 'b'}
+    assert len(fake.calls) == dynamo_batch.MAX_ATTEMPTS
+
+
+def test_throttling_error_is_retried():
+    fake = FakeDynamoDB([throttled()])
+
+    failed = dynamo_batch.batch_write_items(fake, 'events', [('a', make_item('u', 't'))], sleep=lambda s: None)
+
+    assert failed == set()
+    assert len(fake.calls) == 2
+
+
+def test_connection_errors_are_retried():
+    fake = FakeDynamoDB([ReadTimeoutError(endpoint_url='https://dynamodb'), EndpointConnectionError(endpoint_url='x')])
+
+    failed = dynamo_batch.batch_write_items(fake, 'events', [('a', make_item('u', 't'))], sleep=lambda s: None)
+
+    assert failed == set()
+    assert len(fake.calls) == 3
+
+
+def test_concurrent_chunks_stop_at_the_deadline():
+    fake = FakeDynamoDB()
+    records = [(str(i), make_item(f'u{i}', 't')) for i in range(60)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert dynamo_batch.batch_write_items(fake, 'events', records, executor=executor) == set()
+        stopped = dynamo_batch.batch_write_items(fake, 'events', records, executor=executor, should_stop=lambda: True)
+
+    assert sorted(len(call['events']) for call in fake.calls) == [10, 25, 25]
+    assert stopped == {record_id for record_id, _ in records}
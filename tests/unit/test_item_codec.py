@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from item_codec import decode_attributes, decode_item, encode_item
+from record_format import build_item
+
+PAYLOAD = {
+    'user_id': '520088904', 'txn_timestamp': '2024-04-06T20:15:14.151884', 'event_type': 'purchase',
+    'product_id': '1003461', 'category_id': '2053013555631882655', 'category_code': 'electronics.smartphone',
+    'brand': 'xiaomi', 'price': '489.07', 'user_session': '4d3b30da-a5e4-49df-b1a8-ba5943f1dd33',
+    'event_time': '2019-11-01 00:00:00 UTC'
+}
+
+
+def test_round_trip():
+    item = build_item(PAYLOAD)
+    stored = encode_item(item, expires_at=1712500000)
+
+    assert stored['u'] == 520088904 and stored['t'] == 1712434514151884
+    assert stored['e'] == 3 and stored['x'] == 1712500000
+    assert len(stored['s'].value) == 16
+    assert decode_item(stored) == item
+
+
+def test_values_without_a_compact_form_stay_strings():
+    item = build_item(dict(PAYLOAD, product_id='sku-1', event_type='wishlist', category_code='', brand='',
+                           user_session='not-a-uuid', event_time='yesterday'))
+    stored = encode_item(item)
+
+    assert stored['pi'] == 'sku-1' and stored['e'] == 'wishlist' and stored['s'] == 'not-a-uuid'
+    assert 'cc' not in stored and 'b' not in stored and 'x' not in stored
+    # Empty strings are left out, like the brand in build_item
+    assert decode_item(stored) == {name: value for name, value in item.items() if name != 'category_code'}
+
+
+def test_user_id_must_be_an_integer():
+    with pytest.raises(ValueError):
+        encode_item(build_item(dict(PAYLOAD, user_id='u-1')))
+    with pytest.raises(ValueError):
+        encode_item(build_item(dict(PAYLOAD, user_id='007')))
+
+
+def test_low_level_client_items_decode():
+    serializer = TypeSerializer()
+    stored = encode_item(build_item(PAYLOAD))
+    attributes = {name: serializer.serialize(value) for name, value in stored.items()}
+
+    decoded = decode_attributes({name: attributes[name] for name in ('b', 'e', 'p')})
+
+    assert decoded == {'brand': 'xiaomi', 'event_type': 'purchase', 'price': Decimal('489.07')}
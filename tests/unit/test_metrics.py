@@ -0,0 +1,44 @@
+import json
+
+import metrics
+from metrics import Metrics, sample_log
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.5
+        return self.now
+
+
+def test_one_emf_document_per_invocation():
+    lines = []
+    recorder = Metrics(dimensions={'Brand': 'apple'}, clock=FakeClock())
+    with recorder.stage('Decode'):
+        pass
+    with recorder.stage('Decode'):
+        pass
+    recorder.count('Records', 3)
+    recorder.count('Records')
+    recorder.emit(log=lines.append)
+
+    assert len(lines) == 1
+    document = json.loads(lines[0])
+    directive = document['_aws']['CloudWatchMetrics'][0]
+    assert directive['Dimensions'] == [['Brand', 'FunctionName']]
+    assert {'Name': 'DecodeTime', 'Unit': 'Milliseconds'} in directive['Metrics']
+    assert {'Name': 'Records', 'Unit': 'Count'} in directive['Metrics']
+    assert document['DecodeTime'] == 1000.0
+    assert document['Records'] == 4
+    assert document['Brand'] == 'apple'
+
+
+def test_sample_log_respects_rate(capsys, monkeypatch):
+    sample_log('never', rate=0)
+    sample_log('always', rate=1)
+    monkeypatch.setattr(metrics.random, 'random', lambda: 0.5)
+    sample_log('sampled out', rate=0.1)
+
+    assert capsys.readouterr().out == 'always\n'
@@ -0,0 +1,187 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+import parquet_compaction  # noqa: E402
+from parquet_compaction import MANIFEST_NAME, closed_hours, compact  # noqa: E402
+from parquet_report import FooterCache, parquet_brand_totals  # noqa: E402
+
+NOW = datetime(2024, 4, 6, 22, 5, tzinfo=timezone.utc)
+
+
+def write_small_files(directory, count, brand='apple'):
+    directory.mkdir(parents=True, exist_ok=True)
+    for index in range(count):
+        table = pa.table({'brand': [brand] * 3, 'event_type': ['view'] * 3, 'price': ['1.0'] * 3})
+        pq.write_table(table, str(directory / f'firehose-{index}'))
+
+
+def data_files(directory):
+    return sorted(path.name for path in directory.iterdir() if not path.name.startswith(('_', '.')))
+
+
+def test_only_closed_hours_are_compacted():
+    hours = closed_hours(NOW, hours=2, grace=15)
+
+    assert hours == [datetime(2024, 4, 6, 20, tzinfo=timezone.utc), datetime(2024, 4, 6, 19, tzinfo=timezone.utc)]
+
+
+def test_small_files_are_merged_and_swapped(tmp_path):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    still_open = tmp_path / 'dt=2024-04-06' / 'hour=21'
+    write_small_files(closed, 5)
+    write_small_files(still_open, 5)
+
+    summaries = compact(str(tmp_path), now=NOW, hours=2, grace=15)
+
+    assert [(s['input_files'], s['output_files']) for s in summaries] == [(5, 1)]
+    assert len(data_files(closed)) == 1 and data_files(closed)[0].startswith('compacted-')
+    assert pq.read_table(str(closed / data_files(closed)[0])).num_rows == 15
+    assert len(data_files(still_open)) == 5
+    assert parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache())['apple'].total_views == 30
+
+
+def test_target_size_splits_outputs(tmp_path):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    write_small_files(closed, 6)
+    size = (closed / 'firehose-0').stat().st_size
+
+    compact(str(tmp_path), now=NOW, hours=1, grace=15, target_bytes=size * 3)
+
+    assert len(data_files(closed)) == 2
+
+
+def test_readers_never_see_duplicates_mid_swap(tmp_path, monkeypatch):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    write_small_files(closed, 4)
+
+    def views():
+        return parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache())['apple'].total_views
+
+    # Job dies after writing merged files but before the manifest
+    def crash(fs, directory, manifest):
+        raise OSError('job killed')
+
+    monkeypatch.setattr(parquet_compaction, 'write_manifest', crash)
+    with pytest.raises(OSError):
+        compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    assert len(data_files(closed)) == 4
+    assert views() == 12
+    monkeypatch.undo()
+
+    # Manifest written but originals not deleted yet
+    monkeypatch.setattr(parquet_compaction, 'delete_files', lambda fs, directory, names: None)
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    assert (closed / MANIFEST_NAME).exists()
+    assert views() == 12
+    monkeypatch.undo()
+
+    # A later run cleans up the originals the manifest already replaced
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    assert not any(name.startswith('firehose-') for name in data_files(closed))
+    assert views() == 12
+
+
+def staged_files(directory):
+    return sorted(path.name for path in directory.iterdir() if path.name.startswith('_compacted-'))
+
+
+def test_crash_before_manifest_leaves_nothing_visible(tmp_path, monkeypatch):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    write_small_files(closed, 4)
+    # Left by an older run that never committed its generation
+    pq.write_table(pa.table({'brand': ['apple'], 'event_type': ['view'], 'price': ['1.0']}),
+                   str(closed / 'compacted-000000000000-00000.parquet'))
+
+    def crash(fs, directory, manifest):
+        raise OSError('job killed')
+
+    monkeypatch.setattr(parquet_compaction, 'write_manifest', crash)
+    with pytest.raises(OSError):
+        compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    monkeypatch.undo()
+
+    # Only the hidden staged file was written, so plain listings such as
+    # Athena's see the originals alone once the orphan is collected
+    assert len(staged_files(closed)) == 1
+    assert parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache())['apple'].total_views == 12
+
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+
+    assert staged_files(closed) == []
+    assert len(data_files(closed)) == 1 and data_files(closed)[0].startswith('compacted-')
+    assert pq.read_table(str(closed / data_files(closed)[0])).num_rows == 12
+    assert parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache())['apple'].total_views == 12
+
+
+def test_crash_after_manifest_is_finished_by_next_run(tmp_path, monkeypatch):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    write_small_files(closed, 4)
+
+    write_manifest = parquet_compaction.write_manifest
+
+    def crash(fs, directory, manifest):
+        write_manifest(fs, directory, manifest)
+        raise OSError('job killed')
+
+    monkeypatch.setattr(parquet_compaction, 'write_manifest', crash)
+    with pytest.raises(OSError):
+        compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    monkeypatch.undo()
+    assert len(staged_files(closed)) == 1
+
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+
+    assert staged_files(closed) == []
+    assert len(data_files(closed)) == 1 and data_files(closed)[0].startswith('compacted-')
+    assert parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache())['apple'].total_views == 12
+
+
+def test_failed_delete_leaves_only_hidden_files(tmp_path, monkeypatch):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    write_small_files(closed, 4)
+
+    def plain_listing_rows():
+        # What a reader that ignores the manifest (Athena) counts
+        return sum(pq.read_table(str(closed / name)).num_rows for name in data_files(closed))
+
+    monkeypatch.setattr(parquet_compaction, 'delete_files', lambda fs, directory, names: None)
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    monkeypatch.undo()
+
+    assert len(data_files(closed)) == 1 and data_files(closed)[0].startswith('compacted-')
+    assert plain_listing_rows() == 12
+    assert sorted(path.name for path in closed.iterdir() if path.name.startswith('_replaced-')) == [
+        f'_replaced-firehose-{index}' for index in range(4)
+    ]
+
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+
+    assert not any(path.name.startswith('_replaced-') for path in closed.iterdir())
+    assert plain_listing_rows() == 12
+
+
+def test_crash_mid_swap_never_exposes_duplicates(tmp_path, monkeypatch):
+    closed = tmp_path / 'dt=2024-04-06' / 'hour=20'
+    write_small_files(closed, 4)
+
+    # Dies after hiding the small files, before exposing the merged one
+    def crash(fs, directory, names):
+        raise OSError('job killed')
+
+    swap = parquet_compaction.swap
+    monkeypatch.setattr(parquet_compaction, 'swap', lambda fs, directory, replaced, outputs: swap(
+        fs, directory, replaced, []) or crash(fs, directory, outputs))
+    with pytest.raises(OSError):
+        compact(str(tmp_path), now=NOW, hours=1, grace=15)
+    monkeypatch.undo()
+    assert data_files(closed) == []
+
+    compact(str(tmp_path), now=NOW, hours=1, grace=15)
+
+    assert len(data_files(closed)) == 1 and data_files(closed)[0].startswith('compacted-')
+    assert pq.read_table(str(closed / data_files(closed)[0])).num_rows == 12
+    assert staged_files(closed) == []
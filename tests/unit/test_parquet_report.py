@@ -0,0 +1,73 @@
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+import parquet_report  # noqa: E402
+from parquet_report import FooterCache, parquet_brand_totals  # noqa: E402
+
+
+def write(path, rows, row_group_size=2):
+    table = pa.table({
+        'brand': [r[0] for r in rows],
+        'event_type': [r[1] for r in rows],
+        'price': [r[2] for r in rows],
+        'user_id': ['1'] * len(rows),
+    })
+    pq.write_table(table, str(path), row_group_size=row_group_size)
+
+
+def test_totals_for_several_brands_in_one_pass(tmp_path):
+    write(tmp_path / 'part-1', [('apple', 'view', '1.0'), ('apple', 'purchase', '10.5'), ('samsung', 'view', '')])
+    (tmp_path / 'nested').mkdir()
+    write(tmp_path / 'nested' / 'part-2', [('apple', 'purchase', '2.5'), ('xiaomi', 'purchase', '9.0')])
+    write(tmp_path / '_manifest', [('apple', 'purchase', '1000.0')])
+
+    totals = parquet_brand_totals(str(tmp_path), ['apple', 'samsung'], cache=FooterCache())
+
+    assert totals['apple'].report('apple') == {
+        'brand': 'apple', 'total_views': 1, 'total_purchases': 2, 'total_price': 13.0
+    }
+    assert totals['samsung'].total_views == 1
+
+
+def test_row_groups_outside_the_statistics_are_skipped(tmp_path, monkeypatch):
+    write(tmp_path / 'part-1', [('acer', 'view', '1'), ('asus', 'view', '1'),
+                                ('xiaomi', 'view', '1'), ('zte', 'view', '1')])
+    read = []
+    original = parquet_report.aggregate_table
+    monkeypatch.setattr(parquet_report, 'aggregate_table',
+                        lambda table, brands: read.append(table.num_rows) or original(table, brands))
+
+    totals = parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache())
+
+    assert read == [2]
+    assert totals['apple'].total_views == 0
+
+
+def test_footer_cache_persists_between_runs(tmp_path):
+    data = tmp_path / 'data'
+    data.mkdir()
+    write(data / 'part-1', [('apple', 'view', '1')])
+    cache_path = str(tmp_path / 'footers.pickle')
+
+    parquet_brand_totals(str(data), ['apple'], cache=FooterCache(cache_path))
+    cache = FooterCache(cache_path)
+
+    assert len(cache.entries) == 1
+    assert parquet_brand_totals(str(data), ['apple'], cache=cache)['apple'].total_views == 1
+    assert not cache.dirty
+
+
+def test_only_requested_partitions_are_read(tmp_path):
+    for dt, brand in [('2024-04-05', 'apple'), ('2024-04-06', 'apple'), ('2024-04-06', 'samsung'),
+                      ('2024-04-06', 'mixed'), ('2024-04-07', 'apple')]:
+        directory = tmp_path / f'dt={dt}' / 'hour=20' / f'brand={brand}'
+        directory.mkdir(parents=True)
+        write(directory / 'part-1', [(brand, 'view', '1')] if brand != 'mixed' else [('apple', 'view', '1'),
+                                                                                    ('samsung', 'view', '1')])
+
+    totals = parquet_brand_totals(str(tmp_path), ['apple'], cache=FooterCache(),
+                                  start_date='2024-04-06', end_date='2024-04-06')
+
+    assert totals['apple'].total_views == 2
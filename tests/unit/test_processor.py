@@ -0,0 +1,65 @@
+import base64
+import json
+
+import processor
+from record_format import aggregate
+
+
+EVENT = {
+    'user_id': '1', 'txn_timestamp': '2024-01-01T00:00:00', 'event_type': 'view',
+    'product_id': '10', 'category_id': '20', 'price': '1.5',
+    'user_session': 's', 'event_time': '2019-11-01 00:00:00 UTC'
+}
+
+
+def test_transform_marks_only_malformed_records():
+    event = {'records': [
+        {'recordId': '1', 'data': base64.b64encode(json.dumps(EVENT).encode('utf-8')).decode('utf-8')},
+        {'recordId': '2', 'data': base64.b64encode(b'not json').decode('utf-8')},
+    ]}
+
+    output = processor.lambda_handler(event, None)['records']
+
+    assert [(r['recordId'], r['result']) for r in output] == [('1', 'Ok'), ('2', 'ProcessingFailed')]
+    assert json.loads(base64.b64decode(output[0]['data']))['price'] == 1.5
+    assert output[1]['data'] == event['records'][1]['data']
+    assert output[0]['metadata'] == {'partitionKeys': {'dt': '2024-01-01', 'hour': '00', 'brand': 'unknown'}}
+    assert 'metadata' not in output[1]
+
+
+def test_transform_fails_only_the_corrupt_records():
+    data = aggregate([json.dumps(EVENT).encode('utf-8')] * 50)
+    event = {'records': [
+        {'recordId': 'cut', 'data': base64.b64encode(data[:len(data) // 2]).decode('utf-8')},
+        {'recordId': 'null', 'data': base64.b64encode(b'null').decode('utf-8')},
+        {'recordId': 'ok', 'data': base64.b64encode(json.dumps(EVENT).encode('utf-8')).decode('utf-8')},
+    ]}
+
+    output = processor.lambda_handler(event, None)['records']
+
+    assert [r['result'] for r in output] == ['ProcessingFailed', 'ProcessingFailed', 'Ok']
+
+
+def test_transform_deaggregates_and_emits_json_lines():
+    documents = [json.dumps(dict(EVENT, txn_timestamp=f'2024-01-01T00:00:0{i}')).encode('utf-8') for i in range(3)]
+    legacy = json.dumps(EVENT, indent=4).encode('utf-8')
+    event = {'records': [
+        {'recordId': 'agg', 'data': base64.b64encode(aggregate(documents)).decode('utf-8')},
+        {'recordId': 'old', 'data': base64.b64encode(legacy).decode('utf-8')},
+    ]}
+
+    output = processor.lambda_handler(event, None)['records']
+
+    assert [r['result'] for r in output] == ['Ok', 'Ok']
+    lines = base64.b64decode(output[0]['data']).decode('utf-8').splitlines()
+    assert [json.loads(line)['txn_timestamp'] for line in lines] == [f'2024-01-01 00:00:0{i}' for i in range(3)]
+    assert base64.b64decode(output[1]['data']).count(b'\n') == 1
+
+
+def test_offset_timestamps_are_partitioned_in_utc():
+    event = {'records': [{'recordId': '1', 'data': base64.b64encode(json.dumps(
+        dict(EVENT, txn_timestamp='2024-01-01T01:30:00+02:00')).encode('utf-8')).decode('utf-8')}]}
+    output = processor.lambda_handler(event, None)['records'][0]
+
+    assert output['metadata']['partitionKeys'] == {'dt': '2023-12-31', 'hour': '23', 'brand': 'unknown'}
+    assert json.loads(base64.b64decode(output['data']))['txn_timestamp'] == '2023-12-31 23:30:00'
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from record_format import aggregate, build_item, deaggregate, hive_timestamp, is_aggregated, output_document
+
+
+EVENT = {
+    'user_id': '1', 'txn_timestamp': '2024-01-01T00:00:00', 'event_type': 'view',
+    'product_id': '10', 'category_id': '20', 'price': '1.5',
+    'user_session': 's', 'event_time': '2019-11-01 00:00:00 UTC'
+}
+
+
+def test_legacy_record_is_a_single_event():
+    data = json.dumps(EVENT, indent=4).encode('utf-8')
+
+    assert not is_aggregated(data)
+    assert deaggregate(data) == [data]
+
+
+def test_aggregated_round_trip():
+    documents = [json.dumps(dict(EVENT, user_id=str(i))).encode('utf-8') for i in range(3)]
+
+    assert deaggregate(aggregate(documents)) == documents
+
+
+def test_truncated_aggregate_is_a_value_error():
+    data = aggregate([json.dumps(EVENT).encode('utf-8')] * 50)
+
+    for broken in (data[:len(data) // 2], data[:-8] + bytes(8), data[:10] + bytes(len(data) - 10)):
+        with pytest.raises(ValueError):
+            deaggregate(broken)
+
+
+@pytest.mark.parametrize('payload', [None, [1, 2], 'view', 3])
+def test_non_object_event_is_a_value_error(payload):
+    with pytest.raises(ValueError):
+        build_item(payload)
+
+
+def test_output_document_is_minified_and_typed():
+    document = output_document(dict(build_item(EVENT), ignored='x'))
+
+    assert document.endswith(b'\n') and b' ' not in document.replace(b' 00:00:00', b'')
+    assert json.loads(document) == {
+        'event_time': '2019-11-01 00:00:00', 'event_type': 'view', 'product_id': '10',
+        'category_id': '20', 'category_code': '', 'brand': '', 'price': 1.5,
+        'user_id': '1', 'user_session': 's', 'txn_timestamp': '2024-01-01 00:00:00'
+    }
+    assert len(document) < len(json.dumps(EVENT, indent=4))
+
+
+def test_offset_timestamps_are_converted_to_utc():
+    assert hive_timestamp('2024-04-06T23:30:00+02:00') == '2024-04-06 21:30:00'
+    assert hive_timestamp('2024-04-06T20:15:14.151884') == '2024-04-06 20:15:14.151884'
+    assert hive_timestamp('2019-11-01 00:00:00 UTC') == '2019-11-01 00:00:00'
@@ -0,0 +1,203 @@
+import io
+import json
+
+from botocore.exceptions import ClientError
+
+import report_handler
+from brand_report import scan_brands_segment
+from item_codec import EVENT_TYPE_CODES, encode_timestamp
+
+
+def raw_item(brand, event_type, price):
+    return {'b': {'S': brand}, 'e': {'N': str(EVENT_TYPE_CODES[event_type])}, 'p': {'N': price}}
+
+
+def rollup_item(brand, bucket, count, price_sum):
+    return {'brand': {'S': brand}, 'bucket': {'S': bucket},
+            'event_count': {'N': str(count)}, 'price_sum': {'N': str(price_sum)}}
+
+
+class FakeAWS:
+    # Scans filter on the requested brands the way the IN expression does,
+    # one page per call; S3 and SNS calls are recorded
+    def __init__(self, items):
+        self.items = items
+        self.scans = []
+        self.objects = {}
+        self.messages = []
+        self.latest = {'apple': encode_timestamp('2024-04-06T20:15:14'), 'samsung': encode_timestamp('2024-04-06T20:15:10')}
+
+    def scan(self, **kwargs):
+        self.scans.append(kwargs)
+        brands = {value['S'] for name, value in kwargs['ExpressionAttributeValues'].items() if name.startswith(':brand')}
+        brand = kwargs['ExpressionAttributeNames']['#brand']
+        items = [item for index, item in enumerate(self.items)
+                 if index % kwargs['TotalSegments'] == kwargs['Segment'] and item[brand]['S'] in brands]
+        if 'begins_with' in kwargs['FilterExpression']:
+            items = [item for item in items if item['bucket']['S'].startswith('all#')]
+        return {'Items': items}
+
+    def query(self, IndexName, ExpressionAttributeValues, **kwargs):
+        # Only the brand index is queried, for the latest txn_timestamp
+        latest = self.latest.get(ExpressionAttributeValues[':brand']['S'])
+        return {'Items': [{'t': {'N': str(latest)}}] if latest else []}
+
+    def get_object(self, Key, **kwargs):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(json.dumps(self.objects[Key]).encode('utf-8'))}
+
+    def put_object(self, Key, Body, **kwargs):
+        self.objects[Key] = json.loads(Body)
+
+    def publish(self, **kwargs):
+        self.messages.append(kwargs)
+
+
+ITEMS = (
+    [raw_item('apple', 'view', '1.0') for _ in range(7)] +
+    [raw_item('apple', 'purchase', '10.5') for _ in range(3)] +
+    [raw_item('samsung', 'purchase', '99.0') for _ in range(4)] +
+    [raw_item('xiaomi', 'purchase', '5.0') for _ in range(2)]
+)
+
+
+def test_one_scan_serves_every_brand():
+    fake = FakeAWS(ITEMS)
+
+    totals = scan_brands_segment(fake, 'events', ['apple', 'samsung'], 0, 1)
+
+    assert len(fake.scans) == 1
+    assert fake.scans[0]['FilterExpression'] == '#brand IN (:brand0, :brand1)'
+    assert totals['apple'].report('apple')['total_purchases'] == 3
+    assert totals['samsung'].report('samsung')['total_price'] == 396.0
+
+
+class FakeRollupTable:
+    # Serves queries by brand and bucket prefix and records every item read;
+    # a scan would read everything, so it is refused
+    def __init__(self, items):
+        self.items = items
+        self.read = []
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        brand, prefix = ExpressionAttributeValues[':brand']['S'], ExpressionAttributeValues[':all_time']['S']
+        items = [item for item in self.items if item['brand']['S'] == brand and item['bucket']['S'].startswith(prefix)]
+        self.read.extend(item['bucket']['S'] for item in items)
+        return {'Items': items}
+
+    def scan(self, **kwargs):
+        raise AssertionError('the rollup table is never scanned')
+
+
+def test_rollup_segments_query_only_all_time_items(monkeypatch):
+    table = FakeRollupTable([
+        rollup_item('apple', 'all#view', 5, 0), rollup_item('apple', 'all#purchase', 2, 21.0),
+        rollup_item('apple', '2024-04-06T20#purchase', 2, 21.0),
+        dict(rollup_item('apple', 'funnel#all', 0, 0), sessions={'N': '3'}),
+        {'brand': {'S': 'apple'}, 'bucket': {'S': 'sketch#2024-04-06'}, 'sketch': {'B': b'blob'}},
+        rollup_item('samsung', 'all#purchase', 1, 99.0),
+    ])
+    monkeypatch.setattr(report_handler, 'dynamodb', table)
+    monkeypatch.setattr(report_handler, 'rollup_table_name', 'rollups')
+
+    partials = report_handler.handler({'step': 'segment', 'brands': ['apple', 'samsung']}, None)
+
+    assert partials[0] == {'brand': 'apple', 'total_views': 5, 'total_purchases': 2, 'total_price': 21.0}
+    assert partials[1]['total_price'] == 99.0
+    assert table.read and all(bucket.startswith('all#') for bucket in table.read)
+
+
+def run_report(request):
+    # What the state machine does: plan, Map over the segments, merge
+    plan = report_handler.handler({'step': 'plan', 'request': request}, None)
+    partials = [report_handler.handler(segment, None) for segment in plan['segments']]
+    return plan, report_handler.handler({'step': 'merge', 'plan': plan, 'partials': partials}, None)
+
+
+def use_fake(monkeypatch, fake):
+    for name in ('dynamodb', 's3', 'sns'):
+        monkeypatch.setattr(report_handler, name, fake)
+    monkeypatch.setattr(report_handler, 'rollup_table_name', None)
+    monkeypatch.setattr(report_handler, 'brand_index_name', 'brand-index')
+    monkeypatch.setenv('S3_BUCKET', 'data')
+
+
+def test_reports_without_index_or_rollups_are_not_cached(monkeypatch):
+    fake = FakeAWS(ITEMS)
+    use_fake(monkeypatch, fake)
+    monkeypatch.setattr(report_handler, 'brand_index_name', None)
+
+    def query(**kwargs):
+        raise AssertionError('there is no index to query')
+
+    monkeypatch.setattr(fake, 'query', query)
+
+    plan, result = run_report({'brands': ['apple'], 'segments': 2})
+
+    assert plan['misses'] == {'apple': None}
+    assert result['reports'][0]['total_purchases'] == 3
+    assert fake.objects == {}
+
+
+def test_plan_map_and_merge(monkeypatch):
+    fake = FakeAWS(ITEMS)
+    use_fake(monkeypatch, fake)
+
+    plan, result = run_report({'brands': ['Apple', 'samsung', 'apple'], 'segments': 3})
+
+    assert plan['brands'] == ['apple', 'samsung']
+    assert len(fake.scans) == 3
+    assert result['reports'] == [
+        {'brand': 'apple', 'total_views': 7, 'total_purchases': 3, 'total_price': 31.5},
+        {'brand': 'samsung', 'total_views': 0, 'total_purchases': 4, 'total_price': 396.0},
+    ]
+    assert sorted(fake.objects) == ['reports/apple/t1712434514000000.json', 'reports/samsung/t1712434510000000.json']
+    assert len(fake.messages) == 1
+
+
+def test_cached_reports_are_served_until_the_watermark_moves(monkeypatch):
+    fake = FakeAWS(ITEMS)
+    use_fake(monkeypatch, fake)
+    _, first = run_report({'brands': ['apple', 'samsung'], 'segments': 2})
+    fake.scans.clear()
+
+    plan, second = run_report({'brands': ['apple', 'samsung'], 'segments': 2})
+    assert plan['segments'] == [] and fake.scans == []
+    assert second['reports'] == first['reports']
+    assert second['cached'] == ['apple', 'samsung']
+
+    # New samsung events: only samsung is scanned again
+    fake.latest['samsung'] = encode_timestamp('2024-04-06T20:16:00')
+    plan, third = run_report({'brands': ['apple', 'samsung'], 'segments': 2})
+    assert third['cached'] == ['apple']
+    assert {tuple(kwargs['ExpressionAttributeValues']) for kwargs in fake.scans} == {(':brand0',)}
+    assert 'reports/samsung/t1712434560000000.json' in fake.objects
+
+
+def test_rollup_watermark_sums_versions():
+    class Client:
+        def query(self, **kwargs):
+            return {'Items': [{'rollup_version': {'N': '3'}}, {'rollup_version': {'N': '4'}}]}
+
+    assert report_handler.rollup_watermark(Client(), 'rollups', 'apple') == 'v7'
+
+
+def test_plan_accepts_a_single_brand(monkeypatch):
+    use_fake(monkeypatch, FakeAWS(ITEMS))
+
+    plan = report_handler.handler({'step': 'plan', 'request': {'brand': 'apple'}}, None)
+
+    assert plan['brands'] == ['apple'] and list(plan['misses']) == ['apple']
+
+
+def test_sync_merge_skips_the_email(monkeypatch):
+    fake = FakeAWS(ITEMS)
+    use_fake(monkeypatch, fake)
+
+    plan = report_handler.handler({'step': 'plan', 'request': {'brand': 'apple'}, 'segments': 1}, None)
+    partials = [report_handler.handler(segment, None) for segment in plan['segments']]
+    result = report_handler.handler({'step': 'merge', 'plan': plan, 'partials': partials, 'notify': False}, None)
+
+    assert result['reports'][0]['brand'] == 'apple'
+    assert fake.messages == []
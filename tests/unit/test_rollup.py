@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+from brand_report import rollup_totals
+from rollup import apply_rollups, merge_rollups
+
+
+def item(brand, event_type, price, event_time='2019-11-01 00:12:44 UTC'):
+    return {'brand': brand, 'event_type': event_type, 'price': Decimal(price), 'event_time': event_time}
+
+
+class FakeTable:
+    def __init__(self):
+        self.updates = []
+
+    def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+class FakeClient:
+    def __init__(self, items):
+        self.items = items
+
+    def query(self, **kwargs):
+        return {'Items': self.items}
+
+
+def test_batch_is_merged_per_key():
+    rollups = merge_rollups([
+        item('apple', 'view', '1'),
+        item('apple', 'view', '1', '2019-11-01 00:59:59 UTC'),
+        item('apple', 'view', '1', '2019-11-01 01:00:00 UTC'),
+        item('apple', 'purchase', '10.25'),
+        {'event_type': 'view', 'price': Decimal(1), 'event_time': '2019-11-01 00:00:00 UTC'},
+    ])
+
+    assert rollups == {
+        ('apple', '2019-11-01T00#view'): [2, Decimal(2)],
+        ('apple', '2019-11-01T01#view'): [1, Decimal(1)],
+        ('apple', 'all#view'): [3, Decimal(3)],
+        ('apple', '2019-11-01T00#purchase'): [1, Decimal('10.25')],
+        ('apple', 'all#purchase'): [1, Decimal('10.25')],
+    }
+
+
+def test_one_atomic_add_per_key():
+    table = FakeTable()
+
+    apply_rollups(table, merge_rollups([item('apple', 'view', '1')] * 50))
+
+    assert len(table.updates) == 2
+    assert table.updates[0]['UpdateExpression'] == 'ADD event_count :count, price_sum :price, rollup_version :one'
+    assert table.updates[0]['ExpressionAttributeValues'][':count'] == 50
+
+
+def test_report_reads_all_time_rollups():
+    client = FakeClient([
+        {'bucket': {'S': 'all#view'}, 'event_count': {'N': '7'}, 'price_sum': {'N': '70'}},
+        {'bucket': {'S': 'all#purchase'}, 'event_count': {'N': '2'}, 'price_sum': {'N': '31.5'}},
+        {'bucket': {'S': 'all#cart'}, 'event_count': {'N': '1'}, 'price_sum': {'N': '5'}},
+    ])
+
+    assert rollup_totals(client, 'rollups', 'apple').report('apple') == {
+        'brand': 'apple', 'total_views': 7, 'total_purchases': 2, 'total_price': 31.5
+    }
@@ -0,0 +1,87 @@
+import csv
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from record_format import build_item
+from sessionizer import FUNNEL, Sessionizer, apply_funnels, merge_funnels
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'term_assignment', '2019-Nov-sample.csv')
+
+
+def load_items():
+    with open(SAMPLE, newline='') as f:
+        return [build_item(dict(row, txn_timestamp='2024-04-06T20:15:14')) for row in csv.DictReader(f)]
+
+
+def exact_funnels(items, timeout_seconds):
+    # Reference: every (session, brand) split at pauses over the timeout
+    sessions = defaultdict(list)
+    for item in items:
+        if item.get('brand'):
+            seconds = datetime.strptime(item['event_time'], '%Y-%m-%d %H:%M:%S UTC').timestamp()
+            sessions[(item['user_session'], item['brand'])].append((seconds, item['event_type']))
+
+    totals = defaultdict(lambda: [0] * 6)
+    for (_, brand), events in sessions.items():
+        runs = [[events[0]]]
+        for previous, event in zip(events, events[1:]):
+            if event[0] - previous[0] > timeout_seconds:
+                runs.append([])
+            runs[-1].append(event)
+        for run in runs:
+            stage = 0
+            for _, event_type in run:
+                if stage < len(FUNNEL) and event_type == FUNNEL[stage]:
+                    stage += 1
+            counts = [1, stage > 0, stage > 1, stage > 2, run[-1][0] - run[0][0], len(run)]
+            totals[brand] = [total + count for total, count in zip(totals[brand], counts)]
+    return dict(totals)
+
+
+def replay(sessionizer, items, batch_size=100):
+    closed = []
+    for start in range(0, len(items), batch_size):
+        closed.extend(sessionizer.observe_batch(items[start:start + batch_size]))
+        assert len(sessionizer) <= sessionizer.max_sessions
+    return closed + sessionizer.close_all()
+
+
+def all_time(funnels):
+    return {brand: counts for (brand, bucket), counts in funnels.items() if bucket == 'funnel#all'}
+
+
+def test_replay_matches_exact_funnels():
+    items = load_items()
+    sessionizer = Sessionizer(timeout_seconds=120)
+
+    funnels = merge_funnels(replay(sessionizer, items))
+
+    assert all_time(funnels) == exact_funnels(items, 120)
+    assert sessionizer.evicted == 0
+    assert any(counts[3] for counts in all_time(funnels).values())
+
+
+def test_memory_ceiling_evicts_but_counts_every_event():
+    items = load_items()
+    sessionizer = Sessionizer(timeout_seconds=1800, max_sessions=50)
+
+    funnels = all_time(merge_funnels(replay(sessionizer, items)))
+
+    assert sessionizer.evicted > 0
+    assert sum(counts[5] for counts in funnels.values()) == sum(1 for item in items if item.get('brand'))
+
+
+def test_funnels_are_added_atomically():
+    class Table:
+        def __init__(self):
+            self.updates = []
+
+        def update_item(self, **kwargs):
+            self.updates.append(kwargs)
+
+    table = Table()
+    assert apply_funnels(table, {('apple', 'funnel#all'): [2, 2, 1, 1, 30, 7]}) == []
+    assert table.updates[0]['Key'] == {'brand': 'apple', 'bucket': 'funnel#all'}
+    assert table.updates[0]['UpdateExpression'].startswith('ADD sessions :sessions, viewed :viewed')
+    assert table.updates[0]['ExpressionAttributeValues'][':session_events'] == 7
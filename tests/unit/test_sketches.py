@@ -0,0 +1,119 @@
+import csv
+import os
+from collections import Counter, defaultdict
+
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+from record_format import build_item
+from sketches import BrandSketch, build_sketches, load_brand_sketch, store_sketch
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'term_assignment', '2019-Nov-sample.csv')
+
+
+def load_items():
+    with open(SAMPLE, newline='') as f:
+        return [build_item(dict(row, txn_timestamp='2024-04-06T20:15:14')) for row in csv.DictReader(f)]
+
+
+def merged_by_brand(sketches):
+    brands = defaultdict(BrandSketch)
+    for (brand, _), sketch in sketches.items():
+        brands[brand].merge(sketch)
+    return brands
+
+
+def test_sketches_match_exact_counts_within_their_bounds():
+    items = load_items()
+    users, sessions, views = defaultdict(set), defaultdict(set), defaultdict(Counter)
+    for item in items:
+        if item.get('brand'):
+            users[item['brand']].add(item['user_id'])
+            sessions[item['brand']].add(item['user_session'])
+            if item['event_type'] == 'view':
+                views[item['brand']][item['product_id']] += 1
+
+    # Sketches of 100-event batches merged the way the stored days are
+    sketches = defaultdict(BrandSketch)
+    for start in range(0, len(items), 100):
+        for (brand, _), sketch in build_sketches(items[start:start + 100]).items():
+            sketches[brand].merge(BrandSketch.from_bytes(sketch.to_bytes()))
+
+    assert set(sketches) == set(users)
+    for brand, sketch in sketches.items():
+        summary = sketch.summary()
+        # 3 standard errors of 2.3%, at least one user
+        assert abs(summary['distinct_users'] - len(users[brand])) <= max(1, 0.07 * len(users[brand]))
+        assert abs(summary['distinct_sessions'] - len(sessions[brand])) <= max(1, 0.07 * len(sessions[brand]))
+
+        total_views = sum(views[brand].values())
+        for product in summary['top_products']:
+            exact = views[brand][product['product_id']]
+            assert exact <= product['views'] <= exact + 0.0053 * total_views + 1
+        if views[brand]:
+            assert summary['top_products'][0]['views'] == views[brand].most_common(1)[0][1]
+
+
+def test_merge_equals_a_single_pass():
+    items = [item for item in load_items() if item.get('brand') == 'samsung']
+    whole = merged_by_brand(build_sketches(items))['samsung']
+    halves = merged_by_brand(build_sketches(items[::2]))['samsung'].merge(
+        merged_by_brand(build_sketches(items[1::2]))['samsung'])
+
+    assert halves.users.registers == whole.users.registers
+    assert halves.products.counts == whole.products.counts
+    assert halves.summary() == whole.summary()
+
+
+class FakeTable:
+    # get_item/put_item with the version condition, and the low-level query
+    def __init__(self):
+        self.items = {}
+        self.conflicts = 0
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get((Key['brand'], Key['bucket']))
+        if item is None:
+            return {}
+        return {'Item': dict(item, sketch=Binary(item['sketch']))}
+
+    def put_item(self, Item, ExpressionAttributeValues, **kwargs):
+        stored = self.items.get((Item['brand'], Item['bucket']))
+        if self.conflicts or (stored and stored['sketch_version'] != ExpressionAttributeValues[':version']):
+            self.conflicts = max(0, self.conflicts - 1)
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[(Item['brand'], Item['bucket'])] = Item
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        brand = ExpressionAttributeValues[':brand']['S']
+        return {'Items': [{'sketch': {'B': item['sketch']}} for (item_brand, _), item in self.items.items()
+                          if item_brand == brand]}
+
+
+def test_stored_days_merge_at_report_time():
+    items = [item for item in load_items() if item.get('brand') == 'apple']
+    table = FakeTable()
+    table.conflicts = 1
+    for day, part in (('2019-11-01', items[:50]), ('2019-11-02', items[50:]), ('2019-11-02', items[50:])):
+        assert store_sketch(table, 'apple', day, merged_by_brand(build_sketches(part))['apple'])
+
+    assert table.items[('apple', 'sketch#2019-11-02')]['sketch_version'] == 2
+    summary = load_brand_sketch(table, 'rollups', 'apple').summary()
+    assert summary['distinct_users'] == merged_by_brand(build_sketches(items))['apple'].summary()['distinct_users']
+
+
+def test_conflicting_writes_retry_until_the_budget_runs_out():
+    sketch = merged_by_brand(build_sketches(item for item in load_items() if item.get('brand') == 'apple'))['apple']
+    table = FakeTable()
+    table.conflicts = 8
+    sleeps = []
+
+    assert store_sketch(table, 'apple', '2019-11-01', sketch, sleep=sleeps.append)
+    assert len(sleeps) == 8
+
+    table.conflicts = 100
+    checks = []
+    stored = store_sketch(table, 'apple', '2019-11-02', sketch,
+                          should_stop=lambda: checks.append(1) or len(checks) >= 3, sleep=sleeps.append)
+    assert not stored and len(checks) == 3
+    assert ('apple', 'sketch#2019-11-02') not in table.items
@@ -0,0 +1,207 @@
+import gzip
+import importlib.util
+import io
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+spec = importlib.util.spec_from_file_location(
+    'stream_simulator', os.path.join(ROOT, 'term_assignment', 'stream-data-app-simulation.py'))
+simulator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(simulator)
+
+
+class FakeKinesis:
+    def __init__(self, shards=4):
+        self.records = []
+        self.shards = shards
+
+    def describe_stream_summary(self, StreamName):
+        return {'StreamDescription': {'StreamName': StreamName, 'OpenShardCount': self.shards}}
+
+    def put_record(self, **request):
+        self.records.append(request)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+def row(user_id, category_id='1'):
+    return {'user_id': str(user_id), 'category_id': category_id, 'category_code': '',
+            'event_time': '2019-11-01 00:00:00 UTC'}
+
+
+def test_aggregated_drift_uses_earliest_scheduled_row(monkeypatch):
+    monkeypatch.setattr(simulator, 'record_format', 'aggregated')
+    monkeypatch.setattr(simulator, 'producer_mode', 'single')
+    monkeypatch.setattr(simulator, 'partition_strategy', 'composite')
+    monkeypatch.setattr(simulator, 'aggregate_max_events', 2)
+    monkeypatch.setattr(simulator, 'time', lambda: 100.0)
+    client = FakeKinesis()
+    drift = simulator.DriftStats()
+    sender = simulator.RecordSender(client, simulator.ProducerStats(), drift, buckets=1)
+
+    # The third row drains the first two; the last one is sent by flush
+    for user_id, scheduled in ((1, 90.0), (2, 95.0), (3, 99.0)):
+        sender.send_row(row(user_id), scheduled)
+    assert len(client.records) == 1
+    sender.flush()
+
+    assert len(client.records) == 2
+    assert sorted(drift.sample) == [1.0, 10.0]
+
+
+def test_composite_buckets_default_to_the_open_shard_count(monkeypatch):
+    monkeypatch.setattr(simulator, 'partition_buckets', 0)
+
+    assert simulator.partition_bucket_count(FakeKinesis(shards=6), 'events') == 6
+    with pytest.raises(ValueError):
+        simulator.partition_route(row(1), 'composite')
+    routes = {simulator.partition_route(row(user_id), 'composite', 6)[1] for user_id in range(200)}
+    assert len(routes) == 6
+
+
+def test_aggregating_user_keyed_rows_is_rejected():
+    with pytest.raises(ValueError):
+        simulator.check_settings('user', 'aggregated')
+    simulator.check_settings('user', 'json')
+    simulator.check_settings('composite', 'aggregated')
+
+
+def test_aggregated_records_keep_one_category(monkeypatch):
+    monkeypatch.setattr(simulator, 'record_format', 'aggregated')
+    monkeypatch.setattr(simulator, 'producer_mode', 'single')
+    monkeypatch.setattr(simulator, 'partition_strategy', 'category')
+    client = FakeKinesis()
+    sender = simulator.RecordSender(client, simulator.ProducerStats())
+
+    for user_id, category_id in ((1, '1'), (2, '2'), (3, '1')):
+        sender.send_row(row(user_id, category_id))
+    sender.flush()
+
+    assert sorted((request['PartitionKey'], len(gzip.decompress(request['Data']).split(b'\n')))
+                  for request in client.records) == [('1', 2), ('2', 1)]
+
+
+class FakePutRecords:
+    # Fails the entries whose data is listed in `failing` on their first try
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def put_records(self, StreamName, Records):
+        self.calls.append([record['Data'] for record in Records])
+        results = []
+        for record in Records:
+            if record['Data'] in self.failing:
+                self.failing.discard(record['Data'])
+                results.append({'ErrorCode': 'ProvisionedThroughputExceededException'})
+            else:
+                results.append({'SequenceNumber': '1', 'ShardId': 'shardId-000000000000'})
+        return {'FailedRecordCount': sum('ErrorCode' in result for result in results), 'Records': results}
+
+
+def test_batch_producer_resends_only_failed_entries(monkeypatch):
+    monkeypatch.setattr(simulator, 'sleep', lambda seconds: None)
+    client = FakePutRecords(failing={b'b', b'd'})
+    stats = simulator.ProducerStats()
+    producer = simulator.BatchProducer(client, 'events', stats)
+
+    for data in (b'a', b'b', b'c', b'd'):
+        producer.add(data, 'key')
+    producer.flush()
+
+    assert client.calls == [[b'a', b'b', b'c', b'd'], [b'b', b'd']]
+    assert (stats.sent, stats.retried, stats.failed, stats.calls) == (4, 2, 0, 2)
+
+
+def test_batch_producer_splits_at_500_records_and_5_mb():
+    client = FakePutRecords()
+    producer = simulator.BatchProducer(client, 'events', simulator.ProducerStats())
+
+    for index in range(1001):
+        producer.add(b'x', str(index))
+    producer.flush()
+    assert [len(call) for call in client.calls] == [500, 500, 1]
+
+    client.calls.clear()
+    big = b'x' * (1024 * 1024 - 10)
+    for index in range(6):
+        producer.add(big, 'key')
+    producer.flush()
+    # Five records of just under 1 MB fill the 5 MB request limit
+    assert [len(call) for call in client.calls] == [5, 1]
+
+
+class FakeS3:
+    def __init__(self, body):
+        self.body = body
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range is None:
+            return {'Body': io.BytesIO(self.body)}
+        start, end = map(int, Range[len('bytes='):].split('-'))
+        self.ranges.append((start, end))
+        return {'Body': io.BytesIO(self.body[start:end + 1])}
+
+
+def test_range_reads_rejoin_lines_cut_at_a_boundary(monkeypatch):
+    body = b'header\nfirst line\nsecond line\nlast'
+    s3 = FakeS3(body)
+    monkeypatch.setattr(simulator, 's3', s3)
+    monkeypatch.setattr(simulator, 'range_chunk_bytes', 10)
+    monkeypatch.setattr(simulator, 'read_parallelism', 2)
+
+    lines = list(simulator.iter_range_lines('bucket', 'key', len(body)))
+
+    # 'first line' spans the first two ranges, 'second line' the next ones
+    assert lines == ['header\n', 'first line\n', 'second line\n', 'last']
+    assert s3.ranges == [(0, 9), (10, 19), (20, 29), (30, 33)]
+
+
+def test_gzip_objects_are_decompressed_while_streaming():
+    body = gzip.compress(b'header\nrow 1\nrow 2\n')
+
+    lines = list(simulator.iter_body_lines({'Body': io.BytesIO(body)}, 'events.csv.gz'))
+
+    assert lines == ['header\n', 'row 1\n', 'row 2\n']
+
+
+def test_rate_limiter_paces_events(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(simulator, 'monotonic', lambda: clock[0])
+    limiter = simulator.RateLimiter(4)
+
+    def send(count):
+        # Waits like the simulator does and returns the waits
+        delays = []
+        for _ in range(count):
+            delays.append(limiter.delay())
+            clock[0] += delays[-1]
+            limiter.acquire()
+        return delays
+
+    assert send(4) == [0.0, 0.25, 0.25, 0.25]
+
+    # After a pause at most one second of events goes out in a burst
+    clock[0] += 10
+    assert send(6) == [0.0, 0.0, 0.0, 0.0, 0.0, 0.25]
+    assert simulator.RateLimiter(None).delay() == 0.0
+
+
+def test_drift_stats_merge_keeps_totals_and_a_bounded_sample(monkeypatch):
+    monkeypatch.setattr(simulator, 'DRIFT_SAMPLE_SIZE', 10)
+    first, second = simulator.DriftStats(), simulator.DriftStats()
+    for index in range(30):
+        first.add(0.1)
+    for index in range(10):
+        second.add(1.0)
+
+    first.merge(second)
+
+    assert first.count == 40
+    assert round(first.total, 6) == 13.0
+    assert first.max == 1.0
+    assert len(first.sample) == 10
+    assert sorted(first.sample).count(1.0) == 2
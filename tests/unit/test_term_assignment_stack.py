@@ -1,3 +1,5 @@
+import json
+import pytest
 import aws_cdk as core
 import aws_cdk.assertions as assertions
 
@@ -13,3 +15,148 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+@pytest.fixture(scope="module")
+def template():
+    app = core.App()
+    stack = TermAssignmentStack(app, "term-assignment")
+    return assertions.Template.from_stack(stack)
+
+
+@pytest.fixture(scope="module")
+def brand_partitioned_template():
+    app = core.App()
+    stack = TermAssignmentStack(app, "term-assignment", partition_by_brand=True)
+    return assertions.Template.from_stack(stack)
+
+
+def test_firehose_writes_time_partitions(template):
+    template.has_resource_properties("AWS::KinesisFirehose::DeliveryStream", {
+        "ExtendedS3DestinationConfiguration": assertions.Match.object_like({
+            "Prefix": "processed-data/dt=!{partitionKeyFromLambda:dt}/hour=!{partitionKeyFromLambda:hour}/",
+            "ErrorOutputPrefix": "error-data/!{firehose:error-output-type}/",
+            "DynamicPartitioningConfiguration": assertions.Match.object_like({"Enabled": True})
+        })
+    })
+
+
+def test_glue_table_uses_partition_projection(template):
+    template.has_resource_properties("AWS::Glue::Table", {
+        "TableInput": assertions.Match.object_like({
+            "PartitionKeys": [
+                {"Name": "dt", "Type": "string"},
+                {"Name": "hour", "Type": "string"}
+            ],
+            "Parameters": assertions.Match.object_like({
+                "projection.enabled": "true",
+                "projection.dt.type": "date",
+                "projection.hour.type": "integer",
+                "projection.hour.digits": "2"
+            })
+        })
+    })
+
+
+def test_brand_partitions_are_optional(brand_partitioned_template):
+    brand_partitioned_template.has_resource_properties("AWS::KinesisFirehose::DeliveryStream", {
+        "ExtendedS3DestinationConfiguration": assertions.Match.object_like({
+            "Prefix": "processed-data/dt=!{partitionKeyFromLambda:dt}/hour=!{partitionKeyFromLambda:hour}/"
+                      "brand=!{partitionKeyFromLambda:brand}/"
+        })
+    })
+    brand_partitioned_template.has_resource_properties("AWS::Glue::Table", {
+        "TableInput": assertions.Match.object_like({
+            "PartitionKeys": assertions.Match.array_with([{"Name": "brand_key", "Type": "string"}]),
+            "Parameters": assertions.Match.object_like({"projection.brand_key.type": "injected"})
+        })
+    })
+
+
+def test_compaction_runs_hourly(template):
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "compaction_handler.handler",
+        "Timeout": 900
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "rate(1 hour)"
+    })
+
+
+def test_stream_consumer_reads_kinesis_with_failure_handling(template):
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 500,
+        "MaximumBatchingWindowInSeconds": 5,
+        "ParallelizationFactor": 4,
+        "BisectBatchOnFunctionError": True,
+        "MaximumRetryAttempts": 5,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        "StartingPosition": "LATEST",
+        "DestinationConfig": {
+            "OnFailure": {"Destination": assertions.Match.any_value()}
+        }
+    })
+    template.resource_count_is("AWS::SQS::Queue", 1)
+
+
+def test_firehose_transform_is_format_only(template):
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "processor.lambda_handler",
+        "Environment": {"Variables": {"LOG_SAMPLE_RATE": "0.01"}}
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "consumer.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "TABLE_NAME": assertions.Match.any_value(),
+            "ROLLUP_TABLE_NAME": assertions.Match.any_value()
+        })}
+    })
+
+
+def test_brand_reports_fan_out_over_scan_segments(template):
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "report_handler.handler"
+    })
+    definition = json.dumps(template.find_resources("AWS::StepFunctions::StateMachine"))
+    assert '\\"Type\\":\\"Map\\"' in definition
+    assert '\\"Type\\":\\"Choice\\"' not in definition
+    assert 'ScanSegments' in definition and 'MergeReport' in definition
+
+
+def test_report_objects_expire(template):
+    template.has_resource_properties("AWS::S3::Bucket", {
+        "LifecycleConfiguration": {"Rules": [
+            assertions.Match.object_like({"Prefix": "reports/", "ExpirationInDays": 30, "Status": "Enabled"})
+        ]}
+    })
+
+
+def test_reports_have_async_and_sync_endpoints(template):
+    template.resource_count_is("AWS::StepFunctions::StateMachine", 2)
+    template.has_resource_properties("AWS::StepFunctions::StateMachine", {"StateMachineType": "EXPRESS"})
+    methods = json.dumps(template.find_resources("AWS::ApiGateway::Method"))
+    assert ":states:action/StartExecution" in methods
+    assert ":states:action/StartSyncExecution" in methods
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "ExecutionTime", "ExtendedStatistic": "p99", "Threshold": 3000
+    })
+
+
+def test_events_are_stored_compact_and_expire(template):
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "KeySchema": [{"AttributeName": "u", "KeyType": "HASH"}, {"AttributeName": "t", "KeyType": "RANGE"}],
+        "AttributeDefinitions": assertions.Match.array_with([{"AttributeName": "t", "AttributeType": "N"}]),
+        "TimeToLiveSpecification": {"AttributeName": "x", "Enabled": True}
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "consumer.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({"EVENT_TTL_SECONDS": "604800"})}
+    })
+
+
+def test_producer_partitions_by_user(template):
+    # The consumer's DDoS window and sessions are kept per container
+    instance = next(iter(template.find_resources("AWS::EC2::Instance").values()))
+    user_data = json.dumps(instance["Properties"]["UserData"])
+
+    assert 'export PARTITION_STRATEGY=\\"user\\"' in user_data